@@ -0,0 +1,96 @@
+"""Benchmark /game-server-states/ serialization paths.
+
+Runs the newest states query of DATABASE_URL through the old ORM
+path (load_only entities, async_to_dict, jsonable_encoder) and the
+Core path used by the API (explicit columns, Row._asdict, orjson)
+and reports the time spent fetching and rendering each.
+
+    python bench_api.py [limit] [repeat]
+"""
+
+import asyncio
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import load_only
+
+from spoofspy import db
+from spoofspy.api import api
+
+
+async def orm_path(sess, limit: int) -> tuple[float, float, int]:
+    gss = db.models.GameServerState
+    stmt = select(
+        gss,
+        db.models.GameServer.address,
+        db.models.GameServer.port,
+    ).join(
+        gss.game_server,
+    ).options(
+        load_only(*(getattr(gss, c) for c in api.STATE_COLUMNS[1:])),
+    ).order_by(
+        gss.time.desc(),
+    ).limit(limit)
+
+    start = time.perf_counter()
+    states = []
+    for row in await sess.execute(stmt):
+        d = await row[0].async_to_dict(ignore_unloaded=True)
+        d["game_server_address"] = row[1]
+        d["game_server_port"] = row[2]
+        states.append(d)
+    fetched = time.perf_counter()
+    body = ORJSONResponse(jsonable_encoder(states)).body
+    rendered = time.perf_counter()
+    return fetched - start, rendered - fetched, len(body)
+
+
+async def core_path(sess, limit: int) -> tuple[float, float, int]:
+    gss = db.models.GameServerState
+    stmt = api._with_sockaddr(
+        select(*(getattr(gss, c) for c in api.STATE_COLUMNS)),
+        gss.game_server_id,
+    ).order_by(
+        gss.time.desc(),
+    ).limit(limit)
+
+    start = time.perf_counter()
+    states = await api._rows(sess, stmt)
+    fetched = time.perf_counter()
+    body = api.RowsResponse(states).body
+    rendered = time.perf_counter()
+    return fetched - start, rendered - fetched, len(body)
+
+
+async def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    session = async_sessionmaker(await db.async_engine())
+    results = {}
+    for name, path in (("orm", orm_path), ("core", core_path)):
+        fetch_total = render_total = 0.0
+        size = 0
+        # First run warms up connections and statement caches.
+        for i in range(repeat + 1):
+            # New session per request, like the API.
+            async with session() as sess:
+                fetch, render, size = await path(sess, limit)
+            if i:
+                fetch_total += fetch
+                render_total += render
+        results[name] = (fetch_total + render_total) / repeat
+        print(f"{name}: fetch {fetch_total / repeat * 1000:.2f} ms, "
+              f"render {render_total / repeat * 1000:.2f} ms, "
+              f"{size} bytes")
+
+    print(f"core speedup: {results['orm'] / results['core']:.2f}x")
+    await db.async_close_database()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""Benchmark roster clustering on synthetic rosters.
+
+Plants farms of servers sharing most of a fake player roster among
+servers with random rosters and compares LSH clustering with brute
+force pairwise Jaccard similarity.
+
+    python bench_roster.py [num_servers] [farm_size]
+"""
+
+import itertools
+import random
+import sys
+import time
+
+from spoofspy.heuristics import roster
+
+NUM_NAMES = 1_000_000
+ROSTER_MIN = 4
+ROSTER_MAX = 64
+# Fraction of a farm roster replaced per server.
+FARM_NOISE = 0.1
+
+
+def make_rosters(
+        num_servers: int,
+        farm_size: int,
+        rng: random.Random,
+) -> tuple[list[set[int]], set[frozenset[int]]]:
+    rosters: list[set[int]] = []
+    farms: set[frozenset[int]] = set()
+
+    num_farm_servers = num_servers // 10
+    while len(rosters) + farm_size <= num_farm_servers:
+        base = rng.sample(range(NUM_NAMES), rng.randint(16, ROSTER_MAX))
+        farm = []
+        for _ in range(farm_size):
+            r = set(base)
+            for name in rng.sample(base, int(len(base) * FARM_NOISE)):
+                r.discard(name)
+                r.add(rng.randrange(NUM_NAMES))
+            farm.append(len(rosters))
+            rosters.append(r)
+        farms.add(frozenset(farm))
+
+    while len(rosters) < num_servers:
+        rosters.append(set(rng.sample(
+            range(NUM_NAMES), rng.randint(ROSTER_MIN, ROSTER_MAX))))
+
+    return rosters, farms
+
+
+def brute_force(rosters: list[set[int]]) -> set[frozenset[int]]:
+    pairs = []
+    for i, j in itertools.combinations(range(len(rosters)), 2):
+        a, b = rosters[i], rosters[j]
+        if len(a & b) / len(a | b) >= roster.JACCARD_THRESHOLD:
+            pairs.append((i, j))
+
+    clusters: dict[int, set[int]] = {}
+    for i, j in pairs:
+        c = clusters.get(i, {i}) | clusters.get(j, {j})
+        for k in c:
+            clusters[k] = c
+    return {frozenset(c) for c in clusters.values()}
+
+
+def pair_set(clusters) -> set[tuple[int, int]]:
+    return {
+        pair
+        for c in clusters
+        for pair in itertools.combinations(sorted(c), 2)
+    }
+
+
+def main():
+    num_servers = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    farm_size = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    rng = random.Random(1)
+    rosters, farms = make_rosters(num_servers, farm_size, rng)
+    print(f"{num_servers} servers, {len(farms)} farms of {farm_size}")
+
+    start = time.perf_counter()
+    clusters = roster.cluster(list(range(len(rosters))), rosters)
+    lsh_time = time.perf_counter() - start
+
+    found = pair_set(clusters)
+    planted = pair_set(farms)
+    tp = len(found & planted)
+    precision = tp / len(found) if found else 1.0
+    recall = tp / len(planted) if planted else 1.0
+    print(f"lsh: {lsh_time:.3f} s, {len(clusters)} clusters, "
+          f"precision {precision:.3f}, recall {recall:.3f}")
+
+    if num_servers > 10_000:
+        print("skipping brute force")
+        return
+
+    start = time.perf_counter()
+    exact = brute_force(rosters)
+    bf_time = time.perf_counter() - start
+    exact_pairs = pair_set(exact)
+    tp = len(found & exact_pairs)
+    recall = tp / len(exact_pairs) if exact_pairs else 1.0
+    print(f"brute force: {bf_time:.3f} s, {len(exact)} clusters, "
+          f"lsh recall vs. exact {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Check that in-database trust scores equal eval_trust_score.
+
+Scores the newest states of DATABASE_URL with both
+`scoring.score` and the spoofspy_trust_score SQL function without
+writing anything, and reports states whose scores differ.
+
+    python check_sql_scoring.py [hours] [max_states]
+"""
+
+import datetime
+import sys
+
+from sqlalchemy.orm import sessionmaker
+
+from spoofspy import db
+from spoofspy.heuristics import trust
+from spoofspy.jobs import scoring
+
+TOLERANCE = 1e-9
+
+
+def main() -> int:
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24.0
+    max_states = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+
+    session = sessionmaker(db.engine())
+    trust.rules.maybe_refresh(session)
+    trust.reputation_index.maybe_refresh(session)
+
+    range_end = datetime.datetime.now(tz=datetime.timezone.utc)
+    range_start = range_end - datetime.timedelta(hours=hours)
+
+    # Not committed, the functions only exist for the check.
+    with session() as sess:
+        gss = db.models.GameServerState
+        batch = scoring.to_batch(sess.execute(
+            scoring.input_stmt(
+                (gss.time >= range_start)
+                & (gss.time < range_end)
+                & gss.a2s_info_responded.is_not(None)
+                & gss.a2s_rules_responded.is_not(None)
+                & gss.a2s_players_responded.is_not(None)
+            ).order_by(
+                gss.time,
+                gss.game_server_id,
+            ).limit(max_states)
+        ).all())
+        expected = {
+            (p["u_time"], p["u_game_server_id"]): p["trust_score"]
+            for p in scoring.score(batch)
+        }
+
+        scoring.create_sql_functions(sess)
+        actual = {
+            (row.time, row.game_server_id): row.trust_score
+            for row in sess.execute(
+                db.queries.score_in_database,
+                {
+                    "range_start": range_start,
+                    "range_end": range_end,
+                    "last_time": None,
+                    "last_game_server_id": None,
+                    "batch_size": max_states,
+                    **scoring.sql_params(),
+                },
+            )
+        }
+
+    mismatches = 0
+    for key, score in expected.items():
+        sql_score = actual.get(key)
+        if sql_score is None or abs(sql_score - score) > TOLERANCE:
+            mismatches += 1
+            if mismatches <= 20:
+                print(f"mismatch {key}: python={score} sql={sql_score}")
+
+    missing = len(actual.keys() - expected.keys())
+    print(f"{len(expected)} states, {mismatches} mismatches, "
+          f"{missing} only scored in SQL")
+    return 1 if (mismatches or missing) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
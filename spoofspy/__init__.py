@@ -1,15 +1,21 @@
 from . import api
+from . import archive
 from . import db
 from . import heuristics
 from . import jobs
+from . import metrics
+from . import rowcache
 from . import utils
 from . import web
 
 __all__ = [
     "api",
+    "archive",
     "db",
     "heuristics",
     "jobs",
+    "metrics",
+    "rowcache",
     "utils",
     "web",
 ]
@@ -1,9 +1,13 @@
+import asyncio
 import logging
 import os
+from collections import defaultdict
 from ipaddress import IPv4Address
 from typing import Annotated
+from typing import Any
 from typing import Tuple
 
+import orjson
 from fastapi import FastAPI
 from fastapi import HTTPException
 from fastapi import Query
@@ -12,13 +16,15 @@ from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
 from fastapi_cache.decorator import cache
 from redis import asyncio as redis
+from sqlalchemy import Select
 from sqlalchemy import select
+from sqlalchemy import tuple_
 from sqlalchemy.ext.asyncio import async_sessionmaker
-from sqlalchemy.orm import load_only
 from starlette.responses import PlainTextResponse
 
 from spoofspy import db
 from spoofspy import coding
+from spoofspy import rowcache
 
 logger = logging.getLogger(__name__)
 
@@ -27,12 +33,65 @@ app = FastAPI(
 )
 
 AsyncSession: async_sessionmaker
+RowCache: rowcache.RowCache
+_row_cache_listener: asyncio.Task | None = None
+
+# GameServerState columns returned by /game-server-states/.
+STATE_COLUMNS = (
+    "time",
+    "steamid",
+    "name",
+    "appid",
+    "gamedir",
+    "version",
+    "players",
+    "max_players",
+    "bots",
+    "map",
+    "secure",
+    "a2s_info_responded",
+    "a2s_player_count",
+    "a2s_max_players",
+    "a2s_rules_responded",
+    "a2s_num_open_public_connections",
+    "a2s_num_public_connections",
+    "a2s_pi_count",
+    "a2s_pi_names",
+    "a2s_pi_platforms",
+    "a2s_pi_scores",
+    "a2s_pi_steam_count",
+    "a2s_pi_eos_count",
+    "a2s_players_responded",
+    "a2s_player_name_ids",
+    "a2s_player_scores",
+    "a2s_player_durations",
+    "trust_score",
+    "trust_penalties",
+    "game_server_id",
+    "static_since",
+)
+
+
+def _orjson_default(obj: Any) -> Any:
+    if isinstance(obj, IPv4Address):
+        return str(obj)
+    raise TypeError
+
+
+class RowsResponse(ORJSONResponse):
+    """Serializes row dicts with orjson directly,
+    without FastAPI's jsonable_encoder pass.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_orjson_default,
+            option=orjson.OPT_NON_STR_KEYS,
+        )
 
 
-# TODO: better, row based caching.
 # TODO: use middleware to ignore Cache-Control?
-# TODO: don't access database directly from endpoints,
-#   use another layer that handles caching more intelligently.
 
 @app.get("/")
 async def root():
@@ -40,13 +99,71 @@ async def root():
 
 
 @app.get("/game-servers/")
-@cache(expire=600)
 async def game_servers(
         address: Annotated[list[IPv4Address] | None, Query()] = None,
         port: Annotated[list[int] | None, Query()] = None,
         query_port: Annotated[list[int] | None, Query()] = None,
 ):
-    stmt = select(db.models.GameServer)
+    if not address:
+        stmt = select(db.models.GameServer.address).distinct()
+        if port:
+            stmt = stmt.where(
+                db.models.GameServer.port.in_(port),
+            )
+        if query_port:
+            stmt = stmt.where(
+                db.models.GameServer.query_port.in_(query_port),
+            )
+        address = await _addresses(stmt)
+
+    servers = await _cached_rows(
+        rowcache.GAME_SERVER, address, _load_game_servers)
+    return RowsResponse([
+        server for server in servers
+        if (not port or server["port"] in port)
+        and (not query_port or server["query_port"] in query_port)
+    ])
+
+
+@app.get("/game-servers/{sockaddr}/")
+async def game_servers_sockaddr(sockaddr: str):
+    addr, port = _parse_sockaddr(sockaddr)
+
+    servers = [
+        server for server in await _cached_rows(
+            rowcache.GAME_SERVER, [addr], _load_game_servers)
+        if server["port"] == port
+    ]
+    if not servers:
+        raise HTTPException(status_code=404)
+    return RowsResponse(servers)
+
+
+# TODO: @app.get("/game-servers/{sockaddr}/states/")
+
+
+@app.get("/game-server-states/")
+async def game_server_states(
+        address: Annotated[list[IPv4Address] | None, Query()] = None,
+        port: Annotated[list[int] | None, Query()] = None,
+        limit: int = 1000,
+):
+    if limit > 1000:
+        limit = 1000
+    elif limit <= 0:
+        limit = 1000
+
+    # Only the primary keys of the newest states are read from
+    # the database, the states are served from the row cache.
+    stmt = select(
+        db.models.GameServerState.game_server_id,
+        db.models.GameServerState.time,
+    ).join(
+        db.models.GameServer,
+        db.models.GameServer.id == db.models.GameServerState.game_server_id,
+    ).order_by(
+        db.models.GameServerState.time.desc(),
+    ).limit(limit)
 
     if address:
         stmt = stmt.where(
@@ -56,44 +173,44 @@ async def game_servers(
         stmt = stmt.where(
             db.models.GameServer.port.in_(port),
         )
-    if query_port:
-        stmt = stmt.where(
-            db.models.GameServer.query_port.in_(query_port),
-        )
 
     async with AsyncSession() as sess:
-        return [
-            await x.async_to_dict(ignore_unloaded=True)
-            for x in await sess.scalars(stmt)
-        ]
-
-
-@app.get("/game-servers/{sockaddr}/")
-@cache(expire=600)
-async def game_servers_sockaddr(sockaddr: str):
-    addr, port = _parse_sockaddr(sockaddr)
+        keys = (await sess.execute(stmt)).tuples().all()
 
-    stmt = select(db.models.GameServer).where(
-        (db.models.GameServer.address == addr)
-        & (db.models.GameServer.port == port)
-    )
+    return RowsResponse(await _cached_rows(
+        rowcache.GAME_SERVER_STATE,
+        [rowcache.state_id(server_id, time) for server_id, time in keys],
+        _load_states,
+    ))
 
-    async with AsyncSession() as sess:
-        scalars = list(await sess.scalars(stmt))
-        if not scalars:
-            raise HTTPException(status_code=404)
-        return [
-            await x.async_to_dict(ignore_unloaded=True)
-            for x in scalars
-        ]
 
+@app.get("/game-servers-latest/")
+async def game_servers_latest(
+        address: Annotated[list[IPv4Address] | None, Query()] = None,
+        port: Annotated[list[int] | None, Query()] = None,
+):
+    if not address:
+        stmt = select(db.models.GameServer.address).distinct().join(
+            db.models.GameServerLatest,
+            db.models.GameServerLatest.game_server_id == db.models.GameServer.id,
+        )
+        if port:
+            stmt = stmt.where(
+                db.models.GameServer.port.in_(port),
+            )
+        address = await _addresses(stmt)
 
-# TODO: @app.get("/game-servers/{sockaddr}/states/")
+    latest = await _cached_rows(
+        rowcache.GAME_SERVER_LATEST, address, _load_latest)
+    return RowsResponse([
+        state for state in latest
+        if not port or state["game_server_port"] in port
+    ])
 
 
-@app.get("/game-server-states/")
-@cache(expire=600, coder=coding.ZstdMsgPackCoder)
-async def game_server_states(
+@app.get("/player-count-anomalies/")
+@cache(expire=60)
+async def player_count_anomalies(
         address: Annotated[list[IPv4Address] | None, Query()] = None,
         port: Annotated[list[int] | None, Query()] = None,
         limit: int = 1000,
@@ -103,65 +220,38 @@ async def game_server_states(
     elif limit <= 0:
         limit = 1000
 
-    stmt = select(db.models.GameServerState).options(
-        load_only(
-            db.models.GameServerState.game_server_address,
-            db.models.GameServerState.game_server_port,
-            db.models.GameServerState.steamid,
-            db.models.GameServerState.name,
-            db.models.GameServerState.appid,
-            db.models.GameServerState.gamedir,
-            db.models.GameServerState.version,
-            db.models.GameServerState.players,
-            db.models.GameServerState.max_players,
-            db.models.GameServerState.bots,
-            db.models.GameServerState.map,
-            db.models.GameServerState.secure,
-            db.models.GameServerState.a2s_info_responded,
-            db.models.GameServerState.a2s_player_count,
-            db.models.GameServerState.a2s_max_players,
-            db.models.GameServerState.a2s_rules_responded,
-            db.models.GameServerState.a2s_num_open_public_connections,
-            db.models.GameServerState.a2s_num_public_connections,
-            db.models.GameServerState.a2s_pi_count,
-            db.models.GameServerState.a2s_pi_objects,
-            db.models.GameServerState.a2s_players_responded,
-            db.models.GameServerState.a2s_players,
-            db.models.GameServerState.trust_score,
-        )
+    stmt = _with_sockaddr(
+        select(db.models.PlayerCountAnomaly.__table__),
+        db.models.PlayerCountAnomaly.game_server_id,
+    ).order_by(
+        db.models.PlayerCountAnomaly.time.desc(),
     ).limit(limit)
 
     if address:
         stmt = stmt.where(
-            db.models.GameServerState.game_server_address.in_(address),
+            db.models.GameServer.address.in_(address),
         )
     if port:
         stmt = stmt.where(
-            db.models.GameServerState.game_server_port.in_(port),
+            db.models.GameServer.port.in_(port),
         )
 
     async with AsyncSession() as sess:
-        return [
-            await x.async_to_dict(
-                ignore_unloaded=True,
-            )
-            for x in await sess.scalars(stmt)
-        ]
+        return await _rows(sess, stmt)
 
 
 @app.get("/query-settings/")
 async def query_settings():
-    stmt = select(db.models.QuerySettings)
+    stmt = select(db.models.QuerySettings.__table__)
     async with AsyncSession() as sess:
-        return [
-            await x.async_to_dict(ignore_unloaded=True)
-            for x in await sess.scalars(stmt)
-        ]
+        return RowsResponse(await _rows(sess, stmt))
 
 
 @app.on_event("startup")
 async def on_startup():
     global AsyncSession
+    global RowCache
+    global _row_cache_listener
 
     logging.basicConfig()
 
@@ -172,12 +262,164 @@ async def on_startup():
                       prefix="fastapi-cache",
                       coder=coding.MsgPackCoder)
 
+    RowCache = rowcache.RowCache(r)
+    _row_cache_listener = asyncio.create_task(RowCache.listen())
+
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    if _row_cache_listener is not None:
+        _row_cache_listener.cancel()
     await db.async_close_database()
 
 
+async def _addresses(stmt) -> list[IPv4Address]:
+    """Addresses to look up in the row cache for unfiltered requests.
+    Only the addresses are read from the database.
+    """
+    async with AsyncSession() as sess:
+        return list(await sess.scalars(stmt))
+
+
+async def _cached_rows(
+        table: str,
+        addresses: list[IPv4Address] | list[str],
+        load: rowcache.Loader,
+) -> list[dict]:
+    """Rows of addresses, or state IDs, from the row
+    cache, in address order.
+    """
+    addrs = [str(addr) for addr in addresses]
+    rows = await RowCache.get_many(table, addrs, load)
+    return [
+        row
+        for addr in dict.fromkeys(addrs)
+        for row in rows[addr]
+    ]
+
+
+async def _load_game_servers(addresses: list[str]) -> dict[str, list[dict]]:
+    stmt = select(db.models.GameServer.__table__).where(
+        db.models.GameServer.address.in_(addresses),
+    )
+    servers = defaultdict(list)
+    async with AsyncSession() as sess:
+        for server in await _rows(sess, stmt):
+            servers[str(server["address"])].append(server)
+    return servers
+
+
+async def _load_latest(addresses: list[str]) -> dict[str, list[dict]]:
+    stmt = _with_sockaddr(
+        select(db.models.GameServerLatest.__table__),
+        db.models.GameServerLatest.game_server_id,
+    ).where(
+        db.models.GameServer.address.in_(addresses),
+    )
+    latest = defaultdict(list)
+    async with AsyncSession() as sess:
+        for state in await _rows(sess, stmt):
+            latest[str(state["game_server_address"])].append(state)
+    return latest
+
+
+async def _load_states(state_ids: list[str]) -> dict[str, list[dict]]:
+    stmt = _with_sockaddr(
+        select(
+            *(getattr(db.models.GameServerState, c) for c in STATE_COLUMNS),
+        ),
+        db.models.GameServerState.game_server_id,
+    ).where(
+        tuple_(
+            db.models.GameServerState.game_server_id,
+            db.models.GameServerState.time,
+        ).in_([rowcache.parse_state_id(sid) for sid in state_ids]),
+    )
+    async with AsyncSession() as sess:
+        states = await _rows(sess, stmt)
+        await _resolve_player_names(sess, states)
+        await _resolve_static_columns(sess, states)
+    return {
+        rowcache.state_id(state["game_server_id"], state["time"]): [state]
+        for state in states
+    }
+
+
+def _with_sockaddr(stmt: Select, game_server_id) -> Select:
+    """Join GameServer on game_server_id and add
+    game_server_address and game_server_port columns.
+    """
+    return stmt.add_columns(
+        db.models.GameServer.address.label("game_server_address"),
+        db.models.GameServer.port.label("game_server_port"),
+    ).join(
+        db.models.GameServer,
+        db.models.GameServer.id == game_server_id,
+    )
+
+
+async def _rows(sess, stmt: Select) -> list[dict]:
+    """Core select results as dicts, without ORM objects."""
+    return [row._asdict() for row in await sess.execute(stmt)]
+
+
+async def _resolve_static_columns(sess, states: list[dict]):
+    """Fill static columns of unchanged states from
+    the full states they reference.
+    """
+    refs = {
+        (state["game_server_id"], state["static_since"])
+        for state in states
+        if state.get("static_since") not in (None, state["time"])
+    }
+    if not refs:
+        return
+
+    columns = db.latest.STATIC_COLUMNS
+    stmt = select(
+        db.models.GameServerState.game_server_id,
+        db.models.GameServerState.time,
+        *(getattr(db.models.GameServerState, c) for c in columns),
+    ).where(
+        tuple_(
+            db.models.GameServerState.game_server_id,
+            db.models.GameServerState.time,
+        ).in_(refs),
+    )
+    full = {
+        (row[0], row[1]): dict(zip(columns, row[2:]))
+        for row in await sess.execute(stmt)
+    }
+    for state in states:
+        ref = (state["game_server_id"], state.get("static_since"))
+        if ref in full:
+            state.update(full[ref])
+
+
+async def _resolve_player_names(sess, states: list[dict]):
+    """Add a2s_player_names resolved from a2s_player_name_ids."""
+    name_ids = {
+        name_id
+        for state in states
+        for name_id in (state.get("a2s_player_name_ids") or [])
+    }
+    names = {}
+    if name_ids:
+        names = dict((await sess.execute(
+            select(
+                db.models.PlayerName.id,
+                db.models.PlayerName.name,
+            ).where(
+                db.models.PlayerName.id.in_(name_ids),
+            )
+        )).all())
+    for state in states:
+        state["a2s_player_names"] = [
+            names.get(name_id)
+            for name_id in (state.get("a2s_player_name_ids") or [])
+        ]
+
+
 def _parse_sockaddr(sockaddr: str) -> Tuple[IPv4Address, int]:
     try:
         parts = sockaddr.split(":")
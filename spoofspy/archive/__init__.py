@@ -0,0 +1,17 @@
+from .archive import ARCHIVE_AFTER
+from .archive import archive_chunk
+from .archive import archive_chunks
+from .archive import archive_dir
+from .archive import chunk_path
+from .archive import eval_archive
+from .archive import iter_states
+
+__all__ = [
+    "ARCHIVE_AFTER",
+    "archive_chunk",
+    "archive_chunks",
+    "archive_dir",
+    "chunk_path",
+    "eval_archive",
+    "iter_states",
+]
@@ -0,0 +1,344 @@
+import datetime
+import ipaddress
+import logging
+import os
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterator
+from typing import Optional
+from typing import Sequence
+
+import orjson
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import sqlalchemy.orm
+from sqlalchemy import ARRAY
+from sqlalchemy import FromClause
+from sqlalchemy import BigInteger
+from sqlalchemy import Boolean
+from sqlalchemy import DateTime
+from sqlalchemy import Float
+from sqlalchemy import Integer
+from sqlalchemy import SmallInteger
+from sqlalchemy import any_
+from sqlalchemy import bindparam
+from sqlalchemy import select
+from sqlalchemy import tuple_
+from sqlalchemy.dialects import postgresql
+
+from spoofspy import db
+from spoofspy.heuristics import trust
+
+logger = logging.getLogger(__name__)
+
+# Chunks are archived this long after their end time, before
+# the compression policy (10 days) kicks in. Late trust score
+# and A2S updates have landed by then.
+ARCHIVE_AFTER = datetime.timedelta(days=8)
+BATCH_SIZE = 10_000
+
+_TABLE_DIR = "game_server_state"
+
+# Dimensions resolved into the archived rows, the files don't
+# depend on a2s_blob or player_name rows that may be gone.
+_RESOLVED_FIELDS = [
+    # JSON.
+    pa.field("a2s_info", pa.string()),
+    pa.field("a2s_rules", pa.string()),
+    pa.field("a2s_player_names", pa.list_(pa.string())),
+]
+
+
+def archive_dir() -> Optional[Path]:
+    """Archive root directory, None if archiving is not configured."""
+    path = os.environ.get("SPOOFSPY_ARCHIVE_DIR")
+    if not path:
+        return None
+    return Path(path)
+
+
+def _arrow_type(sql_type) -> pa.DataType:
+    # Order matters, SmallInteger and BigInteger are Integers.
+    if isinstance(sql_type, ARRAY):
+        return pa.list_(_arrow_type(sql_type.item_type))
+    if isinstance(sql_type, Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, SmallInteger):
+        return pa.int16()
+    if isinstance(sql_type, BigInteger):
+        return pa.int64()
+    if isinstance(sql_type, Integer):
+        return pa.int32()
+    if isinstance(sql_type, postgresql.REAL):
+        return pa.float32()
+    if isinstance(sql_type, Float):
+        return pa.float64()
+    if isinstance(sql_type, DateTime):
+        return pa.timestamp("us", tz="UTC")
+    # Text, INET and anything else.
+    return pa.string()
+
+
+def _schema(table: FromClause) -> pa.Schema:
+    return pa.schema(
+        [
+            pa.field("game_server_address", pa.string(), nullable=False),
+            pa.field("game_server_port", pa.int32(), nullable=False),
+        ] + [
+            pa.field(col.name, _arrow_type(col.type))
+            for col in table.columns
+        ] + _RESOLVED_FIELDS
+    )
+
+
+def _resolve_dimensions(
+        session: sqlalchemy.orm.Session,
+        rows: Sequence[sqlalchemy.Row],
+        blobs: dict[int, str],
+        names: dict[int, str],
+) -> list[tuple]:
+    """Return a2s_info, a2s_rules and a2s_player_names columns of
+    rows. Blobs and names not yet in `blobs` and `names` are fetched
+    and added to them.
+    """
+    blob_hashes = {
+        h for row in rows
+        for h in (row.a2s_info_hash, row.a2s_rules_hash)
+        if h is not None and h not in blobs
+    }
+    if blob_hashes:
+        blobs.update(
+            (h, orjson.dumps(data).decode("utf-8"))
+            for h, data in session.execute(
+                select(db.models.A2SBlob.hash, db.models.A2SBlob.data).where(
+                    db.models.A2SBlob.hash == any_(bindparam(
+                        "hashes", list(blob_hashes),
+                        type_=postgresql.ARRAY(BigInteger))),
+                )
+            ).tuples()
+        )
+
+    name_ids = {
+        name_id for row in rows
+        for name_id in (row.a2s_player_name_ids or ())
+        if name_id not in names
+    }
+    if name_ids:
+        names.update(session.execute(
+            select(db.models.PlayerName.id, db.models.PlayerName.name).where(
+                db.models.PlayerName.id == any_(bindparam(
+                    "name_ids", list(name_ids),
+                    type_=postgresql.ARRAY(Integer))),
+            )
+        ).tuples().all())
+
+    return [
+        tuple(blobs.get(row.a2s_info_hash) for row in rows),
+        tuple(blobs.get(row.a2s_rules_hash) for row in rows),
+        tuple(
+            None if row.a2s_player_name_ids is None
+            else [names.get(name_id) for name_id in row.a2s_player_name_ids]
+            for row in rows
+        ),
+    ]
+
+
+def _resolve_static_columns(
+        session: sqlalchemy.orm.Session,
+        rows: Sequence[sqlalchemy.Row],
+        columns: list[tuple],
+        schema: pa.Schema,
+):
+    """Fill static columns of unchanged states in `columns` from
+    the full states they reference, which may be in earlier chunks.
+    """
+    refs = {
+        (row.game_server_id, row.static_since)
+        for row in rows
+        if row.static_since not in (None, row.time)
+    }
+    if not refs:
+        return
+
+    static_columns = db.latest.STATIC_COLUMNS
+    gss = db.models.GameServerState
+    full = {
+        (row[0], row[1]): row[2:]
+        for row in session.execute(
+            select(
+                gss.game_server_id,
+                gss.time,
+                *(getattr(gss, c) for c in static_columns),
+            ).where(
+                tuple_(gss.game_server_id, gss.time).in_(refs),
+            )
+        )
+    }
+
+    for i, name in enumerate(static_columns):
+        idx = schema.get_field_index(name)
+        columns[idx] = tuple(
+            full[(row.game_server_id, row.static_since)][i]
+            if (row.game_server_id, row.static_since) in full
+            else value
+            for row, value in zip(rows, columns[idx])
+        )
+
+
+def chunk_path(root: Path, chunk_name: str, range_start: datetime.datetime) -> Path:
+    """Hive partitioned by the chunk start date."""
+    return (root / _TABLE_DIR / f"date={range_start.date().isoformat()}"
+            / f"{chunk_name}.parquet")
+
+
+def archive_chunk(
+        session: sqlalchemy.orm.Session,
+        root: Path,
+        chunk_name: str,
+        range_start: datetime.datetime,
+        range_end: datetime.datetime,
+) -> int:
+    """Export states in [range_start, range_end) to a Parquet file
+    and record the chunk in ArchivedChunk. Static columns of unchanged
+    states are resolved from the full states. Returns the row count.
+    """
+    table = db.models.GameServerState.__table__
+    schema = _schema(table)
+    path = chunk_path(root, chunk_name, range_start)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Hidden from `iter_states` until complete.
+    tmp_path = path.with_name(f".{path.name}.tmp")
+
+    stmt = select(
+        db.models.GameServer.address.label("game_server_address"),
+        db.models.GameServer.port.label("game_server_port"),
+        *table.columns,
+    ).join_from(
+        table,
+        db.models.GameServer.__table__,
+        table.c.game_server_id == db.models.GameServer.id,
+    ).where(
+        (table.c.time >= range_start)
+        & (table.c.time < range_end)
+    ).execution_options(
+        yield_per=BATCH_SIZE,
+    )
+
+    num_rows = 0
+    blobs: dict[int, str] = {}
+    names: dict[int, str] = {}
+    try:
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+            result = session.execute(stmt)
+            for rows in result.partitions():
+                columns = list(zip(*rows))
+                # INET is returned as an ipaddress object.
+                columns[0] = tuple(str(addr) for addr in columns[0])
+                _resolve_static_columns(session, rows, columns, schema)
+                columns.extend(_resolve_dimensions(session, rows, blobs, names))
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    [pa.array(col, type=field.type)
+                     for col, field in zip(columns, schema)],
+                    schema=schema,
+                ))
+                num_rows += len(rows)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    tmp_path.replace(path)
+
+    session.add(db.models.ArchivedChunk(
+        chunk_name=chunk_name,
+        range_start=range_start,
+        range_end=range_end,
+        path=str(path.relative_to(root)),
+        num_rows=num_rows,
+    ))
+    return num_rows
+
+
+def archive_chunks(
+        session_maker: sqlalchemy.orm.sessionmaker,
+        root: Path,
+        now: Optional[datetime.datetime] = None,
+) -> int:
+    """Archive all chunks older than ARCHIVE_AFTER that are not yet
+    archived. Each chunk is archived in its own transaction.
+    Returns the number of archived chunks.
+    """
+    if now is None:
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+
+    with session_maker.begin() as sess:
+        chunks = sess.execute(
+            db.queries.archive_chunks,
+            {"before": now - ARCHIVE_AFTER},
+        ).all()
+
+    for chunk_name, range_start, range_end in chunks:
+        with session_maker.begin() as sess:
+            num_rows = archive_chunk(
+                sess, root, chunk_name, range_start, range_end)
+        logger.info("archived chunk %s [%s, %s): %s rows",
+                    chunk_name, range_start, range_end, num_rows)
+
+    return len(chunks)
+
+
+def iter_states(
+        root: Path,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+        columns: Optional[list[str]] = None,
+) -> Iterator[SimpleNamespace]:
+    """Stream archived states in [start, end) as attribute namespaces
+    compatible with `spoofspy.heuristics.trust.eval_trust_score`.
+    No database connection is needed.
+    """
+    dataset = ds.dataset(
+        root / _TABLE_DIR,
+        format="parquet",
+        partitioning="hive",
+        # Chunk names start with an underscore,
+        # ignored by default.
+        ignore_prefixes=["."],
+    )
+
+    expr = None
+    if start is not None:
+        expr = ds.field("time") >= pa.scalar(start, pa.timestamp("us", tz="UTC"))
+    if end is not None:
+        end_expr = ds.field("time") < pa.scalar(end, pa.timestamp("us", tz="UTC"))
+        expr = end_expr if expr is None else (expr & end_expr)
+
+    if columns is not None:
+        columns = list(dict.fromkeys(
+            ["game_server_address", "game_server_port", "time"] + columns))
+
+    for batch in dataset.to_batches(columns=columns, filter=expr):
+        for row in batch.to_pylist():
+            row.pop("date", None)
+            row["game_server_address"] = ipaddress.IPv4Address(
+                row["game_server_address"])
+            yield SimpleNamespace(**row)
+
+
+def eval_archive(
+        root: Path,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+) -> Iterator[tuple[ipaddress.IPv4Address, int, datetime.datetime, float]]:
+    """Re-run the trust evaluator over archived states. Yields
+    (address, port, time, trust score) tuples.
+    """
+    for state in iter_states(root, start, end):
+        # noinspection PyTypeChecker
+        score = trust.eval_trust_score(state)  # type: ignore[arg-type]
+        yield (
+            state.game_server_address,
+            state.game_server_port,
+            state.time,
+            score,
+        )
@@ -1,7 +1,9 @@
 from .coding import MsgPackCoder
+from .coding import RowMsgPackCoder
 from .coding import ZstdMsgPackCoder
 
 __all__ = [
     "MsgPackCoder",
+    "RowMsgPackCoder",
     "ZstdMsgPackCoder",
 ]
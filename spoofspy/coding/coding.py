@@ -60,6 +60,20 @@ class MsgPackCoder(Coder):
         )
 
 
+class RowMsgPackCoder(MsgPackCoder):
+    """Decodes to str keys and lists, for rows served by the API."""
+
+    @classmethod
+    # type: ignore[override]
+    def decode(cls, value: bytes) -> Any:
+        return msgpack.unpackb(
+            value,
+            timestamp=3,
+            object_hook=_object_hook,
+            ext_hook=_ext_hook,
+        )
+
+
 class ZstdMsgPackCoder(MsgPackCoder):
     @classmethod
     # type: ignore[override]
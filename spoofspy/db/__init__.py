@@ -1,3 +1,5 @@
+from . import blobs
+from . import latest
 from . import models
 from . import queries
 from .db import async_close_database
@@ -7,6 +9,8 @@ from .db import drop_create_all
 from .db import engine
 
 __all__ = [
+    "blobs",
+    "latest",
     "models",
     "queries",
     "async_close_database",
@@ -0,0 +1,12 @@
+-- game_server_state chunks ending before the given time
+-- that have not been archived yet, oldest first.
+SELECT chunks.chunk_name,
+       chunks.range_start,
+       chunks.range_end
+FROM timescaledb_information.chunks AS chunks
+WHERE chunks.hypertable_name = 'game_server_state'
+  AND chunks.range_end <= :before
+  AND NOT EXISTS(SELECT 1
+                 FROM archived_chunk
+                 WHERE archived_chunk.chunk_name = chunks.chunk_name)
+ORDER BY chunks.range_start;
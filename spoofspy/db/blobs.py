@@ -0,0 +1,76 @@
+import datetime
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Iterable
+from typing import Optional
+
+import orjson
+import sqlalchemy.orm
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from spoofspy.db.models import A2SBlob
+
+LRU_SIZE = 50_000
+# Seconds a remembered hash is trusted to still exist. Storing
+# the blob again refreshes its last_seen time.
+LRU_MAX_AGE = 24 * 60 * 60
+# Blobs not seen in this time are no longer referenced by any state:
+# game_server_state retention (4 months) plus a margin for the 7-day
+# chunk interval and LRU_MAX_AGE.
+MAX_AGE = datetime.timedelta(days=4 * 31 + 14)
+
+# Hashes recently stored by this process -> time remembered,
+# most recent last.
+_seen: OrderedDict[int, float] = OrderedDict()
+
+
+def blob_hash(data: Any) -> int:
+    """64-bit signed hash of the canonicalized (sorted keys) JSON."""
+    canonical = orjson.dumps(
+        data, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    digest = hashlib.blake2b(canonical, digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def store(
+        session: sqlalchemy.orm.Session,
+        data: Optional[Any],
+) -> Optional[int]:
+    """Insert blob or refresh its last_seen time unless recently
+    seen, returns its hash. Call `remember` with the hash after
+    the session is committed.
+    """
+    if data is None:
+        return None
+
+    h = blob_hash(data)
+    stored = _seen.get(h)
+    if stored is not None and time.monotonic() - stored < LRU_MAX_AGE:
+        _seen.move_to_end(h)
+        return h
+
+    session.execute(
+        pg_insert(A2SBlob).values(
+            hash=h,
+            data=data,
+        ).on_conflict_do_update(
+            index_elements=[A2SBlob.hash],
+            set_={"last_seen": func.now()},
+        ),
+    )
+    return h
+
+
+def remember(hashes: Iterable[Optional[int]]):
+    """Mark committed blob hashes as stored."""
+    now = time.monotonic()
+    for h in hashes:
+        if h is None:
+            continue
+        _seen[h] = now
+        _seen.move_to_end(h)
+    while len(_seen) > LRU_SIZE:
+        _seen.popitem(last=False)
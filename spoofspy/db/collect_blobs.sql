@@ -0,0 +1,6 @@
+-- Delete A2S blobs not stored by any state since :seen_before. States
+-- refresh last_seen when storing a blob, no state references it after
+-- the retention policy has dropped the chunks of the last ones.
+DELETE
+FROM a2s_blob
+WHERE last_seen < :seen_before;
@@ -21,7 +21,6 @@ from sqlalchemy.schema import DropTable
 
 from spoofspy.db.models import BaseModel
 from spoofspy.db.models import QuerySettings
-from spoofspy.db.models import QueryStatistics
 from spoofspy.db.models import ReflectedBase
 from spoofspy.utils.deployment import is_prod_deployment
 
@@ -160,9 +159,6 @@ def drop_create_all(db_engine: Optional[Engine] = None):
 
     ReflectedBase.prepare(db_engine)
 
-    with session.begin() as sess:
-        sess.add(QueryStatistics())
-
     if not is_prod_deployment():
         with session.begin() as sess:
             sess.add(QuerySettings(
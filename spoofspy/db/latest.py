@@ -0,0 +1,141 @@
+import datetime
+from typing import Any
+
+import sqlalchemy.orm
+from sqlalchemy import Update
+from sqlalchemy import bindparam
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import Insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from spoofspy.db.models import GameServerLatest
+
+# GetServerList columns that rarely change between probes. These are
+# only written to game_server_state when any of them has changed, other
+# states reference the full row by static_since. Trust inputs (players,
+# map, secure) are always written.
+STATIC_COLUMNS = (
+    "steamid",
+    "name",
+    "appid",
+    "gamedir",
+    "version",
+    "product",
+    "region",
+    "max_players",
+    "dedicated",
+    "os",
+    "gametype",
+)
+
+# game_server_state chunk_time_interval, see timescale.sql.
+CHUNK_INTERVAL = datetime.timedelta(days=7)
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+_KEY_COLUMNS = ("game_server_id",)
+_TRUST_COLUMNS = (
+    "trust_score",
+    "trust_score_time",
+    "trust_algo_version",
+    "trust_penalties",
+)
+_COLUMNS = frozenset(GameServerLatest.__table__.columns.keys())
+# Columns describing the newest state, reset when a newer state arrives.
+_STATE_COLUMNS = tuple(
+    c for c in GameServerLatest.__table__.columns.keys()
+    if c not in _KEY_COLUMNS and c not in _TRUST_COLUMNS
+)
+
+
+def _latest_values(values: dict[str, Any]) -> dict[str, Any]:
+    return {
+        key: value for key, value in values.items()
+        if key in _COLUMNS
+    }
+
+
+def upsert_stmt(values: dict[str, Any]) -> Insert:
+    """Insert new latest state or replace an older one.
+    Values must contain game_server_id and time. Values not present in the latest table are ignored.
+    """
+    stmt = pg_insert(GameServerLatest).values(_latest_values(values))
+    return stmt.on_conflict_do_update(
+        index_elements=list(_KEY_COLUMNS),
+        set_={
+            col: stmt.excluded[col]
+            for col in _STATE_COLUMNS
+        },
+        where=(GameServerLatest.time <= stmt.excluded.time),
+    )
+
+
+def update_stmt(
+        server_id: int,
+        time: datetime.datetime,
+        values: dict[str, Any],
+) -> Update:
+    """Update latest state columns if the state at `time` is still
+    the newest one. Values not present in the latest table are ignored.
+    """
+    return update(GameServerLatest).where(
+        (GameServerLatest.game_server_id == server_id)
+        & (GameServerLatest.time == time)
+    ).values(
+        _latest_values(values),
+    )
+
+
+def update_trust_score_stmt() -> Update:
+    """Executemany trust score update, takes the same parameters
+    as the GameServerState trust score update: u_game_server_id,
+    u_time, trust_score, trust_algo_version and trust_penalties.
+    """
+    return update(GameServerLatest).where(
+        (GameServerLatest.game_server_id == bindparam("u_game_server_id"))
+        & (
+                GameServerLatest.trust_score_time.is_(None)
+                | (GameServerLatest.trust_score_time <= bindparam("u_time"))
+        )
+    ).values(
+        trust_score_time=bindparam("u_time"),
+    )
+
+
+def static_key(values: dict[str, Any]) -> tuple:
+    """Comparable STATIC_COLUMNS values. Values are compared as strings,
+    e.g. steamid is a string in GetServerList and an int in the DB.
+    """
+    return tuple(
+        None if values.get(c) is None else str(values[c])
+        for c in STATIC_COLUMNS
+    )
+
+
+def chunk_start(time: datetime.datetime) -> datetime.datetime:
+    """Start of the game_server_state chunk of `time`. TimescaleDB
+    aligns chunks to multiples of the interval since the Unix epoch.
+    """
+    return time - (time - _EPOCH) % CHUNK_INTERVAL
+
+
+def static_state(
+        session: sqlalchemy.orm.Session,
+        server_id: int,
+) -> tuple[tuple, datetime.datetime] | None:
+    """Return (`static_key`, static_since) of the latest state
+    of the server, if any. The latest row is locked until the
+    end of the transaction to serialize concurrent probes.
+    """
+    row = session.execute(
+        select(
+            GameServerLatest.static_since,
+            *(getattr(GameServerLatest, c) for c in STATIC_COLUMNS),
+        ).where(
+            GameServerLatest.game_server_id == server_id,
+        ).with_for_update()
+    ).first()
+    if row is None or row[0] is None:
+        return None
+    return static_key(dict(zip(STATIC_COLUMNS, row[1:]))), row[0]
@@ -0,0 +1,5 @@
+-- Transaction level advisory locks of game servers, taken in the
+-- order of :server_ids. Callers pass sorted IDs so that concurrent
+-- transactions locking overlapping servers don't deadlock.
+SELECT pg_advisory_xact_lock(hashtext('spoofspy_game_server'), server_id)
+FROM unnest(CAST(:server_ids AS INTEGER[])) AS server_id;
@@ -1,7 +1,8 @@
 import datetime
+import enum
 import ipaddress
 from typing import Any
-from typing import List
+from typing import Optional
 
 import sqlalchemy
 from sqlalchemy import BigInteger
@@ -9,8 +10,12 @@ from sqlalchemy import Boolean
 from sqlalchemy import CheckConstraint
 from sqlalchemy import DateTime
 from sqlalchemy import Float
-from sqlalchemy import ForeignKeyConstraint
+from sqlalchemy import ForeignKey
+from sqlalchemy import Identity
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import SmallInteger
+from sqlalchemy import UniqueConstraint
 from sqlalchemy import Text
 from sqlalchemy import inspect
 from sqlalchemy.dialects import postgresql
@@ -93,30 +98,166 @@ class BaseModel(PrettyReprMixin, AsyncAttrs, DeclarativeBase):
         return d
 
 
-class QueryStatistics(BaseModel):
-    # TODO: this could simply be a name-value table.
-    #   E.g. name(text) - value(bigint):
-    #   steam_web_api_queries   -  x
-    #   some_other_query_state  -  y
+class Metric(BaseModel):
+    """Named counter value. Each metric has an all-time total
+    row in `spoofspy.metrics.TOTAL_BUCKET` and hourly rows.
+    E.g. name(text) - bucket(timestamptz) - value(bigint):
+    steam_web_api_queries  -  1970-01-01 00:00  -  x
+    steam_web_api_queries  -  2024-01-01 12:00  -  y
+    """
+    __tablename__ = "metrics"
+
+    name: Mapped[str] = mapped_column(
+        Text,
+        primary_key=True,
+        nullable=False,
+    )
+    bucket: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        primary_key=True,
+        nullable=False,
+    )
+    value: Mapped[int] = mapped_column(
+        BigInteger,
+        default=0,
+        nullable=False,
+    )
 
-    __tablename__ = "query_statistics"
 
-    id: Mapped[bool] = mapped_column(
+class RescoreCheckpoint(BaseModel):
+    """Progress of re-scoring a game_server_state chunk with a
+    trust algorithm version. States are processed in (time,
+    game_server_id) order, last_* is the last processed state.
+    """
+    __tablename__ = "rescore_checkpoint"
+
+    trust_algo_version: Mapped[int] = mapped_column(
+        SmallInteger,
+        primary_key=True,
+    )
+    chunk_name: Mapped[str] = mapped_column(
+        Text,
+        primary_key=True,
+    )
+    range_start: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+    )
+    range_end: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+    )
+    last_time: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+    last_game_server_id: Mapped[int] = mapped_column(
+        Integer,
+        nullable=True,
+    )
+    num_scored: Mapped[int] = mapped_column(
+        BigInteger,
+        nullable=False,
+        default=0,
+    )
+    done: Mapped[bool] = mapped_column(
         Boolean,
+        nullable=False,
+        default=False,
+    )
+    # Set while a worker is processing the chunk, refreshed on
+    # every batch. Stale claims are taken over by other workers.
+    claimed_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+
+
+class MatcherRuleSet(BaseModel):
+    """Bot name list or mutator signature list used by trust
+    evaluation, see `spoofspy.heuristics.matcher`. Bump version
+    when updating entries to have workers reload the rule sets.
+    """
+    __tablename__ = "matcher_rule_set"
+
+    name: Mapped[str] = mapped_column(
+        Text,
         primary_key=True,
-        unique=True,
-        default=True,
     )
+    # "bot_name" or "mutator".
+    kind: Mapped[str] = mapped_column(
+        Text,
+        nullable=False,
+    )
+    # Bit index of this rule set in match bitmasks.
+    bit: Mapped[int] = mapped_column(
+        SmallInteger,
+        nullable=False,
+    )
+    version: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        default=1,
+    )
+    entries: Mapped[list[str]] = mapped_column(
+        postgresql.ARRAY(Text),
+        nullable=False,
+    )
+
+    __table_args__ = (
+        UniqueConstraint("kind", "bit"),
+    )
+
+
+class ReputationEntry(BaseModel):
+    """Trust score multiplier for a network, a single server
+    (network and port) or all networks of an ASN, see
+    `spoofspy.heuristics.reputation`. 0.0 blacklists.
+    """
+    __tablename__ = "reputation_entry"
 
-    steam_web_api_queries: Mapped[int] = mapped_column(
+    id: Mapped[int] = mapped_column(
+        Integer,
+        Identity(),
+        primary_key=True,
+    )
+    network: Mapped[ipaddress.IPv4Network] = mapped_column(
+        postgresql.CIDR,
+        nullable=True,
+    )
+    port: Mapped[int] = mapped_column(
+        Integer,
+        nullable=True,
+    )
+    asn: Mapped[int] = mapped_column(
         BigInteger,
-        default=0,
+        nullable=True,
+    )
+    multiplier: Mapped[float] = mapped_column(
+        Float,
         nullable=False,
+        default=0.0,
+    )
+    reason: Mapped[str] = mapped_column(
+        Text,
+        nullable=True,
+    )
+    updated_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=sqlalchemy.func.now(),
+        onupdate=sqlalchemy.func.now(),
     )
 
-    # Enforce only a single row allowed.
-    CheckConstraint(
-        "id CHECK (id)"
+    __table_args__ = (
+        CheckConstraint(
+            "(network IS NULL) != (asn IS NULL)",
+            name="check_network_or_asn",
+        ),
+        CheckConstraint(
+            "multiplier BETWEEN 0.0 AND 1.0",
+            name="check_multiplier_range",
+        ),
     )
 
 
@@ -157,20 +298,57 @@ class QuerySettings(BaseModel):
         )
 
 
+class ArchivedChunk(BaseModel):
+    """game_server_state chunk exported to Parquet cold storage."""
+    __tablename__ = "archived_chunk"
+
+    chunk_name: Mapped[str] = mapped_column(
+        Text,
+        primary_key=True,
+    )
+    range_start: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+    )
+    range_end: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+    )
+    # Relative to the archive root directory.
+    path: Mapped[str] = mapped_column(
+        Text,
+        nullable=False,
+    )
+    num_rows: Mapped[int] = mapped_column(
+        BigInteger,
+        nullable=False,
+    )
+    archived_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=sqlalchemy.func.now(),
+    )
+
+
 class GameServer(BaseModel):
-    """Steam game server. Identified by IP:PORT."""
+    """Steam game server. Identified by IP:PORT. Other tables
+    reference game servers by the compact surrogate `id`.
+    """
     __tablename__ = "game_server"
 
+    id: Mapped[int] = mapped_column(
+        Integer,
+        Identity(),
+        primary_key=True,
+    )
     # TODO: common base class to allow both IPv4 and IPv6?
     address: Mapped[ipaddress.IPv4Address] = mapped_column(
         postgresql.INET,
         nullable=False,
-        primary_key=True,
     )
     port: Mapped[int] = mapped_column(
         Integer,
         nullable=False,
-        primary_key=True,
     )
     query_port: Mapped[int] = mapped_column(
         Integer,
@@ -185,6 +363,51 @@ class GameServer(BaseModel):
         name="check_query_port_range",
     )
 
+    __table_args__ = (
+        UniqueConstraint("address", "port"),
+    )
+
+
+class PlayerName(BaseModel):
+    """Interned A2S player name."""
+    __tablename__ = "player_name"
+
+    id: Mapped[int] = mapped_column(
+        Integer,
+        Identity(),
+        primary_key=True,
+    )
+    name: Mapped[str] = mapped_column(
+        Text,
+        nullable=False,
+        unique=True,
+    )
+
+
+class A2SBlob(BaseModel):
+    """Content-addressed A2S leftover fields (a2s_info, a2s_rules).
+    Identical blobs are stored once, keyed by `spoofspy.db.blobs.blob_hash`.
+    Blobs not seen in `spoofspy.db.blobs.MAX_AGE`, i.e. no longer
+    referenced by any state, are deleted periodically.
+    """
+    __tablename__ = "a2s_blob"
+
+    hash: Mapped[int] = mapped_column(
+        BigInteger,
+        primary_key=True,
+        autoincrement=False,
+    )
+    data: Mapped[dict[str, Any]] = mapped_column(
+        postgresql.JSONB,
+        nullable=False,
+    )
+    last_seen: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=sqlalchemy.func.now(),
+        index=True,
+    )
+
 
 class ReflectedBase(DeferredReflection):
     __abstract__ = True
@@ -201,6 +424,20 @@ class TimescaleModel(BaseModel):
     )
 
 
+class PiPlatform(enum.IntEnum):
+    """A2S rules PI_P_<index> values, stored as SMALLINT."""
+    UNKNOWN = 0
+    STEAM = 1
+    EOS = 2
+
+    @classmethod
+    def from_str(cls, value: str) -> "PiPlatform":
+        try:
+            return cls[value.upper()]
+        except KeyError:
+            return cls.UNKNOWN
+
+
 class GameServerState(ReflectedBase, TimescaleModel):
     """State(s) of queried server at given time.
     - A2S Info.
@@ -210,16 +447,13 @@ class GameServerState(ReflectedBase, TimescaleModel):
     """
     __tablename__ = "game_server_state"
 
-    game_server_address = mapped_column(
-        postgresql.INET,
-        nullable=False,
-    )
-    game_server_port: Mapped[int] = mapped_column(
+    game_server_id: Mapped[int] = mapped_column(
         Integer,
+        ForeignKey("game_server.id"),
         nullable=False,
     )
     game_server: Mapped[GameServer] = relationship(
-        foreign_keys=[game_server_address, game_server_port],
+        foreign_keys=[game_server_id],
     )
 
     # IGameServersService/GetServerList state.
@@ -257,11 +491,11 @@ class GameServerState(ReflectedBase, TimescaleModel):
     a2s_player_count: Mapped[int] = mapped_column(Integer, nullable=True)
     a2s_max_players: Mapped[int] = mapped_column(Integer, nullable=True)
     a2s_open_slots: Mapped[int] = mapped_column(Integer, nullable=True)
-    # Leftover fields in their raw format.
-    a2s_info: Mapped[dict[str, str]] = mapped_column(
-        postgresql.JSONB,
-        nullable=True,
-        deferred=True,
+    # Leftover fields in their raw format, stored in A2SBlob.
+    a2s_info_hash: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    a2s_info_blob: Mapped[Optional["A2SBlob"]] = relationship(
+        primaryjoin="foreign(GameServerState.a2s_info_hash) == A2SBlob.hash",
+        viewonly=True,
     )
 
     # A2S rules fields.
@@ -286,19 +520,39 @@ class GameServerState(ReflectedBase, TimescaleModel):
         Integer,
         nullable=True,
     )
-    a2s_pi_objects: Mapped[dict[str, dict]] = mapped_column(
-        postgresql.JSONB,
+    # PI objects as parallel arrays, array position is the PI index.
+    # Missing indices are stored as NULLs.
+    a2s_pi_names: Mapped[list[str]] = mapped_column(
+        postgresql.ARRAY(Text),
+        nullable=True,
+    )
+    # PiPlatform values.
+    a2s_pi_platforms: Mapped[list[int]] = mapped_column(
+        postgresql.ARRAY(SmallInteger),
+        nullable=True,
+    )
+    a2s_pi_scores: Mapped[list[int]] = mapped_column(
+        postgresql.ARRAY(Integer),
+        nullable=True,
+    )
+    # Platform counts of PI objects with index < a2s_pi_count.
+    a2s_pi_steam_count: Mapped[int] = mapped_column(
+        Integer,
+        nullable=True,
+    )
+    a2s_pi_eos_count: Mapped[int] = mapped_column(
+        Integer,
         nullable=True,
     )
     a2s_mutators_running: Mapped[list[str]] = mapped_column(
         postgresql.ARRAY(Text),
         nullable=True,
     )
-    # Leftovers.
-    a2s_rules: Mapped[dict[str, str]] = mapped_column(
-        postgresql.JSONB,
-        nullable=True,
-        deferred=True,
+    # Leftovers, stored in A2SBlob.
+    a2s_rules_hash: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    a2s_rules_blob: Mapped[Optional["A2SBlob"]] = relationship(
+        primaryjoin="foreign(GameServerState.a2s_rules_hash) == A2SBlob.hash",
+        viewonly=True,
     )
 
     # A2S players fields.
@@ -310,23 +564,18 @@ class GameServerState(ReflectedBase, TimescaleModel):
         DateTime(timezone=True),
         nullable=True,
     )
-    # Array of A2S player objects e.g.:
-    # [
-    #   {
-    #       "index": 0,
-    #       "name", "Player1",
-    #       "score": 40,
-    #       "duration": 0.00001,
-    #   },
-    #   {
-    #       "index": 0,
-    #       "name", "Ryan Gosling",
-    #       "score": -1,
-    #       "duration": 5.4501,
-    #   },
-    # ]
-    a2s_players: Mapped[List[dict[str, str]]] = mapped_column(
-        postgresql.ARRAY(postgresql.JSONB),
+    # A2S players as parallel arrays. Names are interned
+    # in the player_name table.
+    a2s_player_name_ids: Mapped[list[int]] = mapped_column(
+        postgresql.ARRAY(Integer),
+        nullable=True,
+    )
+    a2s_player_scores: Mapped[list[int]] = mapped_column(
+        postgresql.ARRAY(Integer),
+        nullable=True,
+    )
+    a2s_player_durations: Mapped[list[float]] = mapped_column(
+        postgresql.ARRAY(postgresql.REAL),
         nullable=True,
     )
 
@@ -334,18 +583,236 @@ class GameServerState(ReflectedBase, TimescaleModel):
         Float,
         nullable=True,
     )
+    # spoofspy.heuristics.trust.ALGO_VERSION used for trust_score.
+    trust_algo_version: Mapped[int] = mapped_column(
+        SmallInteger,
+        nullable=True,
+    )
+    # Penalty breakdown of trust_score, indexed as
+    # spoofspy.heuristics.trust.PENALTY_NAMES.
+    trust_penalties: Mapped[list[float]] = mapped_column(
+        postgresql.ARRAY(postgresql.REAL),
+        nullable=True,
+    )
 
     icmp_responded: Mapped[bool] = mapped_column(
         Boolean,
         nullable=True,
     )
 
-    __table__args = (
-        ForeignKeyConstraint(
-            [game_server_address, game_server_port],
-            [GameServer.address, GameServer.port],
-        )
+    # Time of the state holding the static GetServerList columns
+    # (see spoofspy.db.latest.STATIC_COLUMNS). Equal to time for
+    # full states, static columns are NULL in other states.
+    static_since: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+
+    # NOTE: requires game_server to be loaded.
+    @property
+    def game_server_address(self) -> ipaddress.IPv4Address:
+        return self.game_server.address
+
+    # NOTE: requires game_server to be loaded.
+    @property
+    def game_server_port(self) -> int:
+        return self.game_server.port
+
+
+class GameServerFeatures(BaseModel):
+    """Rolling temporal features of a server, maintained at score
+    time. See `spoofspy.heuristics.features.ServerFeatures`.
+    """
+    __tablename__ = "game_server_features"
+
+    game_server_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("game_server.id"),
+        primary_key=True,
+    )
+    # Time of the newest state included in the features.
+    time: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
     )
+    samples: Mapped[int] = mapped_column(Integer, nullable=False)
+    players: Mapped[int] = mapped_column(Integer, nullable=True)
+    players_delta_ewma: Mapped[float] = mapped_column(Float, nullable=False)
+    players_delta_var: Mapped[float] = mapped_column(Float, nullable=False)
+    players_ewma: Mapped[float] = mapped_column(Float, nullable=False)
+    players_var: Mapped[float] = mapped_column(Float, nullable=False)
+    players_cusum_pos: Mapped[float] = mapped_column(Float, nullable=False)
+    players_cusum_neg: Mapped[float] = mapped_column(Float, nullable=False)
+    anomaly_flags: Mapped[int] = mapped_column(SmallInteger, nullable=False)
+    anomaly_ewma: Mapped[float] = mapped_column(Float, nullable=False)
+    duration_violation_ewma: Mapped[float] = mapped_column(
+        Float,
+        nullable=False,
+    )
+    player_name_ids: Mapped[list[int]] = mapped_column(
+        postgresql.ARRAY(Integer),
+        nullable=False,
+    )
+    player_scores: Mapped[list[int]] = mapped_column(
+        postgresql.ARRAY(Integer),
+        nullable=False,
+    )
+    player_durations: Mapped[list[float]] = mapped_column(
+        postgresql.ARRAY(postgresql.REAL),
+        nullable=False,
+    )
+    player_frozen: Mapped[list[int]] = mapped_column(
+        postgresql.ARRAY(Integer),
+        nullable=False,
+    )
+
+
+class RosterCluster(BaseModel):
+    """Servers with suspiciously similar player rosters, replaced
+    on every clustering run. See `spoofspy.heuristics.roster`.
+    """
+    __tablename__ = "roster_cluster"
+
+    game_server_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("game_server.id"),
+        primary_key=True,
+    )
+    cluster_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Number of servers in the cluster.
+    cluster_size: Mapped[int] = mapped_column(Integer, nullable=False)
+    time: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+    )
+
+
+class GameServerLatest(BaseModel):
+    """Scalar columns of the newest GameServerState of each server.
+    Upserted on every ingest to allow reading the current state
+    of all servers without scanning the hypertable.
+    """
+    __tablename__ = "game_server_latest"
+
+    game_server_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("game_server.id"),
+        primary_key=True,
+    )
+    game_server: Mapped[GameServer] = relationship(
+        foreign_keys=[game_server_id],
+    )
+    # Time of the newest state.
+    time: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+    )
+    # Time of the newest full state, see GameServerState.static_since.
+    static_since: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+
+    steamid: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    name: Mapped[str] = mapped_column(Text, nullable=True)
+    appid: Mapped[int] = mapped_column(Integer, nullable=True)
+    gamedir: Mapped[str] = mapped_column(Text, nullable=True)
+    version: Mapped[str] = mapped_column(Text, nullable=True)
+    product: Mapped[str] = mapped_column(Text, nullable=True)
+    region: Mapped[int] = mapped_column(Integer, nullable=True)
+    players: Mapped[int] = mapped_column(Integer, nullable=True)
+    max_players: Mapped[int] = mapped_column(Integer, nullable=True)
+    bots: Mapped[int] = mapped_column(Integer, nullable=True)
+    map: Mapped[str] = mapped_column(Text, nullable=True)
+    secure: Mapped[bool] = mapped_column(Boolean, nullable=True)
+    dedicated: Mapped[bool] = mapped_column(Boolean, nullable=True)
+    os: Mapped[str] = mapped_column(Text, nullable=True)
+    gametype: Mapped[str] = mapped_column(Text, nullable=True, deferred=True)
+
+    a2s_info_responded: Mapped[bool] = mapped_column(Boolean, nullable=True)
+    a2s_info_response_time: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+    a2s_server_name: Mapped[str] = mapped_column(Text, nullable=True)
+    a2s_map_name: Mapped[str] = mapped_column(Text, nullable=True)
+    a2s_steam_id: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    a2s_player_count: Mapped[int] = mapped_column(Integer, nullable=True)
+    a2s_max_players: Mapped[int] = mapped_column(Integer, nullable=True)
+    a2s_open_slots: Mapped[int] = mapped_column(Integer, nullable=True)
+
+    a2s_rules_responded: Mapped[bool] = mapped_column(Boolean, nullable=True)
+    a2s_rules_response_time: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+    a2s_num_open_public_connections: Mapped[int] = mapped_column(
+        Integer,
+        nullable=True,
+    )
+    a2s_num_public_connections: Mapped[int] = mapped_column(
+        Integer,
+        nullable=True,
+    )
+    a2s_pi_count: Mapped[int] = mapped_column(Integer, nullable=True)
+    a2s_pi_steam_count: Mapped[int] = mapped_column(Integer, nullable=True)
+    a2s_pi_eos_count: Mapped[int] = mapped_column(Integer, nullable=True)
+    a2s_mutators_running: Mapped[list[str]] = mapped_column(
+        postgresql.ARRAY(Text),
+        nullable=True,
+    )
+
+    a2s_players_responded: Mapped[bool] = mapped_column(
+        Boolean,
+        nullable=True,
+    )
+    a2s_players_response_time: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+
+    icmp_responded: Mapped[bool] = mapped_column(Boolean, nullable=True)
+
+    # Latest evaluated trust score, not necessarily
+    # the trust score of the newest state.
+    trust_score: Mapped[float] = mapped_column(Float, nullable=True)
+    trust_score_time: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+    trust_algo_version: Mapped[int] = mapped_column(
+        SmallInteger,
+        nullable=True,
+    )
+    trust_penalties: Mapped[list[float]] = mapped_column(
+        postgresql.ARRAY(postgresql.REAL),
+        nullable=True,
+    )
+
+    __table_args__ = (
+        Index("ix_game_server_latest_time", "time"),
+    )
+
+
+class PlayerCountAnomaly(ReflectedBase, TimescaleModel):
+    """Player count anomaly raised by a state, see
+    `spoofspy.heuristics.features` for the flag bits.
+    """
+    __tablename__ = "player_count_anomaly"
+
+    game_server_id: Mapped[int] = mapped_column(
+        Integer,
+        ForeignKey("game_server.id"),
+        nullable=False,
+    )
+    game_server: Mapped[GameServer] = relationship(
+        foreign_keys=[game_server_id],
+    )
+
+    flags: Mapped[int] = mapped_column(SmallInteger, nullable=False)
+    players: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Player count EWMA before the state.
+    expected: Mapped[float] = mapped_column(postgresql.REAL, nullable=False)
 
 
 class EndpointAccess(ReflectedBase, TimescaleModel):
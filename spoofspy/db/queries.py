@@ -4,3 +4,13 @@ from sqlalchemy import text
 
 # TODO: is there a better way to make this available in multiple places?
 trust_aggregate = text((Path(__file__).parent / "trust_aggregate.sql").read_text())
+trust_volatility = text((Path(__file__).parent / "trust_volatility.sql").read_text())
+archive_chunks = text((Path(__file__).parent / "archive_chunks.sql").read_text())
+rescore_chunks = text((Path(__file__).parent / "rescore_chunks.sql").read_text())
+rescore_claim = text((Path(__file__).parent / "rescore_claim.sql").read_text())
+refresh_trust_aggregate = text((Path(__file__).parent / "refresh_trust_aggregate.sql").read_text())
+trust_score_functions = text((Path(__file__).parent / "trust_score_functions.sql").read_text())
+rescore_in_database = text((Path(__file__).parent / "rescore_in_database.sql").read_text())
+score_in_database = text((Path(__file__).parent / "score_in_database.sql").read_text())
+collect_blobs = text((Path(__file__).parent / "collect_blobs.sql").read_text())
+lock_servers = text((Path(__file__).parent / "lock_servers.sql").read_text())
@@ -0,0 +1,4 @@
+-- Must be executed outside a transaction block (autocommit).
+CALL refresh_continuous_aggregate('game_server_trust_4d',
+                                  CAST(:window_start AS TIMESTAMPTZ),
+                                  CAST(:window_end AS TIMESTAMPTZ));
@@ -0,0 +1,7 @@
+-- All game_server_state chunks, newest first.
+SELECT chunks.chunk_name,
+       chunks.range_start,
+       chunks.range_end
+FROM timescaledb_information.chunks AS chunks
+WHERE chunks.hypertable_name = 'game_server_state'
+ORDER BY chunks.range_start DESC;
@@ -0,0 +1,13 @@
+-- Claim the newest unfinished chunk that has ended before :ready_before
+-- and is not being processed by another worker (no claim or a stale claim).
+UPDATE rescore_checkpoint
+SET claimed_at = now()
+WHERE (trust_algo_version, chunk_name) = (SELECT trust_algo_version, chunk_name
+                                          FROM rescore_checkpoint
+                                          WHERE trust_algo_version = :trust_algo_version
+                                            AND NOT done
+                                            AND range_end <= :ready_before
+                                            AND (claimed_at IS NULL OR claimed_at < :stale_before)
+                                          ORDER BY range_start DESC
+                                          LIMIT 1 FOR UPDATE SKIP LOCKED)
+RETURNING chunk_name;
@@ -0,0 +1,55 @@
+-- Re-score the next keyset batch of a chunk in the database with
+-- spoofspy_trust_score (trust_score_functions.sql). Like re-scoring
+-- in Python, the latest table is not updated. Returns the number of
+-- scored states, the key of the last one and the scored addresses.
+WITH batch AS (SELECT s.time,
+                      s.game_server_id
+               FROM game_server_state AS s
+               WHERE s.time >= :range_start
+                 AND s.time < :range_end
+                 AND s.a2s_info_responded IS NOT NULL
+                 AND s.a2s_rules_responded IS NOT NULL
+                 AND s.a2s_players_responded IS NOT NULL
+                 AND s.trust_algo_version IS DISTINCT FROM :trust_algo_version
+                 AND (CAST(:last_time AS TIMESTAMPTZ) IS NULL
+                   OR (s.time, s.game_server_id) > (CAST(:last_time AS TIMESTAMPTZ),
+                                                    CAST(:last_game_server_id AS INTEGER)))
+               ORDER BY s.time, s.game_server_id
+               LIMIT :batch_size),
+     scored AS (
+         UPDATE game_server_state AS s
+             SET trust_score = spoofspy_trust_score(
+                     s,
+                     spoofspy_reputation_multiplier(
+                             g.address - inet '0.0.0.0',
+                             g.port,
+                             CAST(:range_starts AS BIGINT[]),
+                             CAST(:range_ends AS BIGINT[]),
+                             CAST(:range_multipliers AS DOUBLE PRECISION[]),
+                             CAST(:port_range_starts AS BIGINT[]),
+                             CAST(:port_range_ends AS BIGINT[]),
+                             CAST(:port_range_multipliers AS DOUBLE PRECISION[])),
+                     CAST(:player_count_x AS DOUBLE PRECISION[]),
+                     CAST(:player_count_y AS DOUBLE PRECISION[]),
+                     CAST(:ww_bots AS TEXT[]),
+                     CAST(:rs2_bots AS TEXT[]),
+                     CAST(:gom4_bots AS TEXT[]),
+                     CAST(:gom3_mutators AS TEXT[]),
+                     CAST(:gom4_mutators AS TEXT[])),
+                 trust_algo_version = :trust_algo_version,
+                 -- Not computed in the database.
+                 trust_penalties = NULL
+             FROM batch, game_server AS g
+             WHERE s.time = batch.time
+                 AND s.game_server_id = batch.game_server_id
+                 AND g.id = s.game_server_id
+             RETURNING s.time, s.game_server_id, g.address)
+SELECT (SELECT count(*) FROM scored)                                     AS num_scored,
+       last.time                                                         AS last_time,
+       last.game_server_id                                               AS last_game_server_id,
+       (SELECT array_agg(DISTINCT host(scored.address)) FROM scored)     AS addresses
+FROM (SELECT 1) AS one
+         LEFT JOIN (SELECT time, game_server_id
+                    FROM scored
+                    ORDER BY time DESC, game_server_id DESC
+                    LIMIT 1) AS last ON TRUE;
@@ -0,0 +1,35 @@
+-- In-database trust scores of a keyset batch of states without
+-- updating them, for parity checks against eval_trust_score.
+-- Takes the same parameters as rescore_in_database.sql.
+SELECT s.time,
+       s.game_server_id,
+       spoofspy_trust_score(
+               s,
+               spoofspy_reputation_multiplier(
+                       g.address - inet '0.0.0.0',
+                       g.port,
+                       CAST(:range_starts AS BIGINT[]),
+                       CAST(:range_ends AS BIGINT[]),
+                       CAST(:range_multipliers AS DOUBLE PRECISION[]),
+                       CAST(:port_range_starts AS BIGINT[]),
+                       CAST(:port_range_ends AS BIGINT[]),
+                       CAST(:port_range_multipliers AS DOUBLE PRECISION[])),
+               CAST(:player_count_x AS DOUBLE PRECISION[]),
+               CAST(:player_count_y AS DOUBLE PRECISION[]),
+               CAST(:ww_bots AS TEXT[]),
+               CAST(:rs2_bots AS TEXT[]),
+               CAST(:gom4_bots AS TEXT[]),
+               CAST(:gom3_mutators AS TEXT[]),
+               CAST(:gom4_mutators AS TEXT[])) AS trust_score
+FROM game_server_state AS s
+         JOIN game_server AS g ON g.id = s.game_server_id
+WHERE s.time >= :range_start
+  AND s.time < :range_end
+  AND s.a2s_info_responded IS NOT NULL
+  AND s.a2s_rules_responded IS NOT NULL
+  AND s.a2s_players_responded IS NOT NULL
+  AND (CAST(:last_time AS TIMESTAMPTZ) IS NULL
+    OR (s.time, s.game_server_id) > (CAST(:last_time AS TIMESTAMPTZ),
+                                     CAST(:last_game_server_id AS INTEGER)))
+ORDER BY s.time, s.game_server_id
+LIMIT :batch_size;
@@ -3,6 +3,7 @@
 -- database initialization.
 CREATE EXTENSION IF NOT EXISTS timescaledb;
 
+DROP MATERIALIZED VIEW IF EXISTS "game_server_trust_4d";
 DROP TABLE IF EXISTS "game_server_state";
 
 -- TODO: need to support multiple "probing" nodes.
@@ -14,8 +15,7 @@ DROP TABLE IF EXISTS "game_server_state";
 CREATE TABLE "game_server_state"
 (
     time                            TIMESTAMPTZ NOT NULL,
-    game_server_address             INET        NOT NULL,
-    game_server_port                INTEGER     NOT NULL,
+    game_server_id                  INTEGER     NOT NULL,
 
     -- IGameServersService/GetServerList.
     steamid                         BIGINT,
@@ -43,7 +43,7 @@ CREATE TABLE "game_server_state"
     a2s_player_count                INTEGER,
     a2s_max_players                 INTEGER,
     a2s_open_slots                  INTEGER,
-    a2s_info                        JSONB,
+    a2s_info_hash                   BIGINT,
 
     -- A2S rules.
     a2s_rules_responded             BOOLEAN,
@@ -51,39 +51,80 @@ CREATE TABLE "game_server_state"
     a2s_num_open_public_connections INTEGER,
     a2s_num_public_connections      INTEGER,
     a2s_pi_count                    INTEGER,
-    a2s_pi_objects                  JSONB,
+    a2s_pi_names                    TEXT[],
+    a2s_pi_platforms                SMALLINT[],
+    a2s_pi_scores                   INTEGER[],
+    a2s_pi_steam_count              INTEGER,
+    a2s_pi_eos_count                INTEGER,
     a2s_mutators_running            TEXT[],
-    a2s_rules                       JSONB,
+    a2s_rules_hash                  BIGINT,
 
     -- A2S players.
     a2s_players_responded           BOOLEAN,
     a2s_players_response_time       TIMESTAMPTZ,
-    a2s_players                     JSONB[],
+    a2s_player_name_ids             INTEGER[],
+    a2s_player_scores               INTEGER[],
+    a2s_player_durations            REAL[],
 
     trust_score                     REAL,
+    trust_algo_version              SMALLINT,
+    -- Indexed as spoofspy.heuristics.trust.PENALTY_NAMES.
+    trust_penalties                 REAL[],
 
     icmp_responded                  BOOLEAN,
 
+    -- Time of the full state holding the static columns.
+    static_since                    TIMESTAMPTZ,
+
     CONSTRAINT fk_game_server
-        FOREIGN KEY (game_server_address, game_server_port)
-            REFERENCES game_server (address, port)
+        FOREIGN KEY (game_server_id)
+            REFERENCES game_server (id)
 );
 
 CREATE INDEX ON "game_server_state" (time DESC);
 CREATE INDEX ON "game_server_state" (time DESC, trust_score);
+CREATE INDEX ON "game_server_state" (game_server_id, time DESC);
+-- Per-player lookups, e.g. a2s_player_name_ids @> ARRAY[id].
+CREATE INDEX ON "game_server_state" USING GIN (a2s_player_name_ids);
 
-SELECT create_hypertable('game_server_state', 'time');
+-- Chunk interval must match spoofspy.db.latest.CHUNK_INTERVAL.
+SELECT create_hypertable('game_server_state', 'time',
+                         chunk_time_interval => INTERVAL '7 days');
 
 SELECT add_retention_policy('game_server_state', INTERVAL '4 months');
 
 ALTER TABLE game_server_state
     SET (
         timescaledb.compress,
-        timescaledb.compress_segmentby = 'game_server_address, game_server_port'
+        timescaledb.compress_segmentby = 'game_server_id'
         );
 
 SELECT add_compression_policy('game_server_state', INTERVAL '10 days');
 
+-- Per-server 4-day trust score averages and last seen times.
+-- Real-time aggregation is enabled to include the latest,
+-- not yet materialized, buckets in query results.
+CREATE MATERIALIZED VIEW "game_server_trust_4d"
+    WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket('4 days', time) AS bucket,
+       game_server_id,
+       avg(trust_score)            AS avg_trust_score,
+       max(time)                   AS last_seen
+FROM game_server_state
+GROUP BY bucket, game_server_id
+WITH NO DATA;
+
+CREATE INDEX ON "game_server_trust_4d" (game_server_id, bucket DESC);
+
+-- Trust scores are evaluated for states up to 24 hours old,
+-- refresh enough buckets to pick up late evaluations.
+SELECT add_continuous_aggregate_policy('game_server_trust_4d',
+                                       start_offset => INTERVAL '12 days',
+                                       end_offset => INTERVAL '5 minutes',
+                                       schedule_interval => INTERVAL '5 minutes');
+
+SELECT add_retention_policy('game_server_trust_4d', INTERVAL '4 months');
+
 
 DROP TABLE IF EXISTS "endpoint_access";
 
@@ -106,3 +147,27 @@ ALTER TABLE endpoint_access
 SELECT add_compression_policy('endpoint_access', INTERVAL '2 days');
 
 SELECT add_retention_policy('endpoint_access', INTERVAL '6 months');
+
+
+DROP TABLE IF EXISTS "player_count_anomaly";
+
+-- Player count anomalies raised at trust score evaluation,
+-- flags are bits of spoofspy.heuristics.features.ANOMALY_*.
+CREATE TABLE "player_count_anomaly"
+(
+    time           TIMESTAMPTZ NOT NULL,
+    game_server_id INTEGER     NOT NULL,
+    flags          SMALLINT    NOT NULL,
+    players        INTEGER     NOT NULL,
+    expected       REAL        NOT NULL,
+
+    CONSTRAINT fk_game_server
+        FOREIGN KEY (game_server_id)
+            REFERENCES game_server (id)
+);
+
+CREATE INDEX ON "player_count_anomaly" (game_server_id, time DESC);
+
+SELECT create_hypertable('player_count_anomaly', 'time');
+
+SELECT add_retention_policy('player_count_anomaly', INTERVAL '4 months');
@@ -1,37 +1,21 @@
-SELECT game_server_address,
-       array_agg(game_server_port)          as game_server_port_agg,
-       array_agg(last_week_avg_trust_score) as trust_score_agg
-FROM (SELECT game_server_address,
-             game_server_port,
-             avg(avg_trust_score) AS last_week_avg_trust_score
-      FROM (SELECT game_server_address,
-                   game_server_port,
-                   avg_trust_score,
-                   rank() OVER (
-                       PARTITION BY game_server_address, game_server_port
-                       ORDER BY four_day_bucket DESC
-                       )
-            FROM (SELECT time_bucket('4 days', time) AS four_day_bucket,
-                         avg(trust_score)            AS avg_trust_score,
-                         game_server_address,
-                         game_server_port
-                  FROM game_server_state
-                  WHERE game_server_state.trust_score IS NOT NULL
-                  GROUP BY game_server_address, game_server_port, four_day_bucket
-                  ORDER BY game_server_address, game_server_port, four_day_bucket DESC) AS gss_buckets) AS gss_ranked
-      WHERE gss_ranked.rank = 1
-        AND gss_ranked.avg_trust_score < :cutoff
-      GROUP BY game_server_address, game_server_port) gss_avg_trust_groups
--- Where server is in set of servers last seen in 24 hours.
-WHERE (game_server_address, game_server_port) IN (SELECT game_server_address, game_server_port
-                                                  FROM (SELECT game_server_address,
-                                                               game_server_port,
-                                                               time,
-                                                               rank() OVER (
-                                                                   PARTITION BY game_server_address, game_server_port
-                                                                   ORDER BY game_server_state.time DESC
-                                                                   )
-                                                        FROM game_server_state) AS gss_ranked_by_time
-                                                  WHERE gss_ranked_by_time.rank <= 1
-                                                    AND gss_ranked_by_time.time >= now() - interval '24 hours')
-GROUP BY game_server_address;
+-- Latest 4-day trust score average of servers with low trust scores,
+-- read from the game_server_trust_4d continuous aggregate.
+-- Limited to the given addresses unless all addresses are requested.
+SELECT game_server.address                          AS game_server_address,
+       array_agg(game_server.port)                  AS game_server_port_agg,
+       array_agg(gss_latest_buckets.avg_trust_score) AS trust_score_agg
+FROM (SELECT DISTINCT ON (game_server_id) game_server_id,
+                                          avg_trust_score
+      FROM game_server_trust_4d
+      WHERE avg_trust_score IS NOT NULL
+        AND (:all_addresses OR game_server_id IN (SELECT id
+                                                  FROM game_server
+                                                  WHERE address = ANY (CAST(:addresses AS INET[]))))
+      ORDER BY game_server_id, bucket DESC) AS gss_latest_buckets
+         JOIN game_server ON game_server.id = gss_latest_buckets.game_server_id
+WHERE gss_latest_buckets.avg_trust_score < :cutoff
+  -- Where server is in set of servers last seen in 24 hours.
+  AND gss_latest_buckets.game_server_id IN (SELECT game_server_id
+                                            FROM game_server_latest
+                                            WHERE time >= now() - interval '24 hours')
+GROUP BY game_server.address;
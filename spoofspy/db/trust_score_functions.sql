@@ -0,0 +1,171 @@
+-- In-database trust score evaluation, mirrors
+-- spoofspy.heuristics.trust.eval_trust_score without temporal
+-- features and roster clusters, as used by historical re-scoring.
+-- Penalty curves, rule sets and reputation ranges are passed in
+-- by the caller so that Python stays the single source of truth.
+-- Check parity with tests/test_sql_scoring.py and check_sql_scoring.py
+-- after changing either.
+
+-- Concurrent replacements by multiple workers fail otherwise.
+SELECT pg_advisory_xact_lock(hashtext('spoofspy_trust_score'));
+
+-- numpy.interp over ascending xs.
+CREATE OR REPLACE FUNCTION spoofspy_interp(
+    x DOUBLE PRECISION,
+    xs DOUBLE PRECISION[],
+    ys DOUBLE PRECISION[]
+) RETURNS DOUBLE PRECISION
+    LANGUAGE plpgsql
+    IMMUTABLE
+AS
+$$
+DECLARE
+    n INTEGER := cardinality(xs);
+BEGIN
+    IF x IS NULL THEN
+        RETURN NULL;
+    END IF;
+    IF x <= xs[1] THEN
+        RETURN ys[1];
+    END IF;
+    IF x >= xs[n] THEN
+        RETURN ys[n];
+    END IF;
+    FOR i IN 1..n - 1
+        LOOP
+            IF x < xs[i + 1] THEN
+                RETURN (ys[i + 1] - ys[i]) / (xs[i + 1] - xs[i]) * (x - xs[i]) + ys[i];
+            END IF;
+        END LOOP;
+    RETURN ys[n];
+END;
+$$;
+
+-- ReputationIndex.lookup over the arrays of ReputationIndex.to_arrays.
+-- Port ranges are over (port << 32) | address keys.
+CREATE OR REPLACE FUNCTION spoofspy_reputation_multiplier(
+    address BIGINT,
+    port INTEGER,
+    range_starts BIGINT[],
+    range_ends BIGINT[],
+    range_multipliers DOUBLE PRECISION[],
+    port_range_starts BIGINT[],
+    port_range_ends BIGINT[],
+    port_range_multipliers DOUBLE PRECISION[]
+) RETURNS DOUBLE PRECISION
+    LANGUAGE sql
+    IMMUTABLE
+AS
+$$
+SELECT least(
+               coalesce((SELECT min(p.multiplier)
+                         FROM unnest(port_range_starts, port_range_ends,
+                                     port_range_multipliers)
+                                  AS p(range_start, range_end, multiplier)
+                         WHERE (($2::BIGINT << 32) | $1)
+                                   BETWEEN p.range_start AND p.range_end), 1.0),
+               coalesce((SELECT min(r.multiplier)
+                         FROM unnest(range_starts, range_ends, range_multipliers)
+                                  AS r(range_start, range_end, multiplier)
+                         WHERE $1 BETWEEN r.range_start AND r.range_end), 1.0)
+       );
+$$;
+
+CREATE OR REPLACE FUNCTION spoofspy_trust_score(
+    s game_server_state,
+    reputation_multiplier DOUBLE PRECISION,
+    player_count_x DOUBLE PRECISION[],
+    player_count_y DOUBLE PRECISION[],
+    ww_bots TEXT[],
+    rs2_bots TEXT[],
+    gom4_bots TEXT[],
+    gom3_mutators TEXT[],
+    gom4_mutators TEXT[]
+) RETURNS DOUBLE PRECISION
+    LANGUAGE plpgsql
+    IMMUTABLE
+AS
+$$
+DECLARE
+    no_response_penalty CONSTANT DOUBLE PRECISION := 0.33;
+    score                        DOUBLE PRECISION := 1.0;
+    bots                         TEXT[];
+    bot_count                    INTEGER;
+    penalty_fix                  DOUBLE PRECISION;
+    n_pi_count_diff              DOUBLE PRECISION;
+    steam_pi_diff                DOUBLE PRECISION;
+    eos_pi_diff                  DOUBLE PRECISION;
+BEGIN
+    IF reputation_multiplier <= 0.0 THEN
+        RETURN 0.0;
+    END IF;
+
+    -- Known mutators/mods, bot names of their bot list are not penalized.
+    IF s.a2s_info_responded AND left(s.map, 2) = 'WW' AND left(s.a2s_map_name, 2) = 'WW' THEN
+        bots := ww_bots;
+    ELSIF EXISTS (SELECT
+                  FROM unnest(s.a2s_mutators_running) AS m(name)
+                  WHERE lower(m.name) = ANY (gom3_mutators)) THEN
+        bots := rs2_bots;
+    ELSIF EXISTS (SELECT
+                  FROM unnest(s.a2s_mutators_running) AS m(name)
+                  WHERE lower(m.name) = ANY (gom4_mutators)) THEN
+        bots := gom4_bots;
+    END IF;
+
+    IF s.secure IS NOT TRUE THEN
+        score := score - 0.1;
+    END IF;
+
+    IF s.a2s_info_responded THEN
+        score := score - spoofspy_interp(
+                abs(s.players - s.a2s_player_count), player_count_x, player_count_y);
+    ELSE
+        score := score - no_response_penalty;
+    END IF;
+
+    IF s.a2s_rules_responded THEN
+        n_pi_count_diff := abs(s.a2s_pi_count
+            - (s.a2s_num_public_connections - s.a2s_num_open_public_connections));
+        steam_pi_diff := abs(s.players - coalesce(s.a2s_pi_steam_count, 0));
+        eos_pi_diff := abs((s.a2s_pi_count - s.players) - coalesce(s.a2s_pi_eos_count, 0));
+
+        IF steam_pi_diff > 2 AND n_pi_count_diff > 2 THEN
+            bot_count := 0;
+            IF bots IS NOT NULL THEN
+                -- Steam PIs within PI_COUNT, see trust._bot_count.
+                SELECT count(*)
+                INTO bot_count
+                FROM unnest(s.a2s_pi_names[1:s.a2s_pi_count],
+                            s.a2s_pi_platforms[1:s.a2s_pi_count]) AS p(name, platform)
+                WHERE p.platform = 1
+                  AND p.name = ANY (bots);
+            END IF;
+
+            penalty_fix := bot_count * 0.95;
+            IF penalty_fix > 0 THEN
+                n_pi_count_diff := abs(n_pi_count_diff - penalty_fix);
+                steam_pi_diff := abs(steam_pi_diff - penalty_fix);
+            END IF;
+        END IF;
+
+        score := score - 3.0 * (
+                    3.0 * spoofspy_interp(n_pi_count_diff, player_count_x, player_count_y)
+                + 2.5 * spoofspy_interp(steam_pi_diff, player_count_x, player_count_y)
+                + 1.0 * spoofspy_interp(eos_pi_diff, player_count_x, player_count_y)
+            ) / 6.5;
+    ELSE
+        score := score - no_response_penalty;
+    END IF;
+
+    IF s.a2s_players_responded THEN
+        score := score - spoofspy_interp(
+                abs(coalesce(cardinality(s.a2s_player_name_ids), 0) - s.players),
+                player_count_x, player_count_y);
+    ELSE
+        score := score - no_response_penalty;
+    END IF;
+
+    RETURN greatest(0.0, least(1.0, score)) * reputation_multiplier;
+END;
+$$;
@@ -0,0 +1,12 @@
+-- Servers whose trust score has been fluctuating recently.
+SELECT game_server.address      AS game_server_address,
+       game_server.port         AS game_server_port,
+       gss_volatile.trust_score_stddev
+FROM (SELECT game_server_id,
+             stddev_samp(trust_score) AS trust_score_stddev
+      FROM game_server_state
+      WHERE trust_score IS NOT NULL
+        AND time >= now() - interval '24 hours'
+      GROUP BY game_server_id
+      HAVING stddev_samp(trust_score) >= :min_stddev) AS gss_volatile
+         JOIN game_server ON game_server.id = gss_volatile.game_server_id;
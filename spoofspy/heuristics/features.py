@@ -0,0 +1,190 @@
+import dataclasses
+import datetime
+import math
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from typing import Optional
+
+# EWMA smoothing factor, roughly a 10 sample window.
+ALPHA = 0.2
+# Consecutive unchanged scores for a player to count as frozen.
+FROZEN_MIN_STREAK = 3
+
+# Player count anomaly detection. States before ANOMALY_MIN_SAMPLES
+# only warm up the estimators. Deviations are in standard deviations,
+# which are at least ANOMALY_MIN_STD players.
+ANOMALY_MIN_SAMPLES = 6
+ANOMALY_MIN_STD = 1.0
+# Player count delta of at least JUMP_MIN_PLAYERS that deviates
+# from the EWMA of deltas by more than JUMP_SIGMA.
+JUMP_SIGMA = 4.0
+JUMP_MIN_PLAYERS = 8
+# Two-sided CUSUM of the player count level, with CUSUM_K allowed
+# drift per state, raising a shift when a sum exceeds CUSUM_H.
+CUSUM_K = 0.5
+CUSUM_H = 5.0
+
+# Anomaly flag bits.
+ANOMALY_JUMP = 1 << 0
+ANOMALY_SHIFT_UP = 1 << 1
+ANOMALY_SHIFT_DOWN = 1 << 2
+
+
+@dataclass(slots=True)
+class ServerFeatures:
+    """Rolling per-server temporal features. Updated incrementally
+    from consecutive states with `update`, so that the trust heuristic
+    can use them without querying state history.
+    """
+    time: Optional[datetime.datetime] = None
+    samples: int = 0
+    players: Optional[int] = None
+    # EWMA and EW variance of player count deltas between states.
+    players_delta_ewma: float = 0.0
+    players_delta_var: float = 0.0
+    # EWMA and EW variance of the player count.
+    players_ewma: float = 0.0
+    players_var: float = 0.0
+    # Upper and lower CUSUM of standardized player counts.
+    players_cusum_pos: float = 0.0
+    players_cusum_neg: float = 0.0
+    # Anomaly flags raised by the newest state and
+    # EWMA of the ratio of states with any flags.
+    anomaly_flags: int = 0
+    anomaly_ewma: float = 0.0
+    # EWMA of the ratio of players whose duration decreased
+    # between consecutive states.
+    duration_violation_ewma: float = 0.0
+    # A2S players of the previous state.
+    player_name_ids: list[int] = field(default_factory=list)
+    player_scores: list[int] = field(default_factory=list)
+    player_durations: list[float] = field(default_factory=list)
+    # Number of consecutive states each player's non-zero
+    # score has not changed.
+    player_frozen: list[int] = field(default_factory=list)
+
+    @property
+    def frozen_score_ratio(self) -> float:
+        if not self.player_frozen:
+            return 0.0
+        frozen = sum(1 for n in self.player_frozen if n >= FROZEN_MIN_STREAK)
+        return frozen / len(self.player_frozen)
+
+    def to_dict(self) -> dict[str, Any]:
+        return dataclasses.asdict(self)
+
+
+def update(features: ServerFeatures, state: Any) -> ServerFeatures:
+    """Return features updated with state. States not newer
+    than the features are ignored.
+    """
+    if features.time is not None and state.time <= features.time:
+        return features
+
+    new = dataclasses.replace(
+        features,
+        time=state.time,
+        samples=features.samples + 1,
+        anomaly_flags=0,
+    )
+
+    if state.players is not None:
+        if features.players is not None:
+            _update_player_count(features, new, state.players)
+        else:
+            new.players_ewma = float(state.players)
+        new.players = state.players
+
+    if state.a2s_players_responded:
+        name_ids = state.a2s_player_name_ids or []
+        scores = state.a2s_player_scores or []
+        durations = state.a2s_player_durations or []
+
+        prev = {
+            name_id: (score, duration, frozen)
+            for name_id, score, duration, frozen in zip(
+                features.player_name_ids,
+                features.player_scores,
+                features.player_durations,
+                features.player_frozen,
+            )
+        }
+
+        frozen_counts = []
+        compared = 0
+        violations = 0
+        for name_id, score, duration in zip(name_ids, scores, durations):
+            try:
+                prev_score, prev_duration, prev_frozen = prev[name_id]
+            except KeyError:
+                frozen_counts.append(0)
+                continue
+            compared += 1
+            if duration < prev_duration:
+                violations += 1
+            # Zero scores are common for idle players, not counted.
+            frozen_counts.append(
+                (prev_frozen + 1) if (score == prev_score and score != 0) else 0)
+
+        if compared:
+            new.duration_violation_ewma = (
+                    (1.0 - ALPHA) * features.duration_violation_ewma
+                    + ALPHA * (violations / compared))
+
+        new.player_name_ids = list(name_ids)
+        new.player_scores = list(scores)
+        new.player_durations = list(durations)
+        new.player_frozen = frozen_counts
+
+    return new
+
+
+def _ew_update(mean: float, var: float, x: float) -> tuple[float, float]:
+    diff = x - mean
+    incr = ALPHA * diff
+    return mean + incr, (1.0 - ALPHA) * (var + diff * incr)
+
+
+def _update_player_count(
+        features: ServerFeatures,
+        new: ServerFeatures,
+        players: int,
+):
+    """Update player count estimators and anomaly flags of new
+    from the previous features. Statistics are tested against the
+    estimators before they are updated with the new count.
+    """
+    delta = players - features.players  # type: ignore[operator]
+    flags = 0
+
+    delta_std = max(math.sqrt(features.players_delta_var), ANOMALY_MIN_STD)
+    if (abs(delta) >= JUMP_MIN_PLAYERS
+            and abs(delta - features.players_delta_ewma)
+            > JUMP_SIGMA * delta_std):
+        flags |= ANOMALY_JUMP
+
+    z = ((players - features.players_ewma)
+         / max(math.sqrt(features.players_var), ANOMALY_MIN_STD))
+    cusum_pos = max(0.0, features.players_cusum_pos + z - CUSUM_K)
+    cusum_neg = max(0.0, features.players_cusum_neg - z - CUSUM_K)
+    if cusum_pos > CUSUM_H:
+        flags |= ANOMALY_SHIFT_UP
+        cusum_pos = 0.0
+    if cusum_neg > CUSUM_H:
+        flags |= ANOMALY_SHIFT_DOWN
+        cusum_neg = 0.0
+
+    new.players_delta_ewma, new.players_delta_var = _ew_update(
+        features.players_delta_ewma, features.players_delta_var, delta)
+    new.players_ewma, new.players_var = _ew_update(
+        features.players_ewma, features.players_var, players)
+    if features.samples < ANOMALY_MIN_SAMPLES:
+        return
+
+    new.players_cusum_pos = cusum_pos
+    new.players_cusum_neg = cusum_neg
+    new.anomaly_flags = flags
+    new.anomaly_ewma = (
+            (1.0 - ALPHA) * features.anomaly_ewma
+            + ALPHA * (1.0 if flags else 0.0))
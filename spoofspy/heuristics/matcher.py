@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Iterable
+from typing import Mapping
+from typing import Optional
+
+import sqlalchemy.orm
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from spoofspy import db
+
+logger = logging.getLogger(__name__)
+
+KIND_BOT_NAME = "bot_name"
+KIND_MUTATOR = "mutator"
+
+# Minimum interval between rule set version checks.
+RELOAD_INTERVAL = 60.0
+
+
+@dataclass(frozen=True, slots=True)
+class RuleSet:
+    name: str
+    kind: str
+    # Bit index of this rule set in the match bitmasks.
+    bit: int
+    values: frozenset[str]
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledMatcher:
+    """Frozen lookup tables mapping a bot name or a lower case
+    mutator name to a bitmask of the rule sets it belongs to.
+    """
+    version: tuple
+    bot_names: Mapping[str, int]
+    mutators: Mapping[str, int]
+
+    def bot_mask(self, name: Optional[str]) -> int:
+        return self.bot_names.get(name, 0)  # type: ignore[arg-type]
+
+    def mutator_mask(self, mutators: Optional[Iterable[str]]) -> int:
+        mask = 0
+        for mut in mutators or ():
+            mask |= self.mutators.get(mut.lower(), 0)
+        return mask
+
+    def bot_names_of(self, bit: int) -> list[str]:
+        return [name for name, mask in self.bot_names.items()
+                if mask & (1 << bit)]
+
+    def mutators_of(self, bit: int) -> list[str]:
+        """Lower case mutator names of the rule set."""
+        return [mut for mut, mask in self.mutators.items()
+                if mask & (1 << bit)]
+
+
+def compile_rule_sets(
+        rule_sets: Iterable[RuleSet],
+        version: tuple = (),
+) -> CompiledMatcher:
+    tables: dict[str, dict[str, int]] = {
+        KIND_BOT_NAME: {},
+        KIND_MUTATOR: {},
+    }
+    for rule_set in rule_sets:
+        table = tables[rule_set.kind]
+        for value in rule_set.values:
+            if rule_set.kind == KIND_MUTATOR:
+                value = value.lower()
+            table[value] = table.get(value, 0) | (1 << rule_set.bit)
+
+    return CompiledMatcher(
+        version=version,
+        bot_names=MappingProxyType(tables[KIND_BOT_NAME]),
+        mutators=MappingProxyType(tables[KIND_MUTATOR]),
+    )
+
+
+class MatcherStore:
+    """Holds the current compiled matcher. Starts with the default
+    rule sets, rule sets stored in the database replace the defaults
+    by name and are hot-swapped when their versions change.
+    """
+
+    def __init__(self, defaults: Iterable[RuleSet]):
+        self._defaults = {rs.name: rs for rs in defaults}
+        self._current = compile_rule_sets(self._defaults.values())
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    @property
+    def current(self) -> CompiledMatcher:
+        return self._current
+
+    def refresh(self, session: sqlalchemy.orm.Session) -> bool:
+        """Recompile if the stored rule set versions have changed.
+        Returns True if the matcher was swapped.
+        """
+        version = tuple(session.execute(
+            select(
+                db.models.MatcherRuleSet.name,
+                db.models.MatcherRuleSet.version,
+            ).order_by(
+                db.models.MatcherRuleSet.name,
+            )
+        ).tuples())
+        if version == self._current.version:
+            return False
+
+        rule_sets = dict(self._defaults)
+        for rs in session.scalars(select(db.models.MatcherRuleSet)):
+            rule_sets[rs.name] = RuleSet(
+                name=rs.name,
+                kind=rs.kind,
+                bit=rs.bit,
+                values=frozenset(rs.entries or ()),
+            )
+
+        self._current = compile_rule_sets(rule_sets.values(), version)
+        logger.info("compiled matcher rule sets: %s", version)
+        return True
+
+    def maybe_refresh(self, session_maker: sqlalchemy.orm.sessionmaker):
+        """Rate limited `refresh`, errors are logged and the
+        current matcher is kept.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if (now - self._last_check) < RELOAD_INTERVAL:
+                return
+            self._last_check = now
+
+        try:
+            with session_maker() as sess:
+                self.refresh(sess)
+        except Exception as e:
+            logger.error("error refreshing matcher rule sets: %s", e)
+
+    def seed(self, session: sqlalchemy.orm.Session):
+        """Store default rule sets missing from the database."""
+        session.execute(
+            pg_insert(db.models.MatcherRuleSet).values([
+                {
+                    "name": rs.name,
+                    "kind": rs.kind,
+                    "bit": rs.bit,
+                    "version": 1,
+                    "entries": sorted(rs.values),
+                }
+                for rs in self._defaults.values()
+            ]).on_conflict_do_nothing(),
+        )
@@ -0,0 +1,300 @@
+import bisect
+import ipaddress
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+from typing import Optional
+from typing import Sequence
+from typing import cast
+
+import numpy as np
+import sqlalchemy.orm
+from sqlalchemy import func
+from sqlalchemy import select
+
+from spoofspy import db
+
+logger = logging.getLogger(__name__)
+
+# Minimum interval between reputation entry version checks.
+RELOAD_INTERVAL = 60.0
+
+# Prefix-to-ASN file record: inclusive IPv4 range and ASN as
+# little-endian uint32s, sorted by range start. See `write_asn_file`.
+ASN_RECORD_DTYPE = np.dtype([
+    ("start", "<u4"),
+    ("end", "<u4"),
+    ("asn", "<u4"),
+])
+
+
+@dataclass(frozen=True, slots=True)
+class Entry:
+    """Trust score multiplier for an IPv4 network, optionally only
+    for a single port, or for all networks announced by an ASN.
+    Multiplier 0.0 blacklists, values in (0.0, 1.0) down-weight.
+    """
+    multiplier: float
+    network: Optional[ipaddress.IPv4Network] = None
+    port: Optional[int] = None
+    asn: Optional[int] = None
+
+
+class ReputationIndex:
+    """Disjoint sorted IPv4 intervals over integer addresses with
+    the minimum multiplier of all overlapping entries. Port entries
+    are intervals over `(port << 32) | address` keys, so that each
+    port has its own address intervals. Lookups are O(log n).
+    """
+
+    def __init__(
+            self,
+            entries: Iterable[Entry],
+            asn_ranges: Optional[np.ndarray] = None,
+            version: tuple = (),
+    ):
+        self.version = version
+
+        ranges: list[tuple[int, int, float]] = []
+        port_ranges: list[tuple[int, int, float]] = []
+        for entry in entries:
+            if entry.network is not None:
+                start = int(entry.network.network_address)
+                end = int(entry.network.broadcast_address)
+                if entry.port is not None:
+                    key = _port_key(0, entry.port)
+                    port_ranges.append(
+                        (key | start, key | end, entry.multiplier))
+                else:
+                    ranges.append((start, end, entry.multiplier))
+            elif entry.asn is not None:
+                if asn_ranges is None:
+                    logger.warning("no ASN file loaded, ignoring ASN entry: %s",
+                                   entry)
+                    continue
+                announced = asn_ranges[asn_ranges["asn"] == entry.asn]
+                ranges.extend(
+                    (int(s), int(e), entry.multiplier)
+                    for s, e in zip(announced["start"], announced["end"])
+                )
+
+        self._starts, self._ends, self._multipliers = _flatten(
+            ranges, np.uint32)
+        self._starts_list = cast(list[int], self._starts.tolist())
+        (self._port_starts,
+         self._port_ends,
+         self._port_multipliers) = _flatten(port_ranges, np.uint64)
+        self._port_starts_list = cast(list[int], self._port_starts.tolist())
+
+    def __len__(self) -> int:
+        return len(self._starts) + len(self._port_starts)
+
+    def to_arrays(self) -> dict[str, list]:
+        """Index as lists, parameters of the in-database
+        spoofspy_reputation_multiplier function.
+        """
+        return {
+            "range_starts": cast(list[int], self._starts.tolist()),
+            "range_ends": cast(list[int], self._ends.tolist()),
+            "range_multipliers": cast(list[float], self._multipliers.tolist()),
+            "port_range_starts": cast(list[int], self._port_starts.tolist()),
+            "port_range_ends": cast(list[int], self._port_ends.tolist()),
+            "port_range_multipliers": cast(
+                list[float], self._port_multipliers.tolist()),
+        }
+
+    def lookup(self, address: ipaddress.IPv4Address, port: int) -> float:
+        """Trust score multiplier of a server, 1.0 if not listed."""
+        addr = int(address)
+        return min(
+            _lookup_one(self._starts_list, self._ends, self._multipliers,
+                        addr),
+            _lookup_one(self._port_starts_list, self._port_ends,
+                        self._port_multipliers, _port_key(addr, port)),
+        )
+
+    def lookup_batch(
+            self,
+            addresses: Sequence[int],
+            ports: Sequence[int],
+    ) -> np.ndarray:
+        """Vectorized `lookup` over integer addresses."""
+        addrs = np.asarray(addresses, dtype=np.uint32)
+        result = _lookup_many(
+            self._starts, self._ends, self._multipliers, addrs)
+        if len(self._port_starts):
+            keys = _port_key(
+                addrs.astype(np.uint64), np.asarray(ports, dtype=np.uint64))
+            result = np.minimum(result, _lookup_many(
+                self._port_starts, self._port_ends, self._port_multipliers,
+                keys))
+        return result
+
+
+def _port_key(addr, port):
+    return (port << 32) | addr
+
+
+def _lookup_one(
+        starts: list[int],
+        ends: np.ndarray,
+        multipliers: np.ndarray,
+        key: int,
+) -> float:
+    idx = bisect.bisect_right(starts, key) - 1
+    if idx >= 0 and key <= ends[idx]:
+        return float(multipliers[idx])
+    return 1.0
+
+
+def _lookup_many(
+        starts: np.ndarray,
+        ends: np.ndarray,
+        multipliers: np.ndarray,
+        keys: np.ndarray,
+) -> np.ndarray:
+    result: np.ndarray = np.ones(len(keys), dtype=np.float64)
+    if not len(starts):
+        return result
+    idx = np.searchsorted(starts, keys, side="right") - 1
+    valid = idx >= 0
+    safe_idx = np.where(valid, idx, 0)
+    hit = valid & (keys <= ends[safe_idx])
+    return np.where(hit, multipliers[safe_idx], result)
+
+
+def _flatten(
+        ranges: list[tuple[int, int, float]],
+        dtype: type[np.unsignedinteger] = np.uint32,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Split overlapping inclusive ranges into disjoint ranges,
+    each with the minimum multiplier of the ranges covering it.
+    """
+    if not ranges:
+        return (np.empty(0, dtype=dtype),
+                np.empty(0, dtype=dtype),
+                np.empty(0, dtype=np.float64))
+
+    bounds = sorted(
+        {start for start, _, _ in ranges}
+        | {end + 1 for _, end, _ in ranges}
+    )
+    starts: list[int] = []
+    ends: list[int] = []
+    multipliers: list[float] = []
+    ranges = sorted(ranges)
+    active: list[tuple[int, float]] = []  # (end, multiplier)
+    r = 0
+    for lo, hi in zip(bounds, bounds[1:]):
+        while r < len(ranges) and ranges[r][0] <= lo:
+            active.append((ranges[r][1], ranges[r][2]))
+            r += 1
+        active = [a for a in active if a[0] >= lo]
+        if not active:
+            continue
+        m = min(a[1] for a in active)
+        if starts and ends[-1] == lo - 1 and multipliers[-1] == m:
+            ends[-1] = hi - 1
+        else:
+            starts.append(lo)
+            ends.append(hi - 1)
+            multipliers.append(m)
+
+    return (np.array(starts, dtype=dtype),
+            np.array(ends, dtype=dtype),
+            np.array(multipliers, dtype=np.float64))
+
+
+def load_asn_file(path: Path) -> np.ndarray:
+    """Memory-map a prefix-to-ASN file written by `write_asn_file`."""
+    return np.memmap(path, dtype=ASN_RECORD_DTYPE, mode="r")
+
+
+def write_asn_file(tsv_path: Path, out_path: Path):
+    """Convert a tab separated "range_start range_end asn ..."
+    file (e.g. iptoasn.com ip2asn-v4-u32.tsv) to the binary
+    format read by `load_asn_file`.
+    """
+    records = []
+    with tsv_path.open() as f:
+        for line in f:
+            fields = line.split("\t")
+            if len(fields) < 3:
+                continue
+            asn = int(fields[2])
+            if asn == 0:
+                continue
+            records.append((int(fields[0]), int(fields[1]), asn))
+    records.sort()
+    np.array(records, dtype=ASN_RECORD_DTYPE).tofile(out_path)
+
+
+class ReputationStore:
+    """Holds the current reputation index. Starts with the default
+    entries, entries stored in the database are added to them and
+    the index is rebuilt when they change.
+    """
+
+    def __init__(self, defaults: Iterable[Entry]):
+        self._defaults = tuple(defaults)
+        self._asn_ranges: Optional[np.ndarray] = None
+        asn_file = os.environ.get("SPOOFSPY_ASN_FILE")
+        if asn_file:
+            try:
+                self._asn_ranges = load_asn_file(Path(asn_file))
+            except Exception as e:
+                logger.error("error loading ASN file '%s': %s", asn_file, e)
+        self._current = ReputationIndex(self._defaults, self._asn_ranges)
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+
+    @property
+    def current(self) -> ReputationIndex:
+        return self._current
+
+    def refresh(self, session: sqlalchemy.orm.Session) -> bool:
+        """Rebuild the index if stored entries have changed.
+        Returns True if the index was swapped.
+        """
+        version = tuple(session.execute(
+            select(
+                func.count(),
+                func.max(db.models.ReputationEntry.updated_at),
+            )
+        ).one())
+        if version == self._current.version:
+            return False
+
+        entries = list(self._defaults)
+        for e in session.scalars(select(db.models.ReputationEntry)):
+            entries.append(Entry(
+                multiplier=e.multiplier,
+                network=(ipaddress.IPv4Network(e.network)
+                         if e.network is not None else None),
+                port=e.port,
+                asn=e.asn,
+            ))
+
+        self._current = ReputationIndex(entries, self._asn_ranges, version)
+        logger.info("built reputation index with %s entries", len(self._current))
+        return True
+
+    def maybe_refresh(self, session_maker: sqlalchemy.orm.sessionmaker):
+        """Rate limited `refresh`, errors are logged and the
+        current index is kept.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if (now - self._last_check) < RELOAD_INTERVAL:
+                return
+            self._last_check = now
+
+        try:
+            with session_maker() as sess:
+                self.refresh(sess)
+        except Exception as e:
+            logger.error("error refreshing reputation index: %s", e)
@@ -0,0 +1,121 @@
+from collections import defaultdict
+from typing import Hashable
+from typing import Iterable
+from typing import Sequence
+from typing import TypeVar
+
+import numpy as np
+
+K = TypeVar("K", bound=Hashable)
+
+NUM_PERM = 64
+# NUM_PERM = BANDS * ROWS. With 16 bands of 4 rows, rosters with
+# Jaccard similarity of 0.6 become candidates with ~0.9 probability.
+BANDS = 16
+ROWS = 4
+# Candidates are verified with the estimated Jaccard similarity.
+JACCARD_THRESHOLD = 0.6
+# Smaller rosters match each other by chance too easily.
+MIN_ROSTER_SIZE = 4
+# Buckets larger than this are verified against the first
+# member only, to keep the clustering near-linear.
+MAX_PAIRWISE_BUCKET = 32
+
+# Mersenne prime 2^31 - 1. Name IDs are below it and
+# a * x + b stays below 2^64.
+_PRIME = np.uint64((1 << 31) - 1)
+
+
+class MinHasher:
+    """MinHash signatures of integer sets using universal
+    hash functions h(x) = (a * x + b) mod p.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)[:, None]
+
+    def signature(self, values: Iterable[int]) -> np.ndarray:
+        x = np.fromiter(values, dtype=np.uint64) % _PRIME
+        return ((self._a * x[None, :] + self._b) % _PRIME).min(axis=1)
+
+
+def jaccard_estimate(sig1: np.ndarray, sig2: np.ndarray) -> float:
+    return float(np.mean(sig1 == sig2))
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self._parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self._parent[i] != i:
+            self._parent[i] = self._parent[self._parent[i]]
+            i = self._parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        ri = self.find(i)
+        rj = self.find(j)
+        if ri != rj:
+            self._parent[rj] = ri
+
+
+def cluster(
+        keys: Sequence[K],
+        rosters: Sequence[Iterable[int]],
+        hasher: MinHasher | None = None,
+        threshold: float = JACCARD_THRESHOLD,
+) -> list[list[K]]:
+    """Cluster keys whose rosters have an estimated Jaccard similarity
+    of at least threshold, using MinHash signatures indexed in LSH
+    band buckets. Returns clusters with at least 2 keys.
+    """
+    if hasher is None:
+        hasher = MinHasher()
+
+    idx_keys: list[K] = []
+    sigs = []
+    for key, roster in zip(keys, rosters):
+        roster = set(roster)
+        if len(roster) < MIN_ROSTER_SIZE:
+            continue
+        idx_keys.append(key)
+        sigs.append(hasher.signature(roster))
+
+    if len(sigs) < 2:
+        return []
+
+    signatures = np.stack(sigs)
+    uf = _UnionFind(len(signatures))
+
+    def _verify(i: int, j: int):
+        if jaccard_estimate(signatures[i], signatures[j]) >= threshold:
+            uf.union(i, j)
+
+    for band in range(BANDS):
+        band_sigs = signatures[:, band * ROWS:(band + 1) * ROWS]
+        buckets: dict[bytes, list[int]] = defaultdict(list)
+        for i, band_sig in enumerate(band_sigs):
+            buckets[band_sig.tobytes()].append(i)
+
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            if len(members) <= MAX_PAIRWISE_BUCKET:
+                for n, i in enumerate(members):
+                    for j in members[n + 1:]:
+                        if uf.find(i) != uf.find(j):
+                            _verify(i, j)
+            else:
+                first = members[0]
+                for j in members[1:]:
+                    if uf.find(first) != uf.find(j):
+                        _verify(first, j)
+
+    clusters: dict[int, list[K]] = defaultdict(list)
+    for i, key in enumerate(idx_keys):
+        clusters[uf.find(i)].append(key)
+
+    return [c for c in clusters.values() if len(c) >= 2]
@@ -1,13 +1,52 @@
 import ipaddress
 import logging
+import random
+from typing import Optional
 
 import numpy as np
 from spoofspy import db
+from spoofspy.heuristics import features as features_
+from spoofspy.heuristics import matcher
+from spoofspy.heuristics import reputation
 
 logger = logging.getLogger(__name__)
 
-# TODO: store penalty curve and algorithm versions in db?
-#   - Ability do discern evaluations done on different versions.
+# Stored alongside trust scores in trust_algo_version. Bump this
+# whenever the evaluation changes in a way that affects scores and
+# re-score history with `spoofspy.jobs.tasks.rescore_trust_scores`.
+ALGO_VERSION = 4
+
+# TODO: store penalty curve versions in db?
+
+# Fraction of evaluations logged in detail at DEBUG level.
+LOG_SAMPLE_RATE = 0.01
+
+# Penalty breakdown stored in trust_penalties, weighted penalties
+# subtracted from the score at these indices. no_response is the
+# sum of no response penalties, reputation_multiplier the
+# multiplier applied to the clamped score.
+PENALTY_NAMES = (
+    "insecure",
+    "info_player_count",
+    "rules_pi_count",
+    "players_count",
+    "frozen_scores",
+    "duration_violations",
+    "player_count_anomalies",
+    "roster_cluster",
+    "no_response",
+    "reputation_multiplier",
+)
+PENALTY_INSECURE = 0
+PENALTY_INFO_PLAYER_COUNT = 1
+PENALTY_RULES_PI_COUNT = 2
+PENALTY_PLAYERS_COUNT = 3
+PENALTY_FROZEN_SCORES = 4
+PENALTY_DURATION_VIOLATIONS = 5
+PENALTY_PLAYER_COUNT_ANOMALIES = 6
+PENALTY_ROSTER_CLUSTER = 7
+PENALTY_NO_RESPONSE = 8
+PENALTY_REPUTATION_MULTIPLIER = 9
 
 # Player count difference penalty curve x values.
 player_count_x = np.array([
@@ -32,6 +71,22 @@ player_count_y = np.array([
     5.0,
 ])
 
+# Minimum number of states in temporal features before they are used.
+FEATURES_MIN_SAMPLES = 6
+# Frozen player score ratio penalty curve.
+frozen_score_x = np.array([0.0, 0.5, 0.8, 1.0])
+frozen_score_y = np.array([0.0, 0.0, 0.1, 0.3])
+# Duration violation ratio EWMA penalty curve.
+duration_violation_x = np.array([0.0, 0.1, 0.5, 1.0])
+duration_violation_y = np.array([0.0, 0.0, 0.2, 0.4])
+# Player count anomaly ratio EWMA penalty curve.
+anomaly_x = np.array([0.0, 0.1, 0.3, 0.6])
+anomaly_y = np.array([0.0, 0.0, 0.15, 0.4])
+
+# Roster cluster size penalty curve.
+roster_cluster_x = np.array([2, 3, 5, 10])
+roster_cluster_y = np.array([0.1, 0.2, 0.4, 0.6])
+
 ww_bots = {
     "Perttu",
     "Antti",
@@ -365,6 +420,34 @@ gom4_bots = rs2_bots | {
 }
 
 
+# Rule set bit indices. Bot name lists and mutator
+# signatures have their own bitmasks.
+BOTS_WW = 0
+BOTS_SEED_MUTATOR = 1
+BOTS_RS2 = 2
+BOTS_GOM4 = 3
+MUTATOR_GOM3 = 0
+MUTATOR_GOM4 = 1
+
+# Defaults used until overridden by rule sets stored in the database.
+DEFAULT_RULE_SETS = (
+    matcher.RuleSet("ww_bots", matcher.KIND_BOT_NAME, BOTS_WW,
+                    frozenset(ww_bots)),
+    matcher.RuleSet("seed_mutator_bots", matcher.KIND_BOT_NAME,
+                    BOTS_SEED_MUTATOR, frozenset(seed_mutator_bots)),
+    matcher.RuleSet("rs2_bots", matcher.KIND_BOT_NAME, BOTS_RS2,
+                    frozenset(rs2_bots)),
+    matcher.RuleSet("gom4_bots", matcher.KIND_BOT_NAME, BOTS_GOM4,
+                    frozenset(gom4_bots)),
+    matcher.RuleSet("gom3_mutators", matcher.KIND_MUTATOR, MUTATOR_GOM3,
+                    frozenset({"gom3.u"})),
+    matcher.RuleSet("gom4_mutators", matcher.KIND_MUTATOR, MUTATOR_GOM4,
+                    frozenset({"gom4.u"})),
+)
+
+rules = matcher.MatcherStore(DEFAULT_RULE_SETS)
+
+
 def _clamp(x: float, x_min: float, x_max: float) -> float:
     if x < x_min:
         return x_min
@@ -374,29 +457,67 @@ def _clamp(x: float, x_min: float, x_max: float) -> float:
 
 
 def _bot_count(
-        pi_objs_actual: list[tuple[int, dict[str, str]]],
-        bot_names: set[str],
+        state: db.models.GameServerState,
+        compiled: matcher.CompiledMatcher,
+        bot_list: int,
 ) -> int:
+    # The server can report old PIs that have already left the
+    # server, so we have to manually "slice" by PI_COUNT.
+    # TODO: check sort order here. The order of PI objects in the
+    #   A2S response is sorted so that this slicing may not actually
+    #   work as intended!
+    names = (state.a2s_pi_names or [])[:state.a2s_pi_count]
+    platforms = (state.a2s_pi_platforms or [])[:state.a2s_pi_count]
+    mask = 1 << bot_list
     bot_count = 0
-    for _, pi_obj in pi_objs_actual:
-        if pi_obj["p"] == "STEAM" and (pi_obj["n"] in bot_names):
+    for name, platform in zip(names, platforms):
+        if (
+                platform == db.models.PiPlatform.STEAM
+                and (compiled.bot_mask(name) & mask)
+        ):
             bot_count += 1
     return bot_count
 
 
 # NOTE: hard-coding score for these now, need to improve
 # score evaluation algorithm to detect these better.
-_bad = (
-    ipaddress.IPv4Address("51.222.28.26"),
-    ipaddress.IPv4Address("51.79.173.138"),
-    ipaddress.IPv4Address("51.195.45.25"),
-    ipaddress.IPv4Address("146.59.94.15"),
+# Defaults used in addition to reputation entries stored in the database.
+DEFAULT_REPUTATION_ENTRIES = (
+    reputation.Entry(0.0, ipaddress.IPv4Network("51.222.28.26/32")),
+    reputation.Entry(0.0, ipaddress.IPv4Network("51.79.173.138/32")),
+    reputation.Entry(0.0, ipaddress.IPv4Network("51.195.45.25/32")),
+    reputation.Entry(0.0, ipaddress.IPv4Network("146.59.94.15/32")),
+    reputation.Entry(0.0, ipaddress.IPv4Network("62.102.148.162/32"), port=47411),
 )
 
+reputation_index = reputation.ReputationStore(DEFAULT_REPUTATION_ENTRIES)
+
+
+def eval_trust_score(
+        state: db.models.GameServerState,
+        reputation_multiplier: Optional[float] = None,
+        features: Optional[features_.ServerFeatures] = None,
+        roster_cluster_size: int = 0,
+) -> float:
+    """Trust score of `eval_trust_breakdown`."""
+    return eval_trust_breakdown(
+        state, reputation_multiplier, features, roster_cluster_size)[0]
 
-def eval_trust_score(state: db.models.GameServerState) -> float:
-    """Evaluate server state trust score in range [0.0, 1.0].
+
+def eval_trust_breakdown(
+        state: db.models.GameServerState,
+        reputation_multiplier: Optional[float] = None,
+        features: Optional[features_.ServerFeatures] = None,
+        roster_cluster_size: int = 0,
+) -> tuple[float, list[float]]:
+    """Evaluate server state trust score in range [0.0, 1.0]
+    and its penalty breakdown, indexed as PENALTY_NAMES.
     1.0 is perfect score and 0.0 is the worst possible score.
+    The score is multiplied by reputation_multiplier, which is
+    looked up from the reputation index if not given. Temporal
+    features of the server before this state are used if given.
+    roster_cluster_size is the number of servers sharing a similar
+    player roster with this server, 0 if not clustered.
 
     TODO: (IMPORTANT/STABILITY):
       - make this function exception safe, return null
@@ -415,27 +536,24 @@ def eval_trust_score(state: db.models.GameServerState) -> float:
     players = state.players  # Steam only.
 
     no_response_penalty = 0.33
-    penalties: list[float] = []
-    weights: list[float] = []
+    breakdown = [0.0] * len(PENALTY_NAMES)
+    log = logger.isEnabledFor(logging.DEBUG) and (
+            random.random() < LOG_SAMPLE_RATE)
     is_ww = False
     is_gom3 = False
     is_gom4 = False
 
-    muts = state.a2s_mutators_running or []
-    muts = [mut.lower() for mut in muts]
-
-    if state.game_server_address in _bad:
-        logger.info("using hard-coded 0 for %s:%s",
-                    state.game_server_address, state.game_server_port)
-        return 0
+    compiled = rules.current
 
-    if (
-            (state.game_server_address == ipaddress.IPv4Address("62.102.148.162"))
-            and (state.game_server_port == 47411)
-    ):
-        logger.info("using hard-coded 0 for %s:%s",
-                    state.game_server_address, state.game_server_port)
-        return 0
+    if reputation_multiplier is None:
+        reputation_multiplier = reputation_index.current.lookup(
+            state.game_server_address, state.game_server_port)
+    breakdown[PENALTY_REPUTATION_MULTIPLIER] = reputation_multiplier
+    if reputation_multiplier <= 0.0:
+        if log:
+            logger.debug("using blacklisted 0 for %s:%s",
+                         state.game_server_address, state.game_server_port)
+        return 0, breakdown
 
     # Check known mutators/mods, be more lenient towards known bots.
     if (
@@ -443,36 +561,37 @@ def eval_trust_score(state: db.models.GameServerState) -> float:
             and state.map.startswith("WW")
             and state.a2s_map_name.startswith("WW")
     ):
-        logger.info(
-            "%s:%s seems to be running Winter War (%s), being more lenient with bot players",
-            state.game_server_address, state.game_server_port, state.map)
+        if log:
+            logger.debug(
+                "%s:%s seems to be running Winter War (%s), being more lenient with bot players",
+                state.game_server_address, state.game_server_port, state.map)
         is_ww = True
-    elif muts and ("gom3.u" in muts):
-        is_gom3 = True
-    elif muts and ("gom4.u" in muts):
-        is_gom4 = True
-
-    if is_gom3 or is_gom4:
-        logger.info(
+    else:
+        mut_mask = compiled.mutator_mask(state.a2s_mutators_running)
+        if mut_mask & (1 << MUTATOR_GOM3):
+            is_gom3 = True
+        elif mut_mask & (1 << MUTATOR_GOM4):
+            is_gom4 = True
+
+    if log and (is_gom3 or is_gom4):
+        logger.debug(
             "%s:%s seems to be running GOM (%s), being more lenient with bot players",
             state.game_server_address, state.game_server_port, state.a2s_mutators_running)
 
     if not state.secure:
-        penalties.append(0.1)
-        weights.append(1.0)
+        breakdown[PENALTY_INSECURE] = 0.1
 
     if state.a2s_info_responded:
         apc = state.a2s_player_count  # Steam only.
         apc_diff = abs(players - apc)
-        # noinspection PyTypeChecker
-        penalties.append(np.interp(
+        breakdown[PENALTY_INFO_PLAYER_COUNT] = float(np.interp(
             apc_diff,
             player_count_x,
             player_count_y,
-        ))  # type: ignore[arg-type]
-        weights.append(1.0)
+        ))
     else:
         score -= no_response_penalty
+        breakdown[PENALTY_NO_RESPONSE] += no_response_penalty
 
     if state.a2s_rules_responded:
         # These include both, Steam and EOS.
@@ -483,34 +602,9 @@ def eval_trust_score(state: db.models.GameServerState) -> float:
         # PI_COUNT includes both platforms and non-player PIs.
         n_pi_count_diff = abs(state.a2s_pi_count - conn_players)
 
-        # The server can report old PIs that have already left the
-        # server, so we have to manually "slice" by PI_COUNT.
-        # TODO: check sort order here. The order of PI objects in the
-        #   A2S response is sorted so that this slicing may not actually
-        #   work as intended!
-        pi_objs_actual = []
-        for pi_idx, a2s_pi_obj in state.a2s_pi_objects.items():
-            try:
-                int_idx = int(pi_idx)
-            except ValueError:
-                continue
-            if int_idx < state.a2s_pi_count:
-                pi_objs_actual.append((int_idx, a2s_pi_obj))
-
-        num_steam_pi_objs = 0
-        num_eos_pi_objs = 0
-        for pi_obj in pi_objs_actual:
-            p = str(pi_obj[1]["p"]).lower()
-            if p == "steam":
-                num_steam_pi_objs += 1
-            elif p == "eos":
-                num_eos_pi_objs += 1
-            else:
-                # What the fuck?
-                logger.error(
-                    "invalid platform '%s' for object: %s",
-                    p, pi_obj
-                )
+        # Counted within PI_COUNT at ingest time.
+        num_steam_pi_objs = state.a2s_pi_steam_count or 0
+        num_eos_pi_objs = state.a2s_pi_eos_count or 0
 
         steam_pi_diff = abs(players - num_steam_pi_objs)
         eos_pi_diff = abs((state.a2s_pi_count - players) - num_eos_pi_objs)
@@ -521,26 +615,27 @@ def eval_trust_score(state: db.models.GameServerState) -> float:
             bot_count = 0
 
             if is_ww:
-                bot_count = _bot_count(pi_objs_actual, ww_bots)
+                bot_count = _bot_count(state, compiled, BOTS_WW)
             elif is_gom3:
-                bot_count = _bot_count(pi_objs_actual, rs2_bots)
+                bot_count = _bot_count(state, compiled, BOTS_RS2)
             elif is_gom4:
-                bot_count = _bot_count(pi_objs_actual, gom4_bots)
+                bot_count = _bot_count(state, compiled, BOTS_GOM4)
 
             penalty_fix = bot_count * 0.95
             if penalty_fix > 0:
                 n_pi_count_diff = abs(n_pi_count_diff - penalty_fix)  # type: ignore[assignment]
                 steam_pi_diff = abs(steam_pi_diff - penalty_fix)  # type: ignore[assignment]
-                logger.info("%s:%s lowered n_pi_count_diff by %s, new value %s",
-                            state.game_server_address,
-                            state.game_server_port,
-                            penalty_fix,
-                            n_pi_count_diff)
-                logger.info("%s:%s lowered steam_pi_diff by %s, new value %s",
-                            state.game_server_address,
-                            state.game_server_port,
-                            penalty_fix,
-                            steam_pi_diff)
+                if log:
+                    logger.debug("%s:%s lowered n_pi_count_diff by %s, new value %s",
+                                 state.game_server_address,
+                                 state.game_server_port,
+                                 penalty_fix,
+                                 n_pi_count_diff)
+                    logger.debug("%s:%s lowered steam_pi_diff by %s, new value %s",
+                                 state.game_server_address,
+                                 state.game_server_port,
+                                 penalty_fix,
+                                 steam_pi_diff)
 
         pi_count_conn_penalty = np.interp(
             n_pi_count_diff,
@@ -573,44 +668,65 @@ def eval_trust_score(state: db.models.GameServerState) -> float:
             ],
         )
 
-        penalties.append(sub_penalty_avg)
-        weights.append(3.0)
+        breakdown[PENALTY_RULES_PI_COUNT] = float(sub_penalty_avg) * 3.0
 
     else:
         score -= no_response_penalty
+        breakdown[PENALTY_NO_RESPONSE] += no_response_penalty
 
     if state.a2s_players_responded:
         # Steam only.
-        num_a2s_players = len(state.a2s_players)
+        num_a2s_players = len(state.a2s_player_name_ids or [])
         n_a2s_p_diff = abs(num_a2s_players - players)
 
-        # noinspection PyTypeChecker
-        penalties.append(np.interp(
+        breakdown[PENALTY_PLAYERS_COUNT] = float(np.interp(
             n_a2s_p_diff,
             player_count_x,
             player_count_y,
-        ))  # type: ignore[arg-type]
-        weights.append(1.0)
+        ))
     else:
         score -= no_response_penalty
+        breakdown[PENALTY_NO_RESPONSE] += no_response_penalty
+
+    if features is not None and features.samples >= FEATURES_MIN_SAMPLES:
+        # Fake player lists tend to repeat the same scores and
+        # report durations that do not increase between queries.
+        breakdown[PENALTY_FROZEN_SCORES] = float(np.interp(
+            features.frozen_score_ratio,
+            frozen_score_x,
+            frozen_score_y,
+        ))
+        breakdown[PENALTY_DURATION_VIOLATIONS] = float(np.interp(
+            features.duration_violation_ewma,
+            duration_violation_x,
+            duration_violation_y,
+        ))
+        # Spoofed player counts jump abruptly between queries.
+        breakdown[PENALTY_PLAYER_COUNT_ANOMALIES] = float(np.interp(
+            features.anomaly_ewma,
+            anomaly_x,
+            anomaly_y,
+        ))
+
+    if roster_cluster_size:
+        # Players can't be on multiple servers at once.
+        breakdown[PENALTY_ROSTER_CLUSTER] = float(np.interp(
+            roster_cluster_size,
+            roster_cluster_x,
+            roster_cluster_y,
+        ))
+
+    for penalty in breakdown[:PENALTY_NO_RESPONSE]:
+        score -= penalty
+
+    trust_score = _clamp(score, 0.0, 1.0) * reputation_multiplier
+    if log:
+        logger.debug(
+            "%s:%s: score: %s, penalties: %s",
+            state.game_server_address,
+            state.game_server_port,
+            trust_score,
+            dict(zip(PENALTY_NAMES, breakdown)),
+        )
 
-    logger.info(
-        "%s:%s: penalties, weights: %s, %s",
-        state.game_server_address,
-        state.game_server_port,
-        penalties,
-        weights,
-    )
-
-    for penalty, weight in zip(penalties, weights):
-        score -= penalty * weight
-
-    trust_score = _clamp(score, 0.0, 1.0)
-    logger.info(
-        "%s:%s: score: %s",
-        state.game_server_address,
-        state.game_server_port,
-        trust_score,
-    )
-
-    return trust_score
+    return trust_score, breakdown
@@ -1,11 +1,15 @@
 from . import a2s_tasks
 from . import app
+from . import scoring
 from . import serialization
 from . import tasks
+from . import trust_cache
 
 __all__ = [
     "a2s_tasks",
     "app",
+    "scoring",
     "serialization",
     "tasks",
+    "trust_cache",
 ]
@@ -1,10 +1,10 @@
 import datetime
-import ipaddress
 import logging
 import socket
 from collections import defaultdict
 from typing import Any
 from typing import Dict
+from typing import List
 from typing import Tuple
 from typing import Union
 
@@ -14,13 +14,20 @@ from a2s import BrokenMessageError
 from a2s import BufferExhaustedError
 from celery import Task
 from celery.utils.log import get_task_logger
+import sqlalchemy.orm
+from sqlalchemy import select
 from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import OperationalError
 
 from spoofspy import db
+from spoofspy import metrics
+from spoofspy import rowcache
 from spoofspy.jobs.app import app
+from spoofspy.jobs.app import redis_client
 
 A2S_TIMEOUT = 5.0
+PLAYER_NAME_CACHE_SIZE = 200_000
 
 logger: logging.Logger = get_task_logger(__name__)
 
@@ -33,6 +40,9 @@ known_a2s_errors = (
     OSError,
 )
 
+# Player name -> PlayerName.id.
+_player_names: dict[str, int] = {}
+
 retry_a2s_task_errors = (
     TimeoutError,
     OperationalError,
@@ -64,6 +74,7 @@ def a2s_info(
         addr: Tuple[str, int],
         gameport: int,
         query_time: datetime.datetime,
+        server_id: int,
 ):
     addr = _coerce_tuple(addr)  # type: ignore[assignment]
     info: a2s.SourceInfo | None = None
@@ -75,6 +86,7 @@ def a2s_info(
         resp_time = datetime.datetime.now(tz=datetime.timezone.utc)
         resp = True
     except TimeoutError as e:
+        metrics.incr(metrics.A2S_INFO_TIMEOUTS)
         # noinspection PyTypeChecker
         if _should_throw_retry(a2s_info):
             raise
@@ -121,25 +133,28 @@ def a2s_info(
     except KeyError:
         pass
 
-    ip_addr_obj = ipaddress.IPv4Address(addr[0])
-    stmt = update(db.models.GameServerState).where(
-        (db.models.GameServerState.time == query_time)
-        & (db.models.GameServerState.game_server_address == ip_addr_obj)
-        & (db.models.GameServerState.game_server_port == gameport)
-    ).values(
-        a2s_info_responded=resp,
-        a2s_info_response_time=resp_time,
-        a2s_server_name=_pop(info_fields, "server_name"),
-        a2s_map_name=_pop(info_fields, "map_name"),
-        a2s_steam_id=_pop(info_fields, "steam_id"),
-        a2s_player_count=_pop(info_fields, "player_count"),
-        a2s_max_players=_pop(info_fields, "max_players"),
-        a2s_open_slots=open_slots,
-        a2s_info=info_fields,
-    )
+    values = {
+        "a2s_info_responded": resp,
+        "a2s_info_response_time": resp_time,
+        "a2s_server_name": _pop(info_fields, "server_name"),
+        "a2s_map_name": _pop(info_fields, "map_name"),
+        "a2s_steam_id": _pop(info_fields, "steam_id"),
+        "a2s_player_count": _pop(info_fields, "player_count"),
+        "a2s_max_players": _pop(info_fields, "max_players"),
+        "a2s_open_slots": open_slots,
+    }
+    latest_stmt = db.latest.update_stmt(server_id, query_time, values)
 
     with app.db_session.begin() as sess:
+        values["a2s_info_hash"] = db.blobs.store(sess, info_fields)
+        stmt = update(db.models.GameServerState).where(
+            (db.models.GameServerState.time == query_time)
+            & (db.models.GameServerState.game_server_id == server_id)
+        ).values(values)
         sess.execute(stmt)
+        sess.execute(latest_stmt)
+    db.blobs.remember([values["a2s_info_hash"]])
+    rowcache.invalidate_state(redis_client(), addr[0], server_id, query_time)
 
     _log_timedelta(
         query_time,
@@ -156,6 +171,7 @@ def a2s_rules(
         addr: Tuple[str, int],
         gameport: int,
         query_time: datetime.datetime,
+        server_id: int,
 ):
     addr = _coerce_tuple(addr)  # type: ignore[assignment]
     rules: Dict[str, str] = {}
@@ -169,6 +185,7 @@ def a2s_rules(
         resp_time = datetime.datetime.now(tz=datetime.timezone.utc)
         resp = True
     except TimeoutError as e:
+        metrics.incr(metrics.A2S_RULES_TIMEOUTS)
         # noinspection PyTypeChecker
         if _should_throw_retry(a2s_info):
             raise
@@ -199,48 +216,29 @@ def a2s_rules(
         mut_str = mut_str.replace('"', "")
         mutators_running = mut_str.split(",")
 
-    # TODO: refactor this loop into functions etc.
-    pi_objs: dict[int, dict[str, str]] = defaultdict(dict)
-    to_del = set()
-    for key, value in rules.items():
-        if key.startswith("PI_"):
-            try:
-                # NOTE: index becomes a string in JSONB.
-                idx = int(key.split("_")[-1])
-                to_del.add(key)
-            except ValueError:
-                continue
-
-            if key.startswith("PI_N_"):
-                pi_objs[idx]["n"] = value
-            elif key.startswith("PI_P_"):
-                # Platform.
-                pi_objs[idx]["p"] = value
-            elif key.startswith("PI_S_"):
-                # Score.
-                pi_objs[idx]["s"] = value
-
-    for key in to_del:
-        del rules[key]
+    pi_values = _pop_pi_arrays(rules, pi_count)
 
-    ip_addr_obj = ipaddress.IPv4Address(addr[0])
-    stmt = update(db.models.GameServerState).where(
-        (db.models.GameServerState.time == query_time)
-        & (db.models.GameServerState.game_server_address == ip_addr_obj)
-        & (db.models.GameServerState.game_server_port == gameport)
-    ).values(
-        a2s_rules_responded=resp,
-        a2s_rules_response_time=resp_time,
-        a2s_num_open_public_connections=num_open_pub,
-        a2s_num_public_connections=num_pub,
-        a2s_pi_count=pi_count,
-        a2s_pi_objects=pi_objs,
-        a2s_mutators_running=mutators_running,
-        a2s_rules=rules,
-    )
+    values = {
+        "a2s_rules_responded": resp,
+        "a2s_rules_response_time": resp_time,
+        "a2s_num_open_public_connections": num_open_pub,
+        "a2s_num_public_connections": num_pub,
+        "a2s_pi_count": pi_count,
+        **pi_values,
+        "a2s_mutators_running": mutators_running,
+    }
+    latest_stmt = db.latest.update_stmt(server_id, query_time, values)
 
     with app.db_session.begin() as sess:
+        values["a2s_rules_hash"] = db.blobs.store(sess, rules)
+        stmt = update(db.models.GameServerState).where(
+            (db.models.GameServerState.time == query_time)
+            & (db.models.GameServerState.game_server_id == server_id)
+        ).values(values)
         sess.execute(stmt)
+        sess.execute(latest_stmt)
+    db.blobs.remember([values["a2s_rules_hash"]])
+    rowcache.invalidate_state(redis_client(), addr[0], server_id, query_time)
 
     _log_timedelta(
         query_time,
@@ -257,6 +255,7 @@ def a2s_players(
         addr: Tuple[str, int],
         gameport: int,
         query_time: datetime.datetime,
+        server_id: int,
 ):
     addr = _coerce_tuple(addr)  # type: ignore[assignment]
     players = []
@@ -270,6 +269,7 @@ def a2s_players(
         resp = True
         resp_time = datetime.datetime.now(tz=datetime.timezone.utc)
     except TimeoutError as e:
+        metrics.incr(metrics.A2S_PLAYERS_TIMEOUTS)
         # noinspection PyTypeChecker
         if _should_throw_retry(a2s_info):
             raise
@@ -289,32 +289,141 @@ def a2s_players(
             addr, gameport, query_time, e
         )
 
-    players = [
-        {
-            key: value
-            for key, value in player
-        } for player in players
-    ]
-
-    ip_addr_obj = ipaddress.IPv4Address(addr[0])
-    stmt = update(db.models.GameServerState).where(
-        (db.models.GameServerState.time == query_time)
-        & (db.models.GameServerState.game_server_address == ip_addr_obj)
-        & (db.models.GameServerState.game_server_port == gameport)
-    ).values(
-        a2s_players_responded=resp,
-        a2s_players_response_time=resp_time,
-        a2s_players=players,
-    )
+    values = {
+        "a2s_players_responded": resp,
+        "a2s_players_response_time": resp_time,
+        "a2s_player_scores": [player.score for player in players],
+        "a2s_player_durations": [player.duration for player in players],
+    }
+    latest_stmt = db.latest.update_stmt(server_id, query_time, values)
 
     with app.db_session.begin() as sess:
+        values["a2s_player_name_ids"] = _player_name_ids(
+            sess, [player.name for player in players])
+        stmt = update(db.models.GameServerState).where(
+            (db.models.GameServerState.time == query_time)
+            & (db.models.GameServerState.game_server_id == server_id)
+        ).values(values)
         sess.execute(stmt)
+        sess.execute(latest_stmt)
+    rowcache.invalidate_state(redis_client(), addr[0], server_id, query_time)
 
     _log_timedelta(
         query_time,
         resp_time or datetime.datetime.now(tz=datetime.timezone.utc))
 
 
+def _player_name_ids(
+        session: sqlalchemy.orm.Session,
+        names: List[str],
+) -> List[int]:
+    """Intern player names, returns name ids in the same order."""
+    # Resolved into a local dict, the shared cache may be
+    # cleared by other greenlets while waiting for the database.
+    ids: dict[str, int] = {}
+    missing = set()
+    for name in names:
+        name_id = _player_names.get(name)
+        if name_id is None:
+            missing.add(name)
+        else:
+            ids[name] = name_id
+
+    if missing:
+        # Sorted to avoid deadlocks between concurrent inserts.
+        session.execute(
+            pg_insert(db.models.PlayerName).values(
+                [{"name": name} for name in sorted(missing)]
+            ).on_conflict_do_nothing(),
+        )
+        rows = session.execute(
+            select(
+                db.models.PlayerName.name,
+                db.models.PlayerName.id,
+            ).where(
+                db.models.PlayerName.name.in_(missing),
+            )
+        )
+        fetched = dict(rows.tuples().all())
+        ids.update(fetched)
+
+        if len(_player_names) + len(fetched) > PLAYER_NAME_CACHE_SIZE:
+            _player_names.clear()
+        _player_names.update(fetched)
+
+    return [ids[name] for name in names]
+
+
+def _pop_pi_arrays(rules: Dict[str, str], pi_count: Any) -> Dict[str, Any]:
+    """Pop PI_N_<index>, PI_P_<index> and PI_S_<index> rules into
+    parallel arrays indexed by the PI index.
+    """
+    pi_objs: dict[int, dict[str, str]] = defaultdict(dict)
+    to_del = set()
+    for key, value in rules.items():
+        if key.startswith("PI_"):
+            try:
+                idx = int(key.split("_")[-1])
+                to_del.add(key)
+            except ValueError:
+                continue
+            # Rules are limited to 750 items, guard against bogus
+            # indices blowing up the array sizes.
+            if not (0 <= idx < 750):
+                continue
+
+            if key.startswith("PI_N_"):
+                pi_objs[idx]["n"] = value
+            elif key.startswith("PI_P_"):
+                # Platform.
+                pi_objs[idx]["p"] = value
+            elif key.startswith("PI_S_"):
+                # Score.
+                pi_objs[idx]["s"] = value
+
+    for key in to_del:
+        del rules[key]
+
+    try:
+        pi_count = int(pi_count)
+    except (TypeError, ValueError):
+        pi_count = 0
+
+    size = (max(pi_objs) + 1) if pi_objs else 0
+    names: list[str | None] = [None] * size
+    platforms: list[int | None] = [None] * size
+    scores: list[int | None] = [None] * size
+    steam_count = 0
+    eos_count = 0
+    for idx, pi_obj in pi_objs.items():
+        names[idx] = pi_obj.get("n")
+        if "p" in pi_obj:
+            platform = db.models.PiPlatform.from_str(pi_obj["p"])
+            platforms[idx] = platform
+            # The server can report old PIs that have already left
+            # the server, only count the ones within PI_COUNT.
+            if idx < pi_count:
+                if platform == db.models.PiPlatform.STEAM:
+                    steam_count += 1
+                elif platform == db.models.PiPlatform.EOS:
+                    eos_count += 1
+                else:
+                    logger.error("invalid platform '%s' for object: %s",
+                                 pi_obj["p"], pi_obj)
+        try:
+            scores[idx] = int(pi_obj["s"])
+        except (KeyError, ValueError):
+            pass
+
+    return {
+        "a2s_pi_names": names,
+        "a2s_pi_platforms": platforms,
+        "a2s_pi_scores": scores,
+        "a2s_pi_steam_count": steam_count,
+        "a2s_pi_eos_count": eos_count,
+    }
+
+
 def _coerce_tuple(x: Union[list, tuple]) -> Tuple:
     # Celery converts tuples to lists.
     return x[0], x[1]
@@ -1,14 +1,18 @@
 import os
 
+import redis
 import sentry_sdk
 from celery import Celery
 from celery.signals import celeryd_init
+from celery.signals import worker_process_init
+from celery.signals import worker_process_shutdown
 from celery.signals import worker_shutdown
 from celery.utils.log import get_logger
 from kombu.serialization import register
 from sqlalchemy.orm import sessionmaker
 
 from spoofspy import db
+from spoofspy import metrics
 from spoofspy.jobs import serialization
 
 logger = get_logger(__name__)
@@ -28,7 +32,30 @@ def _make_session() -> sessionmaker:
 
 REDIS_URL = os.environ["REDIS_URL"]
 
+# Redis broker priority steps. NOTE: with Redis, lower value
+# means higher priority, i.e. 0 is consumed first.
+PRIORITY_STEPS = list(range(10))
+PRIORITY_HIGHEST = PRIORITY_STEPS[0]
+PRIORITY_DEFAULT = 5
+PRIORITY_LOWEST = PRIORITY_STEPS[-1]
+
 _DB_SESSION: sessionmaker | None = None
+_METRICS_FLUSHER: metrics.MetricsFlusher | None = None
+_REDIS_CLIENT: redis.Redis | None = None
+
+
+def redis_client() -> redis.Redis:
+    global _REDIS_CLIENT
+    if _REDIS_CLIENT is None:
+        pool = redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=5,
+            timeout=30,
+        )
+        _REDIS_CLIENT = redis.Redis(
+            connection_pool=pool,
+        )
+    return _REDIS_CLIENT
 
 
 class CustomCelery(Celery):
@@ -66,12 +93,17 @@ app = CustomCelery(
     task_compression="gzip",
     result_compression="gzip",
     broker_connection_retry_on_startup=True,
+    task_default_priority=PRIORITY_DEFAULT,
     task_serializer="msgpack_dt",
     result_serializer="msgpack_dt",
     accept_content=_accept_content,
     task_accept_content=_accept_content,
     result_accept_content=_accept_content,
     task_routes={
+        # CPU-bound tasks, consumed by prefork workers.
+        "spoofspy.jobs.tasks.score_states": {"queue": "CPUQueue"},
+        "spoofspy.jobs.tasks.rescore_batch": {"queue": "CPUQueue"},
+        "spoofspy.jobs.tasks.cluster_rosters": {"queue": "CPUQueue"},
         "spoofspy.jobs.tasks.*": {"queue": "MainQueue"},
         "spoofspy.jobs.a2s_tasks.*": {"queue": "A2SQueue"},
     },
@@ -84,6 +116,9 @@ app = CustomCelery(
         "socket_timeout": 60,
         "socket_connect_timeout": 60,
         "retry_on_timeout": True,
+        "priority_steps": PRIORITY_STEPS,
+        "sep": ":",
+        "queue_order_strategy": "priority",
     },
     result_backend_transport_options={
         "socket_timeout": 60,
@@ -97,11 +132,38 @@ app = CustomCelery(
 # See: https://github.com/celery/celery/issues/8285
 
 
+def _start_metrics_flusher():
+    global _METRICS_FLUSHER
+    _METRICS_FLUSHER = metrics.MetricsFlusher(app.db_session)
+    _METRICS_FLUSHER.start()
+
+
+def _stop_metrics_flusher():
+    if _METRICS_FLUSHER is not None:
+        _METRICS_FLUSHER.stop()
+
+
 @worker_shutdown.connect
 def _shutdown_worker(*_args, **_kwargs):
+    _stop_metrics_flusher()
     db.close_database()
 
 
+# Threads don't survive forking, prefork pool child
+# processes need their own metrics flushers.
+@worker_process_init.connect
+def _worker_process_init(*_args, **_kwargs):
+    # Prefork child processes must not reuse connections
+    # inherited from the parent process.
+    db.engine(reflect=False, dispose=True)
+    _start_metrics_flusher()
+
+
+@worker_process_shutdown.connect
+def _worker_process_shutdown(*_args, **_kwargs):
+    _stop_metrics_flusher()
+
+
 _SENTRY_DSN = os.environ.get("SENTRY_DSN")
 
 
@@ -120,3 +182,5 @@ def _celeryd_init(**_kwargs):
     if not all((_DB_SESSION, app._db_session)):
         _DB_SESSION = _make_session()
         app._db_session = _DB_SESSION
+
+    _start_metrics_flusher()
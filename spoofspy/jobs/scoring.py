@@ -0,0 +1,354 @@
+import dataclasses
+import datetime
+import ipaddress
+from types import SimpleNamespace
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Sequence
+
+import sqlalchemy.orm
+from sqlalchemy import Row
+from sqlalchemy import Select
+from sqlalchemy import bindparam
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from spoofspy import db
+from spoofspy.heuristics import features
+from spoofspy.heuristics import trust
+
+# Columnar batch of trust evaluation inputs, column name -> values.
+Batch = dict[str, list[Any]]
+
+# GameServerState columns needed by `trust.eval_trust_score`.
+INPUT_COLUMNS = (
+    "time",
+    "game_server_id",
+    "players",
+    "max_players",
+    "a2s_info_responded",
+    "a2s_player_count",
+    "a2s_max_players",
+    "a2s_rules_responded",
+    "a2s_num_public_connections",
+    "a2s_num_open_public_connections",
+    "a2s_pi_count",
+    "a2s_pi_names",
+    "a2s_pi_platforms",
+    "a2s_pi_steam_count",
+    "a2s_pi_eos_count",
+    "a2s_players_responded",
+    "a2s_player_name_ids",
+    "a2s_player_scores",
+    "a2s_player_durations",
+    "secure",
+    "map",
+    "a2s_map_name",
+    "a2s_mutators_running",
+)
+
+_BATCH_COLUMNS = ("game_server_address", "game_server_port") + INPUT_COLUMNS
+_FEATURE_FIELDS = tuple(
+    f.name for f in dataclasses.fields(features.ServerFeatures))
+
+# Set once the in-database scoring functions are
+# (re)created by this process.
+_sql_functions_created = False
+
+
+def input_stmt(*wheres) -> Select:
+    """Core select of trust evaluation inputs, rows
+    are converted to batches with `to_batch`.
+    """
+    return select(
+        db.models.GameServer.address,
+        db.models.GameServer.port,
+        *(getattr(db.models.GameServerState, c) for c in INPUT_COLUMNS),
+    ).join(
+        db.models.GameServerState.game_server,
+    ).where(
+        *wheres
+    )
+
+
+def to_batch(rows: Sequence[Row]) -> Batch:
+    batch: Batch = {
+        name: list(values)
+        for name, values in zip(_BATCH_COLUMNS, zip(*rows))
+    }
+    # INET is returned as an ipaddress object.
+    batch["game_server_address"] = [
+        str(addr) for addr in batch.get("game_server_address", [])
+    ]
+    return batch
+
+
+def server_partitions(
+        rows: Iterable[Row],
+        size: int,
+) -> Iterator[list[Row]]:
+    """Partition rows ordered by game server into lists of at
+    least `size` rows, except the last. All rows of a server
+    are in the same partition.
+    """
+    partition: list[Row] = []
+    for row in rows:
+        if (len(partition) >= size
+                and row.game_server_id != partition[-1].game_server_id):
+            yield partition
+            partition = []
+        partition.append(row)
+    if partition:
+        yield partition
+
+
+def batch_size(batch: Batch) -> int:
+    return len(batch.get("time", []))
+
+
+def _states(batch: Batch) -> list[SimpleNamespace]:
+    states = []
+    for values in zip(*(batch[c] for c in _BATCH_COLUMNS)):
+        state = SimpleNamespace(**dict(zip(_BATCH_COLUMNS, values)))
+        state.game_server_address = ipaddress.IPv4Address(
+            state.game_server_address)
+        states.append(state)
+    return states
+
+
+def score(
+        batch: Batch,
+        server_features: Optional[dict[int, features.ServerFeatures]] = None,
+        roster_clusters: Optional[dict[int, int]] = None,
+        anomalies: Optional[list[dict[str, Any]]] = None,
+) -> list[dict[str, Any]]:
+    """Evaluate trust scores. Returns update parameters
+    for `store_scores`.
+
+    If server_features is given, states are evaluated in time order
+    with the features of their server, which are updated in place.
+    roster_clusters maps server IDs to their roster cluster sizes.
+    Player count anomalies raised by the states are appended to
+    anomalies, if given, as values for `store_anomalies`.
+    """
+    roster_clusters = roster_clusters or {}
+    states = _states(batch)
+    multipliers = trust.reputation_index.current.lookup_batch(
+        [int(state.game_server_address) for state in states],
+        batch["game_server_port"],
+    )
+
+    update_params = []
+    for state, multiplier in sorted(
+            zip(states, multipliers), key=lambda x: x[0].time):
+        server_feats = None
+        if server_features is not None:
+            server_feats = server_features.get(state.game_server_id)
+            if server_feats is None:
+                server_feats = features.ServerFeatures()
+            new_feats = features.update(server_feats, state)
+            server_features[state.game_server_id] = new_feats
+            # States not newer than the features are not evaluated by
+            # the estimators, the stored flags belong to a newer state.
+            flags = 0
+            if new_feats is not server_feats:
+                flags = new_feats.anomaly_flags
+            if anomalies is not None and flags:
+                anomalies.append({
+                    "time": state.time,
+                    "game_server_id": state.game_server_id,
+                    "flags": flags,
+                    "players": state.players,
+                    "expected": server_feats.players_ewma,
+                })
+
+        # noinspection PyTypeChecker
+        trust_score, penalties = trust.eval_trust_breakdown(
+            state,  # type: ignore[arg-type]
+            float(multiplier),
+            server_feats,
+            roster_clusters.get(state.game_server_id, 0),
+        )
+        update_params.append({
+            "u_game_server_id": state.game_server_id,
+            "u_time": state.time,
+            "trust_score": trust_score,
+            "trust_algo_version": trust.ALGO_VERSION,
+            "trust_penalties": penalties,
+        })
+
+    return update_params
+
+
+def lock_servers(
+        session: sqlalchemy.orm.Session,
+        server_ids: Iterable[int],
+):
+    """Lock servers until the end of the transaction, so that
+    their features are loaded, updated and stored by one
+    transaction at a time.
+    """
+    session.execute(
+        db.queries.lock_servers,
+        {"server_ids": sorted(set(server_ids))},
+    )
+
+
+def load_features(
+        session: sqlalchemy.orm.Session,
+        server_ids: Iterable[int],
+) -> dict[int, features.ServerFeatures]:
+    rows = session.scalars(
+        select(db.models.GameServerFeatures).where(
+            db.models.GameServerFeatures.game_server_id.in_(set(server_ids)),
+        )
+    )
+    return {
+        row.game_server_id: features.ServerFeatures(**{
+            f: getattr(row, f) for f in _FEATURE_FIELDS
+        })
+        for row in rows
+    }
+
+
+def load_roster_clusters(
+        session: sqlalchemy.orm.Session,
+        server_ids: Iterable[int],
+        min_time: datetime.datetime,
+) -> dict[int, int]:
+    """Return server ID -> roster cluster size of clusters
+    computed at or after min_time.
+    """
+    return dict(session.execute(
+        select(
+            db.models.RosterCluster.game_server_id,
+            db.models.RosterCluster.cluster_size,
+        ).where(
+            db.models.RosterCluster.game_server_id.in_(set(server_ids))
+            & (db.models.RosterCluster.time >= min_time)
+        )
+    ).tuples().all())
+
+
+def store_features(
+        session: sqlalchemy.orm.Session,
+        server_features: dict[int, features.ServerFeatures],
+):
+    """Upsert features, features of newer states are not overwritten."""
+    values = [
+        {"game_server_id": server_id, **feats.to_dict()}
+        for server_id, feats in server_features.items()
+        if feats.time is not None
+    ]
+    if not values:
+        return
+
+    stmt = pg_insert(db.models.GameServerFeatures).values(values)
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["game_server_id"],
+            set_={f: stmt.excluded[f] for f in _FEATURE_FIELDS},
+            where=(db.models.GameServerFeatures.time < stmt.excluded.time),
+        ),
+    )
+
+
+def store_anomalies(
+        session: sqlalchemy.orm.Session,
+        values: list[dict[str, Any]],
+):
+    if not values:
+        return
+    session.execute(
+        pg_insert(db.models.PlayerCountAnomaly),
+        values,
+    )
+
+
+def sql_params() -> dict[str, Any]:
+    """Penalty curves, rule sets and reputation index parameters
+    of the in-database scoring statements in `db.queries`.
+    """
+    compiled = trust.rules.current
+    return {
+        "player_count_x": trust.player_count_x.astype(float).tolist(),
+        "player_count_y": trust.player_count_y.astype(float).tolist(),
+        "ww_bots": compiled.bot_names_of(trust.BOTS_WW),
+        "rs2_bots": compiled.bot_names_of(trust.BOTS_RS2),
+        "gom4_bots": compiled.bot_names_of(trust.BOTS_GOM4),
+        "gom3_mutators": compiled.mutators_of(trust.MUTATOR_GOM3),
+        "gom4_mutators": compiled.mutators_of(trust.MUTATOR_GOM4),
+        **trust.reputation_index.current.to_arrays(),
+    }
+
+
+def create_sql_functions(session: sqlalchemy.orm.Session):
+    """Create or replace the in-database scoring functions,
+    once per process so that they match this version of the code.
+    """
+    global _sql_functions_created
+    if _sql_functions_created:
+        return
+    session.execute(db.queries.trust_score_functions)
+    _sql_functions_created = True
+
+
+def rescore_in_database(
+        session: sqlalchemy.orm.Session,
+        range_start: datetime.datetime,
+        range_end: datetime.datetime,
+        last_key: tuple[Optional[datetime.datetime], Optional[int]],
+        batch_size: int,
+) -> tuple[int, tuple[Optional[datetime.datetime], Optional[int]], list[str]]:
+    """Re-score the next batch of states after last_key in
+    [range_start, range_end) with a single set-wise UPDATE.
+    Evaluated like `score` without features and roster clusters.
+    Returns the number of scored states, the key of the last
+    scored state and the addresses of the scored servers.
+    """
+    create_sql_functions(session)
+    row = session.execute(
+        db.queries.rescore_in_database,
+        {
+            "range_start": range_start,
+            "range_end": range_end,
+            "last_time": last_key[0],
+            "last_game_server_id": last_key[1],
+            "batch_size": batch_size,
+            "trust_algo_version": trust.ALGO_VERSION,
+            **sql_params(),
+        },
+    ).one()
+    return (
+        row.num_scored,
+        (row.last_time, row.last_game_server_id),
+        row.addresses or [],
+    )
+
+
+def store_scores(
+        session: sqlalchemy.orm.Session,
+        update_params: list[dict[str, Any]],
+        update_latest: bool = True,
+):
+    """Store trust scores of `score`. Re-scores of historical
+    states, evaluated without features, don't update the latest table.
+    """
+    if not update_params:
+        return
+
+    session.connection().execute(
+        update(db.models.GameServerState).where(
+            (db.models.GameServerState.game_server_id == bindparam("u_game_server_id"))
+            & (db.models.GameServerState.time == bindparam("u_time"))
+        ),
+        update_params,
+    )
+    if update_latest:
+        session.connection().execute(
+            db.latest.update_trust_score_stmt(),
+            update_params,
+        )
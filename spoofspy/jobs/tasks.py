@@ -10,6 +10,7 @@ from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 from typing import Dict
 from typing import Optional
+from typing import cast
 
 import a2s
 import icmplib
@@ -21,34 +22,91 @@ from celery import Celery
 from celery.signals import beat_init
 from celery.utils.log import get_logger
 from celery.utils.log import get_task_logger
-from sqlalchemy import bindparam
 from sqlalchemy import select
 from sqlalchemy import update
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import load_only
+from sqlalchemy.sql.dml import ReturningInsert
 
+from spoofspy import archive
 from spoofspy import coding
 from spoofspy import db
+from spoofspy import metrics
+from spoofspy import rowcache
+from spoofspy.heuristics import roster
 from spoofspy.heuristics import trust
 from spoofspy.jobs import a2s_tasks
+from spoofspy.jobs import scoring
+from spoofspy.jobs import trust_cache
+from spoofspy.jobs.app import PRIORITY_DEFAULT
+from spoofspy.jobs.app import PRIORITY_HIGHEST
+from spoofspy.jobs.app import PRIORITY_LOWEST
 from spoofspy.jobs.app import app
+from spoofspy.jobs.app import redis_client
 from spoofspy.utils.deployment import is_prod_deployment
 from spoofspy.web import GameServerResult
+from spoofspy.web import RequestScheduler
 from spoofspy.web import SteamWebAPI
 
 DISCOVER_DELAY_MIN = 0.0
 DISCOVER_DELAY_MAX = 10.0
+# Number of discovered servers stored and dispatched at once.
+DISCOVER_BATCH_SIZE = 500
+# Number of states per score_states task. Batches are cut on
+# server boundaries and exceed this by at most one server's states.
+EVAL_BATCH_SIZE = 2000
+
+# Historical trust re-scoring. Number of chunks processed in
+# parallel, states per batch and delay between batches of a chunk.
+RESCORE_LANES = 2
+RESCORE_BATCH_SIZE = 2000
+RESCORE_BATCH_DELAY = 1.0
+# Claims of chunks not updated in this time are taken over.
+RESCORE_CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+# Chunks are re-scored once they have ended this long ago. Newer states
+# may still be scored by eval_server_trust_scores with temporal features,
+# roster clusters and anomalies, which re-scoring doesn't evaluate.
+RESCORE_MIN_AGE = datetime.timedelta(days=2)
+# Re-score with a set-wise UPDATE in the database instead of loading
+# states, see `scoring.rescore_in_database`. Batches can be larger
+# since no rows are transferred.
+RESCORE_IN_DATABASE = str(os.environ.get(
+    "SPOOFSPY_RESCORE_IN_DATABASE")).lower() in ("true", "on", "1")
+RESCORE_IN_DATABASE_BATCH_SIZE = 20000
+
+# Maximum age of the full state referenced by unchanged states.
+# Keeps full states well within the retention period.
+STATIC_MAX_RUN = datetime.timedelta(days=1)
+
+# Player rosters older than this are not clustered.
+ROSTER_WINDOW = datetime.timedelta(minutes=30)
+# Roster clusters older than this are ignored in scoring.
+ROSTER_CLUSTER_MAX_AGE = datetime.timedelta(hours=1)
 
-TRUST_KEY = "_spoofspy_trust"
 TRUST_LOCK_KEY = "_spoofspy_trust_lock"
+TRUST_VOLATILITY_KEY = "_spoofspy_trust_volatility"
+
+# Trust score cutoff for servers included in the cached trust aggregate.
+TRUST_CUTOFF = 0.31
+# Minimum 24-hour trust score standard deviation for
+# a server to be considered volatile.
+TRUST_VOLATILITY_MIN_STDDEV = 0.1
+
+# Probe priorities. Newly discovered servers are probed first,
+# followed by volatile and low trust score servers. Lower is higher.
+PRIORITY_NEW_SERVER = PRIORITY_HIGHEST
+PRIORITY_VOLATILE = 2
+PRIORITY_LOW_TRUST_MIN = 1
+PRIORITY_LOW_TRUST_MAX = 4
 
 _webapi: Optional[SteamWebAPI] = None
 
 logger: logging.Logger = get_task_logger(__name__)
 beat_logger: logging.Logger = get_logger(f"beat.{__name__}")
 
-_redis_client: Optional[redis.Redis] = None
+# Game server (address, port) -> id.
+_server_ids: dict[tuple[str, int], int] = {}
 
 _retry_task_for_errors = (
     OperationalError,
@@ -59,23 +117,19 @@ _retry_task_for_errors = (
 def webapi() -> SteamWebAPI:
     global _webapi
     if _webapi is None:
-        _webapi = SteamWebAPI(key=os.environ["STEAM_WEB_API_KEY"])
-        logger.info("created SteamWebAPI instance: %s", _webapi)
-    return _webapi
-
-
-def redis_client() -> redis.Redis:
-    global _redis_client
-    if _redis_client is None:
-        pool = redis.BlockingConnectionPool.from_url(
-            os.environ["REDIS_URL"],
-            max_connections=5,
-            timeout=30,
-        )
-        _redis_client = redis.Redis(
-            connection_pool=pool,
+        key = os.environ["STEAM_WEB_API_KEY"]
+        scheduler = RequestScheduler(
+            redis_client(),
+            api_key=key,
+            daily_budget=int(os.environ.get(
+                "STEAM_WEB_API_DAILY_BUDGET", 100_000)),
+            cache_ttl=float(os.environ.get(
+                "STEAM_WEB_API_CACHE_TTL", 60.0)),
         )
-    return _redis_client
+        _webapi = SteamWebAPI(key=key, scheduler=scheduler)
+        logger.info("created SteamWebAPI instance: %s (scheduler: %s)",
+                    _webapi, scheduler)
+    return _webapi
 
 
 if is_prod_deployment():
@@ -91,6 +145,12 @@ def on_beat_init(*_args, **_kwargs):
     beat_logger.info("using QUERY_INTERVAL=%s", QUERY_INTERVAL)
     beat_logger.info("using EVAL_INTERVAL=%s", EVAL_INTERVAL)
 
+    try:
+        with app.db_session.begin() as sess:
+            trust.rules.seed(sess)
+    except Exception as e:
+        beat_logger.error("error seeding matcher rule sets: %s", e)
+
 
 @app.on_after_configure.connect
 def setup_periodic_tasks(sender: Celery, **_kwargs):
@@ -127,6 +187,31 @@ def setup_periodic_tasks(sender: Celery, **_kwargs):
         expires=QUERY_INTERVAL,
     )
 
+    sender.add_periodic_task(
+        QUERY_INTERVAL,
+        cluster_rosters.s(),
+        expires=QUERY_INTERVAL,
+    )
+
+    sender.add_periodic_task(
+        delta_24h,
+        archive_state_chunks.s(),
+        expires=delta_24h.total_seconds(),
+    )
+
+    sender.add_periodic_task(
+        delta_24h,
+        collect_blobs.s(),
+        expires=delta_24h.total_seconds(),
+    )
+
+    # Resume crashed rescoring lanes, if any.
+    sender.add_periodic_task(
+        datetime.timedelta(hours=1),
+        rescore_trust_scores.s(resume_only=True),
+        expires=3600,
+    )
+
     # Re-check ALL null trust_scores.
     # TODO: probably only needed during active development
     #   because trust eval algo is still evolving?
@@ -226,68 +311,252 @@ def eval_server_trust_scores(
             (db.models.GameServerState.time >= min_dt)  # type: ignore[arg-type]
         )
 
-    stmt = select(db.models.GameServerState).where(
-        *wheres
-    ).options(
-        load_only(
-            db.models.GameServerState.game_server_port,
-            db.models.GameServerState.game_server_address,
-            db.models.GameServerState.players,
-            db.models.GameServerState.max_players,
-            db.models.GameServerState.a2s_info_responded,
-            db.models.GameServerState.a2s_player_count,
-            db.models.GameServerState.a2s_max_players,
-            db.models.GameServerState.a2s_rules_responded,
-            db.models.GameServerState.a2s_num_public_connections,
-            db.models.GameServerState.a2s_num_open_public_connections,
-            db.models.GameServerState.a2s_pi_count,
-            db.models.GameServerState.a2s_pi_objects,
-            db.models.GameServerState.a2s_players_responded,
-            db.models.GameServerState.a2s_players,
-            db.models.GameServerState.secure,
-            db.models.GameServerState.map,
-            db.models.GameServerState.a2s_map_name,
-            db.models.GameServerState.a2s_mutators_running,
+    stmt = scoring.input_stmt(*wheres).order_by(
+        db.models.GameServerState.game_server_id,
+        db.models.GameServerState.time,
+    ).execution_options(
+        yield_per=EVAL_BATCH_SIZE,
+    )
+
+    # Scoring is CPU-bound, batches are handed over to
+    # score_states on prefork workers to keep this gevent
+    # worker responsive. All states of a server are in the
+    # same batch, the server's features are updated in order.
+    num_states = 0
+    with app.db_session.begin() as sess:
+        for rows in scoring.server_partitions(
+                sess.execute(stmt), EVAL_BATCH_SIZE):
+            score_states.apply_async((scoring.to_batch(rows),))
+            num_states += len(rows)
+
+    if not num_states:
+        logger.info("no game server states with timedelta: %s", timedelta)
+        return
+
+    logger.info("dispatched %s states for trust score evaluation", num_states)
+
+
+@app.task(
+    ignore_result=True,
+    autoretry_for=_retry_task_for_errors,
+    default_retry_delay=2,
+    max_retries=3,
+)
+def score_states(batch: scoring.Batch):
+    trust.rules.maybe_refresh(app.db_session)
+    trust.reputation_index.maybe_refresh(app.db_session)
+    with app.db_session.begin() as sess:
+        # Batches of overlapping runs may contain the same servers.
+        scoring.lock_servers(sess, batch["game_server_id"])
+        server_features = scoring.load_features(
+            sess, batch["game_server_id"])
+        roster_clusters = scoring.load_roster_clusters(
+            sess,
+            batch["game_server_id"],
+            datetime.datetime.now(tz=datetime.timezone.utc)
+            - ROSTER_CLUSTER_MAX_AGE,
         )
+        anomalies: list[dict[str, Any]] = []
+        update_params = scoring.score(
+            batch, server_features, roster_clusters, anomalies)
+        scoring.store_scores(sess, update_params)
+        scoring.store_features(sess, server_features)
+        scoring.store_anomalies(sess, anomalies)
+    _mark_trust_dirty(set(batch["game_server_address"]))
+    rowcache.invalidate(
+        redis_client(),
+        rowcache.GAME_SERVER_STATE,
+        [rowcache.state_id(server_id, time) for server_id, time
+         in zip(batch["game_server_id"], batch["time"])],
     )
 
-    if timedelta is None:
-        stmt = stmt.execution_options(
-            yield_per=1000,
-        )  # .limit(2000)  # TODO: limit is temporary!
 
-    update_wheres = [
-        (db.models.GameServerState.game_server_port == bindparam("u_game_server_port"))
-        & (db.models.GameServerState.game_server_address == bindparam("u_game_server_address"))
-        & (db.models.GameServerState.time == bindparam("u_time"))
-    ]
+def _mark_trust_dirty(addresses: set[str]):
+    try:
+        trust_cache.mark_dirty(redis_client(), addresses)
+    except Exception as e:
+        logger.error("error marking trust cache dirty: %s", e)
+    # Latest trust scores changed.
+    rowcache.invalidate(
+        redis_client(), rowcache.GAME_SERVER_LATEST, addresses)
+
+
+@app.task(
+    ignore_result=True,
+    autoretry_for=_retry_task_for_errors,
+    default_retry_delay=2,
+    max_retries=3,
+)
+def rescore_trust_scores(resume_only: bool = False):
+    """Re-score all states with the current trust algorithm version,
+    chunk by chunk. Progress is checkpointed in RescoreCheckpoint,
+    calling this again resumes unfinished and crashed chunks, and
+    chunks that have since become older than RESCORE_MIN_AGE.
+    """
+    version = trust.ALGO_VERSION
 
     with app.db_session.begin() as sess:
-        states = sess.scalars(stmt)
+        if not resume_only:
+            chunks = sess.execute(db.queries.rescore_chunks).all()
+            if chunks:
+                sess.execute(
+                    pg_insert(db.models.RescoreCheckpoint).values([
+                        {
+                            "trust_algo_version": version,
+                            "chunk_name": chunk_name,
+                            "range_start": range_start,
+                            "range_end": range_end,
+                        }
+                        for chunk_name, range_start, range_end in chunks
+                    ]).on_conflict_do_nothing(),
+                )
 
-        # TODO: do this in blocks? yield_per=x?
-        states_values = states.all()
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        active = sess.scalar(
+            select(sqlalchemy.func.count()).where(
+                (db.models.RescoreCheckpoint.trust_algo_version == version)
+                & db.models.RescoreCheckpoint.done.is_(False)
+                & (db.models.RescoreCheckpoint.claimed_at
+                   >= now - RESCORE_CLAIM_TIMEOUT)
+            )
+        )
+        pending = sess.scalar(
+            select(sqlalchemy.func.count()).where(
+                (db.models.RescoreCheckpoint.trust_algo_version == version)
+                & db.models.RescoreCheckpoint.done.is_(False)
+                & (db.models.RescoreCheckpoint.range_end
+                   <= now - RESCORE_MIN_AGE)
+            )
+        )
+
+    # Each lane is a chain of rescore_batch tasks processing
+    # one chunk at a time, limiting the load on the database.
+    lanes = min(RESCORE_LANES - active, pending - active)
+    logger.info(
+        "rescoring with trust algorithm version %s: %s pending chunks, "
+        "%s active lanes, starting %s lanes",
+        version, pending, active, max(lanes, 0))
+    for _ in range(lanes):
+        rescore_batch.apply_async(priority=PRIORITY_LOWEST)
 
-        if not states_values:
-            logger.info("no game server states with timedelta: %s", timedelta)
-            return
 
-        logger.info("evaluating trust score for %s states", len(states_values))
+@app.task(
+    ignore_result=True,
+    autoretry_for=_retry_task_for_errors,
+    default_retry_delay=2,
+    max_retries=3,
+)
+def rescore_batch(chunk_name: Optional[str] = None):
+    """Re-score the next batch of a chunk claimed by this lane,
+    or claim a new chunk. Dispatches the next batch of the lane.
+    """
+    trust.rules.maybe_refresh(app.db_session)
+    trust.reputation_index.maybe_refresh(app.db_session)
+    version = trust.ALGO_VERSION
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    done_range = None
+    scored_addresses: set[str] = set()
 
-        sess.connection().execute(
-            update(db.models.GameServerState).where(
-                *update_wheres,
-            ),
-            [
+    with app.db_session.begin() as sess:
+        if chunk_name is None:
+            chunk_name = sess.scalar(
+                db.queries.rescore_claim,
                 {
-                    "u_game_server_port": state.game_server_port,
-                    "u_game_server_address": state.game_server_address,
-                    "u_time": state.time,
-                    "trust_score": trust.eval_trust_score(state)
-                }
-                for state in states_values
-            ],
+                    "trust_algo_version": version,
+                    "stale_before": now - RESCORE_CLAIM_TIMEOUT,
+                    "ready_before": now - RESCORE_MIN_AGE,
+                },
+            )
+            if chunk_name is None:
+                logger.info("no chunks left to rescore for version %s",
+                            version)
+                return
+
+        cp = sess.scalar(
+            select(db.models.RescoreCheckpoint).where(
+                (db.models.RescoreCheckpoint.trust_algo_version == version)
+                & (db.models.RescoreCheckpoint.chunk_name == chunk_name)
+            ).with_for_update()
         )
+        if cp is None or cp.done:
+            chunk_name = None
+        else:
+            wheres = [
+                (db.models.GameServerState.time >= cp.range_start)
+                & (db.models.GameServerState.time < cp.range_end)
+                & (db.models.GameServerState.a2s_info_responded.is_not(None))
+                & (db.models.GameServerState.a2s_rules_responded.is_not(None))
+                & (db.models.GameServerState.a2s_players_responded.is_not(None))
+                & (db.models.GameServerState.trust_algo_version.is_distinct_from(version))
+            ]
+            if cp.last_time is not None:
+                wheres.append(
+                    sqlalchemy.tuple_(
+                        db.models.GameServerState.time,
+                        db.models.GameServerState.game_server_id,
+                    ) > sqlalchemy.tuple_(
+                        cp.last_time,
+                        cp.last_game_server_id,
+                    )
+                )
+            # Current temporal features don't describe historical
+            # states, these are evaluated without them.
+            if RESCORE_IN_DATABASE:
+                num_scored, last_key, addresses = scoring.rescore_in_database(
+                    sess,
+                    cp.range_start,
+                    cp.range_end,
+                    (cp.last_time, cp.last_game_server_id),
+                    RESCORE_IN_DATABASE_BATCH_SIZE,
+                )
+            else:
+                batch = scoring.to_batch(sess.execute(
+                    scoring.input_stmt(*wheres).order_by(
+                        db.models.GameServerState.time,
+                        db.models.GameServerState.game_server_id,
+                    ).limit(RESCORE_BATCH_SIZE)
+                ).all())
+                num_scored = scoring.batch_size(batch)
+                if num_scored:
+                    scoring.store_scores(
+                        sess, scoring.score(batch), update_latest=False)
+                    last_key = (batch["time"][-1], batch["game_server_id"][-1])
+                    addresses = batch["game_server_address"]
+
+            if num_scored:
+                scored_addresses = set(addresses)
+                cp.last_time, cp.last_game_server_id = last_key
+                cp.num_scored += num_scored
+                cp.claimed_at = now
+            else:
+                cp.done = True
+                cp.claimed_at = None
+                done_range = (cp.range_start, cp.range_end)
+                logger.info("rescored chunk %s (%s states) with version %s",
+                            chunk_name, cp.num_scored, version)
+                chunk_name = None
+
+    if done_range is not None:
+        # Historical buckets are outside the refresh policy window.
+        with db.engine(reflect=False).connect().execution_options(
+                isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(
+                db.queries.refresh_trust_aggregate,
+                {
+                    "window_start": done_range[0],
+                    "window_end": done_range[1],
+                },
+            )
+
+    if scored_addresses:
+        _mark_trust_dirty(scored_addresses)
+
+    # Delayed to leave database capacity for live ingest.
+    rescore_batch.apply_async(
+        (chunk_name,),
+        countdown=RESCORE_BATCH_DELAY,
+        priority=PRIORITY_LOWEST,
+    )
 
 
 @app.task(
@@ -352,89 +621,191 @@ def discover_servers(query_params: Dict[str, str | int]):
     # Don't allow empty filters for now.
     query_filter = str(query_params["filter"])
     limit = int(query_params.get("limit", 0))
-    server_results = list(webapi().get_server_list(query_filter, limit))
 
     # TODO: parse IP addresses into objects here and pass them into
     #  further tasks as objects to avoid doing the conversions multiple times?
 
-    if not server_results:
-        logger.warning("did not get any server results for query: %s",
-                       query_params)
-        return
+    trust_scores, volatile = _cached_trust_lookups()
 
+    # Servers are parsed, deduplicated and dispatched while the
+    # Steam Web API response is still being received.
+    #
     # Detect duplicated servers i.e. servers that have same
     # address:gameport but different query port. It's possible
     # to register duplicated servers with the master server, but
     # it really does not make sense from game client POV,
     # since only one of them will be able to respond to A2S queries.
+    # Any server may get a duplicate later in the response, so only
+    # known servers at their stored query port, i.e. the ones resolved
+    # as real earlier, are dispatched before all results have been
+    # received. New servers and query port changes wait for the rest.
     # TODO: discard servers with gameport == query_port before doing
     #  this complex black magic fuckery to make our life easier...
-    #  ALSO ADD SOME UNIT TESTING THIS IS GETTING RIDICULOUS.
+    first_seen: dict[tuple[str, int], GameServerResult] = {}
     duplicates: defaultdict[
-        tuple[str, int], list[tuple[GameServerResult, bool]]] = defaultdict(list)
-    all_seen: defaultdict[tuple[str, int], int] = defaultdict(int)
-    for sr in server_results:
+        tuple[str, int], list[GameServerResult]] = defaultdict(list)
+    dispatched: set[tuple[str, int]] = set()
+    pending: list[GameServerResult] = []
+    num_results = 0
+
+    for sr in webapi().get_server_list(query_filter, limit):
+        num_results += 1
         key = (sr.addr, sr.gameport)
-        all_seen[key] += 1
-
-    for seen_add_port, seen_count in all_seen.items():
-        if seen_count > 1:
-            for sr in server_results:
-                if (sr.addr == seen_add_port[0]) and (sr.gameport == seen_add_port[1]):
-                    logger.warning(
-                        "duplicated server detected: %s:%s [%s], seen earlier as: %s",
-                        sr.addr, sr.gameport, sr.name, seen_add_port)
-                    # (GameServerResult, a2s_responded?).
-                    duplicates[seen_add_port].append((sr, False))
-
-    # TODO: refactor info a function.
-    # TODO: refactor complex nested structures.
+
+        if key in first_seen:
+            logger.warning(
+                "duplicated server detected: %s:%s [%s], seen earlier as: %s",
+                sr.addr, sr.gameport, sr.name, first_seen[key])
+            duplicates[key].append(sr)
+            metrics.incr(metrics.DISCOVERY_DUPLICATES)
+            continue
+
+        first_seen[key] = sr
+        pending.append(sr)
+        if len(pending) >= DISCOVER_BATCH_SIZE:
+            dispatched.update(_dispatch_known_servers(
+                [p for p in pending if (p.addr, p.gameport) not in duplicates],
+                trust_scores,
+                volatile,
+            ))
+            pending = []
+
+    if not num_results:
+        logger.warning("did not get any server results for query: %s",
+                       query_params)
+        return
+
+    # Rest of the unique servers are dispatched now, duplicated
+    # ones once the real server has been resolved.
+    unique = [
+        sr for key, sr in first_seen.items()
+        if key not in duplicates and key not in dispatched
+    ]
+    for i in range(0, len(unique), DISCOVER_BATCH_SIZE):
+        _dispatch_server_queries(
+            unique[i:i + DISCOVER_BATCH_SIZE], trust_scores, volatile)
+
     if duplicates:
-        # From duplicated servers, detect the "real" server by checking
-        # which of the duplicates successfully answers to A2S queries.
-        # If none of them answer, select the first seen one. This is kind
-        # of shoddy, but the best we can do to weed out the "fake" ones.
-        # TODO: maybe simplify this. Some other data structure must be better.
-        # noinspection PyTypeChecker
-        fut_to_server: dict[
-            futures.Future, tuple[tuple[str, int], GameServerResult, int]
-        ] = {}
-        cpu_count = os.cpu_count() or 1
-        with ThreadPoolExecutor(max_workers=cpu_count * 4) as executor:
-            for dupl_key in duplicates:
-                for i, (dup_serv, _) in enumerate(duplicates[dupl_key]):
-                    fut: futures.Future = executor.submit(
-                        _responds_to_a2s,
-                        (dup_serv.addr, dup_serv.query_port),
-                    )
-                    # noinspection PyTypeChecker
-                    fut_to_server[fut] = (dupl_key, dup_serv, i)
+        replacements = _resolve_duplicates(first_seen, duplicates)
+        resolved = []
+        for key in duplicates:
+            sr = replacements.get(key, first_seen[key])
+            if key not in dispatched:
+                resolved.append(sr)
+            elif sr is not first_seen[key]:
+                # Stored query port no longer responds, but a
+                # duplicate does. Both end up being queried.
+                logger.warning(
+                    "dispatched server %s replaced by duplicate: %s",
+                    first_seen[key], sr)
+                resolved.append(sr)
+        if resolved:
+            _dispatch_server_queries(resolved, trust_scores, volatile)
+
+
+def _dispatch_known_servers(
+        server_results: list[GameServerResult],
+        trust_scores: dict[tuple[str, int], float],
+        volatile: set[tuple[str, int]],
+) -> set[tuple[str, int]]:
+    """Dispatch queries of servers already stored with the
+    same query port. Returns keys of the dispatched servers.
+    """
+    if not server_results:
+        return set()
+
+    known = _known_query_ports(server_results)
+    known_results = [
+        sr for sr in server_results
+        if known.get((sr.addr, sr.gameport)) == sr.query_port
+    ]
+    if known_results:
+        _dispatch_server_queries(known_results, trust_scores, volatile)
+    return {(sr.addr, sr.gameport) for sr in known_results}
 
-        to_remove: list[GameServerResult] = []
-        done_futs, not_done_futs = futures.wait(fut_to_server, timeout=30.0)
-        for done_fut in done_futs:
-            dupl_key, dup_serv, i = fut_to_server[fut]
-            a2s_responded: bool = done_fut.result()
-            # TODO: maybe use dataclass to avoid copy and write again here.
-            duplicates[dupl_key][i] = (dup_serv, a2s_responded)
-
-        for dupl_servs in duplicates.values():
-            # No A2S responses, use first server, discard rest.
-            if not any((x[1]) for x in dupl_servs):
-                to_remove.extend((x[0] for x in dupl_servs[1:]))
-            # Pick first server that did respond. If multiple servers
-            # responded, we just ignore it. It *should not* be possible
-            # for multiple duplicated servers to respond to the query!
-            else:
-                for serv, resp_ok in dupl_servs:
-                    if resp_ok:
-                        to_remove.append(serv)
-                        break
 
-        for to_rem in to_remove:
-            logger.info("removing duplicated server: %s from results", to_rem)
-            server_results.remove(to_rem)
+def _known_query_ports(
+        server_results: list[GameServerResult],
+) -> dict[tuple[str, int], int]:
+    """Stored query ports of servers, by (address, port)."""
+    gs = db.models.GameServer
+    with app.db_session() as sess:
+        return {
+            (str(row[0]), row[1]): row[2]
+            for row in sess.execute(
+                select(gs.address, gs.port, gs.query_port).where(
+                    sqlalchemy.tuple_(gs.address, gs.port).in_([
+                        (ipaddress.IPv4Address(sr.addr), sr.gameport)
+                        for sr in server_results
+                    ])
+                )
+            )
+        }
+
+
+def _resolve_duplicates(
+        first_seen: dict[tuple[str, int], GameServerResult],
+        duplicates: dict[tuple[str, int], list[GameServerResult]],
+) -> dict[tuple[str, int], GameServerResult]:
+    """From duplicated servers, detect the "real" server by checking
+    which of the duplicates successfully answers to A2S queries.
+    If none of them answer, select the first seen one. This is kind
+    of shoddy, but the best we can do to weed out the "fake" ones.
+
+    Returns the servers that should replace the first seen server.
+    """
+    candidates = {
+        key: [first_seen[key], *dupl_servs]
+        for key, dupl_servs in duplicates.items()
+    }
+    responded = {
+        key: [False] * len(servs)
+        for key, servs in candidates.items()
+    }
+
+    # noinspection PyTypeChecker
+    fut_to_server: dict[futures.Future, tuple[tuple[str, int], int]] = {}
+    cpu_count = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=cpu_count * 4) as executor:
+        for key, servs in candidates.items():
+            for i, serv in enumerate(servs):
+                fut: futures.Future = executor.submit(
+                    _responds_to_a2s,
+                    (serv.addr, serv.query_port),
+                )
+                # noinspection PyTypeChecker
+                fut_to_server[fut] = (key, i)
 
+        done_futs, _ = futures.wait(fut_to_server, timeout=30.0)
+        for done_fut in done_futs:
+            key, i = fut_to_server[done_fut]
+            responded[key][i] = done_fut.result()
+
+    replacements = {}
+    for key, servs in candidates.items():
+        # Pick first server that did respond. If multiple servers
+        # responded, we just ignore it. It *should not* be possible
+        # for multiple duplicated servers to respond to the query!
+        # If there are no A2S responses, the first server is kept.
+        for i, resp_ok in enumerate(responded[key]):
+            if resp_ok:
+                if i > 0:
+                    replacements[key] = servs[i]
+                break
+
+        kept = replacements.get(key, servs[0])
+        for serv in servs:
+            if serv is not kept:
+                logger.info("removing duplicated server: %s from results", serv)
+
+    return replacements
+
+
+def _dispatch_server_queries(
+        server_results: list[GameServerResult],
+        trust_scores: dict[tuple[str, int], float],
+        volatile: set[tuple[str, int]],
+):
     # Randomize order to normalize delays between discovery to queries.
     random.shuffle(server_results)
 
@@ -450,22 +821,128 @@ def discover_servers(query_params: Dict[str, str | int]):
             for sr in server_results
         ]
     )
-    on_update_stmt = stmt.on_conflict_do_update(
+    on_update_stmt: ReturningInsert[Any] = stmt.on_conflict_do_update(
         index_elements=["address", "port"],
         set_={
             "query_port": stmt.excluded.query_port,
         },
+    ).returning(
+        db.models.GameServer.id,
+        db.models.GameServer.address,
+        db.models.GameServer.port,
+        # Row was inserted, not updated, i.e. this is a new server.
+        sqlalchemy.literal_column("(xmax = 0)"),
     )
 
+    new_servers = set()
     with app.db_session.begin() as sess:
-        sess.execute(on_update_stmt)
+        for row in sess.execute(on_update_stmt):
+            key = (str(row[1]), row[2])
+            _server_ids[key] = row[0]
+            if row[3]:
+                new_servers.add(key)
+    # Only new servers, query port updates expire from the cache.
+    rowcache.invalidate(
+        redis_client(),
+        rowcache.GAME_SERVER,
+        [addr for addr, _ in new_servers],
+    )
 
     for sr in server_results:
+        key = (sr.addr, sr.gameport)
+        priority = _probe_priority(
+            key,
+            new_servers,
+            trust_scores,
+            volatile,
+        )
         query_server_state.apply_async(
-            (dataclasses.asdict(sr),),
+            (dataclasses.asdict(sr), priority, _server_ids[key]),
             expires=QUERY_INTERVAL,
+            priority=priority,
+        )
+
+
+def _server_id(
+        session: sqlalchemy.orm.Session,
+        address: str,
+        port: int,
+) -> int:
+    key = (address, port)
+    try:
+        return _server_ids[key]
+    except KeyError:
+        server_id = session.scalar(
+            select(db.models.GameServer.id).where(
+                (db.models.GameServer.address == ipaddress.IPv4Address(address))
+                & (db.models.GameServer.port == port)
+            )
+        )
+        if server_id is None:
+            raise ValueError(f"unknown game server: {address}:{port}")
+        _server_ids[key] = server_id
+        return server_id
+
+
+def _cached_trust_lookups() -> tuple[
+    dict[tuple[str, int], float], set[tuple[str, int]]
+]:
+    """Return cached low trust scores and volatile servers
+    as lookups keyed by (address, port).
+    """
+    trust_scores: dict[tuple[str, int], float] = {}
+    volatile: set[tuple[str, int]] = set()
+
+    try:
+        r = redis_client()
+        cached_trust = trust_cache.get_all(r)
+        packed_volatile = cast(bytes | None, r.get(TRUST_VOLATILITY_KEY))
+    except Exception as e:
+        logger.error("error reading cached trust values: %s", e)
+        return trust_scores, volatile
+
+    coder = coding.ZstdMsgPackCoder()
+
+    for addr, (ports, scores) in cached_trust.items():
+        for port, score in zip(ports, scores):
+            trust_scores[(addr, port)] = score
+
+    if packed_volatile:
+        volatile.update(
+            (str(addr), port)
+            for addr, port, _ in coder.decode(packed_volatile)
         )
 
+    return trust_scores, volatile
+
+
+def _probe_priority(
+        key: tuple[str, int],
+        new_servers: set[tuple[str, int]],
+        trust_scores: dict[tuple[str, int], float],
+        volatile: set[tuple[str, int]],
+) -> int:
+    if key in new_servers:
+        return PRIORITY_NEW_SERVER
+
+    priority = PRIORITY_DEFAULT
+
+    score = trust_scores.get(key)
+    if score is not None:
+        # Scale [0.0, TRUST_CUTOFF] to low trust priority range.
+        score = _clamp(score / TRUST_CUTOFF, 0.0, 1.0)
+        priority = PRIORITY_LOW_TRUST_MIN + round(
+            score * (PRIORITY_LOW_TRUST_MAX - PRIORITY_LOW_TRUST_MIN))
+
+    if key in volatile:
+        priority = min(priority, PRIORITY_VOLATILE)
+
+    return priority
+
+
+def _clamp(x: float, x_min: float, x_max: float) -> float:
+    return max(x_min, min(x, x_max))
+
 
 @app.task(
     ignore_result=True,
@@ -473,7 +950,11 @@ def discover_servers(query_params: Dict[str, str | int]):
     default_retry_delay=2,
     max_retries=3,
 )
-def query_server_state(server: Dict[str, Any]):
+def query_server_state(
+        server: Dict[str, Any],
+        priority: int = PRIORITY_DEFAULT,
+        server_id: Optional[int] = None,
+):
     gs_result = GameServerResult(**server)
     a2s_addr = (gs_result.addr, gs_result.query_port)
     gameport = gs_result.gameport
@@ -482,45 +963,84 @@ def query_server_state(server: Dict[str, Any]):
     #   happens? That would be closer to reality.
     query_time = datetime.datetime.now(tz=datetime.timezone.utc)
 
+    values = {
+        "time": query_time,
+        "steamid": gs_result.steamid,
+        "name": gs_result.name,
+        "appid": gs_result.appid,
+        "gamedir": gs_result.gamedir,
+        "version": gs_result.version,
+        "product": gs_result.product,
+        "region": gs_result.region,
+        "players": gs_result.players,
+        "max_players": gs_result.max_players,
+        "bots": gs_result.bots,
+        "map": gs_result.map,
+        "secure": gs_result.secure,
+        "dedicated": gs_result.dedicated,
+        "os": gs_result.os,
+        "gametype": gs_result.gametype,
+    }
+
+    static = db.latest.static_key(values)
+
     with app.db_session.begin() as sess:
-        state = db.models.GameServerState(
-            time=query_time,
-            game_server_address=gs_result.addr,
-            game_server_port=gameport,
-            steamid=gs_result.steamid,
-            name=gs_result.name,
-            appid=gs_result.appid,
-            gamedir=gs_result.gamedir,
-            version=gs_result.version,
-            product=gs_result.product,
-            region=gs_result.region,
-            players=gs_result.players,
-            max_players=gs_result.max_players,
-            bots=gs_result.bots,
-            map=gs_result.map,
-            secure=gs_result.secure,
-            dedicated=gs_result.dedicated,
-            os=gs_result.os,
-            gametype=gs_result.gametype,
-        )
-        sess.add(state)
+        if server_id is None:
+            server_id = _server_id(sess, gs_result.addr, gameport)
+        values["game_server_id"] = server_id
+
+        # Probes of a server land on any worker, the latest
+        # row is the only reliable previous state. The first state
+        # of each chunk is a full state, chunks are archived and
+        # dropped by retention without depending on earlier ones.
+        static_since = query_time
+        prev = db.latest.static_state(sess, server_id)
+        if (
+                prev is not None
+                and prev[0] == static
+                and prev[1] <= query_time
+                and (query_time - prev[1]) < STATIC_MAX_RUN
+                and (db.latest.chunk_start(prev[1])
+                     == db.latest.chunk_start(query_time))
+        ):
+            static_since = prev[1]
+        values["static_since"] = static_since
+
+        state_values = values
+        if static_since != query_time:
+            # Unchanged, static columns are stored in the
+            # state at static_since.
+            state_values = {
+                key: value for key, value in values.items()
+                if key not in db.latest.STATIC_COLUMNS
+            }
+
+        sess.add(db.models.GameServerState(**state_values))
+        sess.execute(db.latest.upsert_stmt(values))
+
+    rowcache.invalidate(
+        redis_client(), rowcache.GAME_SERVER_LATEST, [gs_result.addr])
 
     a2s_tasks.a2s_info.apply_async(
-        (a2s_addr, gameport, query_time),
+        (a2s_addr, gameport, query_time, server_id),
         expires=A2S_TASK_EXPIRY,
+        priority=priority,
     )
     a2s_tasks.a2s_rules.apply_async(
-        (a2s_addr, gameport, query_time),
+        (a2s_addr, gameport, query_time, server_id),
         expires=A2S_TASK_EXPIRY,
+        priority=priority,
     )
     a2s_tasks.a2s_players.apply_async(
-        (a2s_addr, gameport, query_time),
+        (a2s_addr, gameport, query_time, server_id),
         expires=A2S_TASK_EXPIRY,
+        priority=priority,
     )
 
     do_icmp_request.apply_async(
-        (gs_result.addr, gameport, query_time),
+        (gs_result.addr, gameport, query_time, server_id),
         expires=A2S_TASK_EXPIRY,
+        priority=priority,
     )
 
 
@@ -533,7 +1053,8 @@ def query_server_state(server: Dict[str, Any]):
 def do_icmp_request(
         game_server_addr: str,
         game_server_port: int,
-        query_time: datetime.datetime
+        query_time: datetime.datetime,
+        server_id: int,
 ):
     resp = icmplib.ping(
         game_server_addr,
@@ -550,18 +1071,117 @@ def do_icmp_request(
 
     )
 
-    addr = ipaddress.IPv4Address(game_server_addr)
-
+    values = {
+        "icmp_responded": is_alive,
+    }
     stmt = update(db.models.GameServerState).where(
         (db.models.GameServerState.time == query_time)
-        & (db.models.GameServerState.game_server_address == addr)
-        & (db.models.GameServerState.game_server_port == game_server_port)
-    ).values(
-        icmp_responded=is_alive,
-    )
+        & (db.models.GameServerState.game_server_id == server_id)
+    ).values(values)
+    latest_stmt = db.latest.update_stmt(server_id, query_time, values)
 
     with app.db_session.begin() as sess:
         sess.execute(stmt)
+        sess.execute(latest_stmt)
+    rowcache.invalidate_state(
+        redis_client(), game_server_addr, server_id, query_time)
+
+
+@app.task(
+    ignore_result=True,
+    autoretry_for=_retry_task_for_errors,
+    default_retry_delay=2,
+    max_retries=3,
+)
+def cluster_rosters():
+    """Cluster servers by the latest player rosters
+    and replace the stored roster clusters.
+    """
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    gss = db.models.GameServerState
+    stmt = select(
+        gss.game_server_id,
+        gss.a2s_player_name_ids,
+    ).distinct(
+        gss.game_server_id,
+    ).where(
+        (gss.time >= now - ROSTER_WINDOW)
+        & gss.a2s_players_responded.is_(True)
+    ).order_by(
+        gss.game_server_id,
+        gss.time.desc(),
+    )
+
+    with app.db_session.begin() as sess:
+        rows = sess.execute(stmt).all()
+        # Shared bot names would cluster every server of a game.
+        bot_names = list(trust.rules.current.bot_names)
+        bot_ids: set[int] = set()
+        if bot_names:
+            bot_ids = set(sess.scalars(
+                select(db.models.PlayerName.id).where(
+                    db.models.PlayerName.name.in_(bot_names))
+            ))
+
+        clusters = roster.cluster(
+            [row[0] for row in rows],
+            [set(row[1] or ()) - bot_ids for row in rows],
+        )
+
+        sess.execute(sqlalchemy.delete(db.models.RosterCluster))
+        values = [
+            {
+                "game_server_id": server_id,
+                "cluster_id": cluster_id,
+                "cluster_size": len(cluster),
+                "time": now,
+            }
+            for cluster_id, cluster in enumerate(clusters)
+            for server_id in cluster
+        ]
+        if values:
+            sess.execute(pg_insert(db.models.RosterCluster), values)
+
+    logger.info(
+        "clustered %s rosters into %s clusters of %s servers",
+        len(rows),
+        len(clusters),
+        sum(len(c) for c in clusters),
+    )
+
+
+@app.task(
+    ignore_result=True,
+    autoretry_for=_retry_task_for_errors,
+    default_retry_delay=2,
+    max_retries=3,
+)
+def archive_state_chunks():
+    root = archive.archive_dir()
+    if root is None:
+        logger.info("SPOOFSPY_ARCHIVE_DIR not set, not archiving")
+        return
+
+    num_chunks = archive.archive_chunks(app.db_session, root)
+    logger.info("archived %s chunks to '%s'", num_chunks, root)
+
+
+@app.task(
+    ignore_result=True,
+    autoretry_for=_retry_task_for_errors,
+    default_retry_delay=2,
+    max_retries=3,
+)
+def collect_blobs():
+    with app.db_session.begin() as sess:
+        num_deleted = sess.execute(
+            db.queries.collect_blobs,
+            {
+                "seen_before": (datetime.datetime.now(tz=datetime.timezone.utc)
+                                - db.blobs.MAX_AGE),
+            },
+        ).rowcount
+    logger.info("deleted %s unreferenced A2S blobs", num_deleted)
 
 
 @app.task(
@@ -586,14 +1206,16 @@ def cache_trust_aggregate():
         return
 
     try:
-        coder = coding.ZstdMsgPackCoder()
         with app.db_session.begin() as sess:
-            vals = _select_trust_aggregate(sess)
-            packed = coder.encode(vals)
-            logger.info("caching trust values (len=%s) (size=%s)",
-                        len(vals), len(packed))
+            _refresh_trust_cache(r, sess)
+
+            coder = coding.ZstdMsgPackCoder()
+            volatile = _select_trust_volatility(sess)
+            packed = coder.encode(volatile)
+            logger.info("caching trust volatility values (len=%s) (size=%s)",
+                        len(volatile), len(packed))
             r.set(
-                name=TRUST_KEY,
+                name=TRUST_VOLATILITY_KEY,
                 value=packed,
                 ex=datetime.timedelta(hours=24),
             )
@@ -604,17 +1226,77 @@ def cache_trust_aggregate():
             lock.release()
 
 
+def _refresh_trust_cache(r: redis.Redis, session: sqlalchemy.orm.Session):
+    """Update cached trust values of addresses with newly evaluated
+    trust scores and addresses that have not been seen in 24 hours
+    since the last refresh. The whole cache is rebuilt if it's empty.
+    """
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    last_refreshed = trust_cache.last_refreshed(r)
+    dirty = trust_cache.pop_dirty(r)
+
+    if trust_cache.version(r) is None or last_refreshed is None:
+        vals = _select_trust_aggregate(session)
+        new_version = trust_cache.apply_changes(
+            r, set(), vals, refreshed=now, full=True)
+        logger.info("rebuilt trust cache (len=%s) (version=%s)",
+                    len(vals), new_version)
+        return
+
+    # Servers that dropped out of the "last seen in 24 hours"
+    # window since the last refresh.
+    window = datetime.timedelta(hours=24)
+    expired = session.scalars(
+        select(
+            db.models.GameServer.address,
+        ).join(
+            db.models.GameServerLatest,
+        ).where(
+            (db.models.GameServerLatest.time >= last_refreshed - window)
+            & (db.models.GameServerLatest.time < now - window)
+        ).distinct()
+    )
+    changed = dirty | {str(addr) for addr in expired}
+
+    try:
+        vals = _select_trust_aggregate(session, changed) if changed else {}
+        new_version = trust_cache.apply_changes(
+            r, changed, vals, refreshed=now)
+    except Exception:
+        # Retry on next refresh.
+        trust_cache.mark_dirty(r, dirty)
+        raise
+
+    logger.info("updated trust cache (changed=%s) (cached=%s) (version=%s)",
+                len(changed), len(vals), new_version)
+
+
 # TODO: deduplicate this?
 def _select_trust_aggregate(
-        session: sqlalchemy.orm.Session
-) -> list[tuple[ipaddress.IPv4Address, tuple[int, ...], tuple[float, ...]]]:
-    params = {"cutoff": 0.31}
-    ret = []
+        session: sqlalchemy.orm.Session,
+        addresses: set[str] | None = None,
+) -> dict[str, trust_cache.TrustValue]:
+    params = {
+        "cutoff": TRUST_CUTOFF,
+        "all_addresses": addresses is None,
+        "addresses": list(addresses or []),
+    }
+    ret = {}
     for row in session.execute(db.queries.trust_aggregate, params):
         len1 = len(row[1])
         len2 = len(row[2])
         if len1 != len2:
             logger.error("agg list lengths don't match: %s != %s",
                          len1, len2)
-        ret.append((row[0], row[1], row[2]))
+        ret[str(row[0])] = (tuple(row[1]), tuple(row[2]))
     return ret
+
+
+def _select_trust_volatility(
+        session: sqlalchemy.orm.Session
+) -> list[tuple[ipaddress.IPv4Address, int, float]]:
+    params = {"min_stddev": TRUST_VOLATILITY_MIN_STDDEV}
+    return [
+        (row[0], row[1], row[2])
+        for row in session.execute(db.queries.trust_volatility, params)
+    ]
@@ -0,0 +1,151 @@
+import datetime
+from typing import Iterable
+from typing import cast
+
+import redis
+
+from spoofspy import coding
+
+# Hash of address -> packed (ports, trust scores).
+TRUST_SERVERS_KEY = "_spoofspy_trust:servers"
+# Incremented on every cache update.
+TRUST_VERSION_KEY = "_spoofspy_trust:version"
+# Sorted set of address -> version the address last changed in.
+TRUST_CHANGES_KEY = "_spoofspy_trust:changes"
+# Set of addresses with newly evaluated trust scores.
+TRUST_DIRTY_KEY = "_spoofspy_trust:dirty"
+# Timestamp of the last cache refresh.
+TRUST_REFRESHED_KEY = "_spoofspy_trust:refreshed"
+
+TrustValue = tuple[tuple[int, ...], tuple[float, ...]]
+
+_coder = coding.MsgPackCoder()
+
+
+def _pack(ports: Iterable[int], scores: Iterable[float]) -> bytes:
+    return _coder.encode((tuple(ports), tuple(scores)))
+
+
+def _unpack(value: bytes) -> TrustValue:
+    return _coder.decode(value)
+
+
+def _decode_addr(addr: bytes | str) -> str:
+    if isinstance(addr, bytes):
+        return addr.decode("utf-8")
+    return addr
+
+
+def mark_dirty(r: redis.Redis, addresses: Iterable[str]):
+    addresses = set(addresses)
+    if addresses:
+        r.sadd(TRUST_DIRTY_KEY, *addresses)
+
+
+def pop_dirty(r: redis.Redis) -> set[str]:
+    pipe = r.pipeline()
+    pipe.smembers(TRUST_DIRTY_KEY)
+    pipe.delete(TRUST_DIRTY_KEY)
+    dirty, _ = pipe.execute()
+    return {_decode_addr(x) for x in dirty}
+
+
+def version(r: redis.Redis) -> int | None:
+    v = cast(bytes | None, r.get(TRUST_VERSION_KEY))
+    return int(v) if v is not None else None
+
+
+def last_refreshed(r: redis.Redis) -> datetime.datetime | None:
+    ts = cast(bytes | None, r.get(TRUST_REFRESHED_KEY))
+    if ts is None:
+        return None
+    return datetime.datetime.fromtimestamp(
+        float(ts), tz=datetime.timezone.utc)
+
+
+def apply_changes(
+        r: redis.Redis,
+        changed: set[str],
+        values: dict[str, TrustValue],
+        refreshed: datetime.datetime,
+        full: bool = False,
+) -> int:
+    """Store `values` for addresses in `changed` and remove the rest
+    of `changed` from the cache. If `full` is True, `values` replaces
+    all cached values. Returns the new cache version.
+    """
+    if full:
+        changed = changed | set(values) | {
+            _decode_addr(x) for x in
+            cast(list[bytes], r.hkeys(TRUST_SERVERS_KEY))}
+
+    if not changed:
+        r.set(TRUST_REFRESHED_KEY, refreshed.timestamp())
+        return version(r) or 0
+
+    new_version = cast(int, r.incr(TRUST_VERSION_KEY))
+    removed = changed - set(values)
+
+    pipe = r.pipeline(transaction=True)
+    if full:
+        pipe.delete(TRUST_SERVERS_KEY)
+    if values:
+        pipe.hset(TRUST_SERVERS_KEY, mapping={
+            addr: _pack(ports, scores)
+            for addr, (ports, scores) in values.items()
+        })
+    if removed and not full:
+        pipe.hdel(TRUST_SERVERS_KEY, *removed)
+    pipe.zadd(TRUST_CHANGES_KEY, {
+        addr: new_version for addr in changed
+    })
+    pipe.set(TRUST_REFRESHED_KEY, refreshed.timestamp())
+    pipe.execute()
+
+    return new_version
+
+
+def get(r: redis.Redis, addresses: Iterable[str]) -> dict[str, TrustValue]:
+    addresses = list(addresses)
+    if not addresses:
+        return {}
+    return {
+        addr: _unpack(value)
+        for addr, value in zip(
+            addresses,
+            cast(list[bytes | None], r.hmget(TRUST_SERVERS_KEY, addresses)))
+        if value is not None
+    }
+
+
+def get_all(r: redis.Redis) -> dict[str, TrustValue]:
+    return {
+        _decode_addr(addr): _unpack(value)
+        for addr, value in cast(
+            dict[bytes, bytes], r.hgetall(TRUST_SERVERS_KEY)).items()
+    }
+
+
+def changes_since(
+        r: redis.Redis,
+        since_version: int,
+) -> tuple[int | None, dict[str, TrustValue | None]] | None:
+    """Return current version and changed values since `since_version`.
+    Removed addresses have None values. Returns None if the consumer
+    is ahead of the cache, e.g. after the cache has been reset, and
+    must resync with `get_all`.
+    """
+    current = version(r)
+    if current is None or since_version > current:
+        return None
+
+    changed = [
+        _decode_addr(x) for x in
+        cast(list[bytes], r.zrangebyscore(
+            TRUST_CHANGES_KEY, f"({since_version}", "+inf"))
+    ]
+    values = get(r, changed)
+    return current, {
+        addr: values.get(addr)
+        for addr in changed
+    }
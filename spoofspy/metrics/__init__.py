@@ -0,0 +1,27 @@
+from .metrics import A2S_INFO_TIMEOUTS
+from .metrics import A2S_PLAYERS_TIMEOUTS
+from .metrics import A2S_RULES_TIMEOUTS
+from .metrics import DISCOVERY_DUPLICATES
+from .metrics import STEAM_WEB_API_CACHE_HITS
+from .metrics import STEAM_WEB_API_QUERIES
+from .metrics import TOTAL_BUCKET
+from .metrics import Counters
+from .metrics import MetricsFlusher
+from .metrics import counters
+from .metrics import flush
+from .metrics import incr
+
+__all__ = [
+    "A2S_INFO_TIMEOUTS",
+    "A2S_PLAYERS_TIMEOUTS",
+    "A2S_RULES_TIMEOUTS",
+    "DISCOVERY_DUPLICATES",
+    "STEAM_WEB_API_CACHE_HITS",
+    "STEAM_WEB_API_QUERIES",
+    "TOTAL_BUCKET",
+    "Counters",
+    "MetricsFlusher",
+    "counters",
+    "flush",
+    "incr",
+]
@@ -0,0 +1,126 @@
+import datetime
+import logging
+import threading
+from collections import Counter
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import sessionmaker
+
+from spoofspy import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 60.0
+
+# Bucket holding all-time totals of each metric.
+TOTAL_BUCKET = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Metric names.
+STEAM_WEB_API_QUERIES = "steam_web_api_queries"
+STEAM_WEB_API_CACHE_HITS = "steam_web_api_cache_hits"
+DISCOVERY_DUPLICATES = "discovery_duplicates"
+A2S_INFO_TIMEOUTS = "a2s_info_timeouts"
+A2S_RULES_TIMEOUTS = "a2s_rules_timeouts"
+A2S_PLAYERS_TIMEOUTS = "a2s_players_timeouts"
+
+
+class Counters:
+    """In-memory metric counters. Incrementing is done without any
+    I/O, accumulated deltas are written to the database periodically
+    by a flusher.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deltas: Counter[str] = Counter()
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self._deltas[name] += n
+
+    def take(self) -> Counter[str]:
+        with self._lock:
+            deltas = self._deltas
+            self._deltas = Counter()
+        return deltas
+
+    def restore(self, deltas: Counter[str]):
+        """Put back deltas taken for a failed flush."""
+        with self._lock:
+            self._deltas.update(deltas)
+
+
+# Process-wide counters.
+counters = Counters()
+
+
+def incr(name: str, n: int = 1):
+    counters.incr(name, n)
+
+
+def _hour_bucket() -> datetime.datetime:
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    return now.replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert(deltas: Counter[str]):
+    bucket = _hour_bucket()
+    stmt = pg_insert(db.models.Metric).values(
+        [
+            {
+                "name": name,
+                "bucket": b,
+                "value": value,
+            }
+            for name, value in deltas.items()
+            for b in (TOTAL_BUCKET, bucket)
+        ]
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["name", "bucket"],
+        set_={
+            "value": db.models.Metric.value + stmt.excluded.value,
+        },
+    )
+
+
+def flush(
+        session: sessionmaker,
+        counters_: Counters = counters,
+):
+    deltas = counters_.take()
+    if not deltas:
+        return
+
+    try:
+        with session.begin() as sess:
+            sess.execute(_upsert(deltas))
+    except Exception as e:
+        logger.error("metrics flush error: %s", e)
+        counters_.restore(deltas)
+
+
+class MetricsFlusher(threading.Thread):
+    """Background thread that flushes metrics periodically
+    and once more when stopped.
+    """
+
+    def __init__(
+            self,
+            session: sessionmaker,
+            interval: float = DEFAULT_FLUSH_INTERVAL,
+            counters_: Counters = counters,
+    ):
+        super().__init__(name="MetricsFlusher", daemon=True)
+        self._session = session
+        self._interval = interval
+        self._counters = counters_
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            flush(self._session, self._counters)
+
+    def stop(self):
+        self._stop_event.set()
+        flush(self._session, self._counters)
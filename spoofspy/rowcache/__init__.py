@@ -0,0 +1,23 @@
+from .rowcache import EXPIRE
+from .rowcache import GAME_SERVER
+from .rowcache import GAME_SERVER_LATEST
+from .rowcache import GAME_SERVER_STATE
+from .rowcache import Loader
+from .rowcache import RowCache
+from .rowcache import invalidate
+from .rowcache import invalidate_state
+from .rowcache import parse_state_id
+from .rowcache import state_id
+
+__all__ = [
+    "EXPIRE",
+    "GAME_SERVER",
+    "GAME_SERVER_LATEST",
+    "GAME_SERVER_STATE",
+    "Loader",
+    "RowCache",
+    "invalidate",
+    "invalidate_state",
+    "parse_state_id",
+    "state_id",
+]
@@ -0,0 +1,207 @@
+import asyncio
+import datetime
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable
+from typing import Callable
+from typing import Iterable
+from typing import cast
+
+import redis
+from redis import asyncio as aioredis
+
+from spoofspy import coding
+
+logger = logging.getLogger(__name__)
+
+# Cached rows are grouped by server address, the key the API filters
+# by, e.g. "_spoofspy_row:game_server:1.2.3.4" -> packed list of rows.
+# States are cached by state ID, see `state_id`.
+KEY_PREFIX = "_spoofspy_row"
+# Packed list of invalidated keys, published by the ingest path.
+INVALIDATE_CHANNEL = "_spoofspy_row:invalidate"
+
+GAME_SERVER = "game_server"
+GAME_SERVER_LATEST = "game_server_latest"
+GAME_SERVER_STATE = "game_server_state"
+
+# Expiry in case an invalidation is lost. Historical re-scores
+# don't invalidate states, they are picked up on expiry.
+EXPIRE = {
+    GAME_SERVER: 600,
+    GAME_SERVER_LATEST: 60,
+    GAME_SERVER_STATE: 600,
+}
+
+# In-process cache in front of Redis, dropped on invalidation.
+LOCAL_SIZE = 10_000
+LOCAL_TTL = 10.0
+
+# Per-key generation, incremented on every invalidation. Must outlive
+# the longest load, an expired generation only skips a write-back.
+GENERATION_EXPIRE = 24 * 60 * 60
+
+Rows = list[dict]
+Loader = Callable[[list[str]], Awaitable[dict[str, Rows]]]
+
+_coder = coding.RowMsgPackCoder()
+
+# Store loaded rows unless the key was invalidated during the load.
+# KEYS: rows key, generation key. ARGV: rows, expiry, generation
+# read before the load ("" if none).
+_SET_IF_GENERATION = """
+if (redis.call("GET", KEYS[2]) or "") ~= ARGV[3] then
+    return 0
+end
+redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+return 1
+"""
+
+
+def key(table: str, address: str) -> str:
+    return f"{KEY_PREFIX}:{table}:{address}"
+
+
+def generation_key(k: str) -> str:
+    return f"{k}:gen"
+
+
+def state_id(game_server_id: int, time: datetime.datetime) -> str:
+    """Row cache key of a GameServerState primary key."""
+    time = time.astimezone(datetime.timezone.utc)
+    return f"{game_server_id}:{time.isoformat()}"
+
+
+def parse_state_id(sid: str) -> tuple[int, datetime.datetime]:
+    game_server_id, time = sid.split(":", 1)
+    return int(game_server_id), datetime.datetime.fromisoformat(time)
+
+
+def invalidate(r: redis.Redis, table: str, addresses: Iterable[str]):
+    """Delete cached rows of addresses, bump their generations and
+    publish the invalidation. Errors are logged, the rows expire
+    eventually.
+    """
+    keys = [key(table, addr) for addr in set(addresses)]
+    if not keys:
+        return
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.delete(*keys)
+        for k in keys:
+            pipe.incr(generation_key(k))
+            pipe.expire(generation_key(k), GENERATION_EXPIRE)
+        pipe.publish(INVALIDATE_CHANNEL, _coder.encode(keys))
+        pipe.execute()
+    except Exception as e:
+        logger.error("error invalidating %s row cache: %s", table, e)
+
+
+def invalidate_state(
+        r: redis.Redis,
+        address: str,
+        game_server_id: int,
+        time: datetime.datetime,
+):
+    """Invalidate an updated state and the latest state of its server."""
+    invalidate(r, GAME_SERVER_LATEST, [address])
+    invalidate(r, GAME_SERVER_STATE, [state_id(game_server_id, time)])
+
+
+class RowCache:
+    """Read-through cache of rows by table and address, or state
+    ID for states. Misses of a multi-address lookup are read from Redis with one MGET and
+    from the database with one loader call. Loaded rows are not
+    written back if the key was invalidated during the load.
+    """
+
+    def __init__(self, r: aioredis.Redis):
+        self._redis = r
+        self._set_if_generation = r.register_script(_SET_IF_GENERATION)
+        # Key -> (expiry, rows).
+        self._local: OrderedDict[str, tuple[float, Rows]] = OrderedDict()
+
+    async def get_many(
+            self,
+            table: str,
+            addresses: Iterable[str],
+            load: Loader,
+    ) -> dict[str, Rows]:
+        """Return address -> rows, addresses without rows
+        are cached and returned as empty lists.
+        """
+        result: dict[str, Rows] = {}
+        now = time.monotonic()
+        misses = []
+        for addr in set(addresses):
+            local = self._local.get(key(table, addr))
+            if local is not None and local[0] > now:
+                result[addr] = local[1]
+            else:
+                misses.append(addr)
+        if not misses:
+            return result
+
+        # Generations are read with the rows, before the load.
+        keys = [key(table, a) for a in misses]
+        values = cast(list[bytes | None], await self._redis.mget(
+            keys + [generation_key(k) for k in keys]))
+        cached = []
+        db_misses = []
+        for addr, value, gen in zip(misses, values, values[len(keys):]):
+            if value is None:
+                db_misses.append((addr, gen))
+            else:
+                result[addr] = _coder.decode(value)
+                cached.append(addr)
+
+        if db_misses:
+            loaded = await load([addr for addr, _ in db_misses])
+            pipe = self._redis.pipeline(transaction=False)
+            for addr, gen in db_misses:
+                rows = loaded.get(addr, [])
+                result[addr] = rows
+                k = key(table, addr)
+                await self._set_if_generation(
+                    keys=[k, generation_key(k)],
+                    args=[_coder.encode(rows), EXPIRE[table], gen or b""],
+                    client=pipe,
+                )
+            stored = await pipe.execute()
+            # Rows of invalidated keys may be stale,
+            # they are returned but not cached.
+            cached.extend(
+                addr for (addr, _), ok in zip(db_misses, stored) if ok)
+
+        for addr in cached:
+            self._set_local(key(table, addr), result[addr], now)
+        return result
+
+    def _set_local(self, k: str, rows: Rows, now: float):
+        self._local[k] = (now + LOCAL_TTL, rows)
+        self._local.move_to_end(k)
+        while len(self._local) > LOCAL_SIZE:
+            self._local.popitem(last=False)
+
+    async def listen(self):
+        """Drop invalidated keys from the in-process cache.
+        Runs until cancelled.
+        """
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                # Invalidations may have been missed while
+                # not subscribed.
+                self._local.clear()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    for k in _coder.decode(message["data"]):
+                        self._local.pop(k, None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("row cache invalidation listener error: %s", e)
+                await asyncio.sleep(1.0)
@@ -1,7 +1,11 @@
+from .scheduler import BudgetExceededError
+from .scheduler import RequestScheduler
 from .web import GameServerResult
 from .web import SteamWebAPI
 
 __all__ = [
+    "BudgetExceededError",
+    "RequestScheduler",
     "GameServerResult",
     "SteamWebAPI",
 ]
@@ -0,0 +1,216 @@
+import datetime
+import hashlib
+import logging
+import time
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import cast
+
+import redis
+import redis.exceptions
+import redis.lock
+import zstandard as zstd
+
+from spoofspy import metrics
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "_spoofspy_webapi"
+
+# Steam Web API default rate limit is 100 000 calls per day per key.
+DEFAULT_DAILY_BUDGET = 100_000
+DEFAULT_CACHE_TTL = 60.0
+# Must exceed the longest request, i.e. SteamWebAPI timeout
+# * (retries + 1), or the single-flight lock expires mid-request.
+# The lock is also held while the caller processes streamed chunks.
+DEFAULT_FLIGHT_TIMEOUT = 150.0
+
+_FLIGHT_POLL_INTERVAL = 0.1
+
+
+class BudgetExceededError(Exception):
+    pass
+
+
+def hash_key(value: str) -> str:
+    """Hash value for use in Redis key names to avoid
+    storing sensitive information such as API keys in them.
+    """
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:32]
+
+
+class RequestScheduler:
+    """Quota-aware Steam Web API request scheduler.
+
+    - Tracks a daily request budget per API key in Redis.
+    - Caches responses in Redis for `cache_ttl` seconds.
+    - Coalesces concurrent identical requests (single-flight),
+      only one caller performs the actual request, the rest
+      wait for its response to appear in the cache.
+    """
+
+    def __init__(
+            self,
+            redis_client: redis.Redis,
+            api_key: str,
+            daily_budget: int = DEFAULT_DAILY_BUDGET,
+            cache_ttl: float = DEFAULT_CACHE_TTL,
+            flight_timeout: float = DEFAULT_FLIGHT_TIMEOUT,
+    ):
+        self._redis = redis_client
+        self._key_id = hash_key(api_key)
+        self._daily_budget = daily_budget
+        self._cache_ttl = datetime.timedelta(seconds=cache_ttl)
+        self._flight_timeout = flight_timeout
+
+    def __repr__(self) -> str:
+        return (f"{self.__class__.__name__}("
+                f"daily_budget={self._daily_budget}, "
+                f"cache_ttl={self._cache_ttl}, "
+                f"flight_timeout={self._flight_timeout})")
+
+    def _budget_key(self) -> str:
+        today = datetime.datetime.now(tz=datetime.timezone.utc).date()
+        return f"{KEY_PREFIX}:budget:{self._key_id}:{today.isoformat()}"
+
+    @staticmethod
+    def _cache_key(request_key: str) -> str:
+        return f"{KEY_PREFIX}:cache:{hash_key(request_key)}"
+
+    @staticmethod
+    def _flight_key(request_key: str) -> str:
+        return f"{KEY_PREFIX}:flight:{hash_key(request_key)}"
+
+    @property
+    def flight_timeout(self) -> float:
+        return self._flight_timeout
+
+    def budget_used(self) -> int:
+        used = cast(bytes | None, self._redis.get(self._budget_key()))
+        return int(used) if used else 0
+
+    def budget_remaining(self) -> int:
+        return max(0, self._daily_budget - self.budget_used())
+
+    def _consume_budget(self) -> bool:
+        pipe = self._redis.pipeline()
+        key = self._budget_key()
+        pipe.incr(key)
+        pipe.expire(key, datetime.timedelta(days=2))
+        used, _ = pipe.execute()
+        if used > self._daily_budget:
+            logger.error("Steam Web API daily budget exceeded: %s > %s",
+                         used, self._daily_budget)
+            return False
+        return True
+
+    def _get_cached(self, cache_key: str) -> bytes | None:
+        cached = cast(bytes | None, self._redis.get(cache_key))
+        if cached is None:
+            return None
+        # Streamed frames don't have content size
+        # in the header, can't use zstd.decompress.
+        return zstd.ZstdDecompressor().decompressobj().decompress(cached)
+
+    def fetch(
+            self,
+            request_key: str,
+            do_request: Callable[[], Iterable[bytes]],
+    ) -> bytes:
+        return b"".join(self.stream(request_key, do_request))
+
+    def stream(
+            self,
+            request_key: str,
+            do_request: Callable[[], Iterable[bytes]],
+    ) -> Iterator[bytes]:
+        """Yield response body chunks for `request_key` from the cache,
+        from an identical in-flight request or by calling `do_request`.
+        `request_key` must uniquely identify the request and must not
+        contain the API key.
+        """
+        cache_key = self._cache_key(request_key)
+        flight_key = self._flight_key(request_key)
+        deadline = time.monotonic() + self._flight_timeout
+
+        while True:
+            cached = self._get_cached(cache_key)
+            if cached is not None:
+                logger.debug("response cache hit: %s", request_key)
+                metrics.incr(metrics.STEAM_WEB_API_CACHE_HITS)
+                yield cached
+                return
+
+            lock = redis.lock.Lock(
+                self._redis,
+                name=flight_key,
+                timeout=self._flight_timeout,
+            )
+            if lock.acquire(blocking=False):
+                yield from self._stream_leader(
+                    request_key, cache_key, do_request, lock)
+                return
+
+            # Another worker is already performing this request,
+            # wait for its response to land in the cache.
+            while self._redis.exists(flight_key):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"timed out waiting for in-flight request: {request_key}")
+                time.sleep(_FLIGHT_POLL_INTERVAL)
+
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"timed out waiting for in-flight request: {request_key}")
+
+    def _stream_leader(
+            self,
+            request_key: str,
+            cache_key: str,
+            do_request: Callable[[], Iterable[bytes]],
+            lock: redis.lock.Lock,
+    ) -> Iterator[bytes]:
+        """Yield response body chunks as they arrive while holding
+        the single-flight `lock`. Each chunk is held back until the
+        next one has been read, the lock is released once the body
+        has been read and cached, before yielding the last chunk.
+        """
+        last = None
+        try:
+            # Previous leader may have finished between our
+            # cache check and acquiring the lock.
+            last = self._get_cached(cache_key)
+            if last is None:
+                if not self._consume_budget():
+                    raise BudgetExceededError(
+                        f"daily budget of {self._daily_budget} "
+                        f"requests exceeded")
+
+                # Compressed for the cache as chunks arrive.
+                compressor = zstd.ZstdCompressor().compressobj()
+                compressed = []
+                size = 0
+                for chunk in do_request():
+                    if last is not None:
+                        yield last
+                    compressed.append(compressor.compress(chunk))
+                    size += len(chunk)
+                    last = chunk
+                compressed.append(compressor.flush())
+
+                self._redis.set(
+                    name=cache_key,
+                    value=b"".join(compressed),
+                    px=self._cache_ttl,
+                )
+                logger.debug("cached response for: %s (size=%s)",
+                             request_key, size)
+        finally:
+            try:
+                lock.release()
+            except redis.exceptions.LockError as e:
+                logger.warning("flight lock release error: %s", e)
+
+        if last is not None:
+            yield last
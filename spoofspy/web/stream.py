@@ -0,0 +1,83 @@
+import re
+from typing import Iterable
+from typing import Iterator
+
+_ARRAY_START = re.compile(rb'"servers"\s*:\s*\[')
+# Skips everything up to the next structural character that matters
+# for finding object boundaries. Complete strings are skipped as a
+# whole, matching stops at the opening quote of an incomplete string.
+# Possessive quantifiers, backtracking into an incomplete string is
+# exponential in its length.
+_SKIP = re.compile(rb'(?:[^"{}\]]++|"(?:[^"\\]++|\\.)*+")*+', re.DOTALL)
+
+_QUOTE = ord('"')
+_LBRACE = ord("{")
+_RBRACE = ord("}")
+_RBRACKET = ord("]")
+
+
+class ServerObjectSplitter:
+    """Incrementally splits GetServerList response body chunks into
+    raw JSON server objects from the `servers` array. Each object is
+    returned as soon as it has been fully received, only the current
+    partial object is kept in memory.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._obj_start = 0
+        self._pos = 0
+
+    def feed(self, chunk: bytes) -> Iterator[bytes]:
+        if self._done:
+            return
+
+        buf = self._buf
+        buf += chunk
+
+        if not self._in_array:
+            m = _ARRAY_START.search(buf)
+            if m is None:
+                return
+            self._in_array = True
+            del buf[:m.end()]
+            self._pos = 0
+
+        pos = self._pos
+        while True:
+            i = _SKIP.match(buf, pos).end()  # type: ignore[union-attr]
+            if i >= len(buf) or buf[i] == _QUOTE:
+                # Need more data, incomplete strings
+                # are rescanned once it arrives.
+                pos = i
+                break
+
+            ch = buf[i]
+            pos = i + 1
+            if ch == _LBRACE:
+                if self._depth == 0:
+                    self._obj_start = i
+                self._depth += 1
+            elif ch == _RBRACE:
+                self._depth -= 1
+                if self._depth == 0:
+                    yield bytes(buf[self._obj_start:pos])
+            elif ch == _RBRACKET and self._depth == 0:
+                self._done = True
+                buf.clear()
+                return
+
+        # Discard everything that has already been processed.
+        keep_from = self._obj_start if self._depth > 0 else pos
+        del buf[:keep_from]
+        self._pos = pos - keep_from
+        self._obj_start = 0
+
+
+def iter_server_objects(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    splitter = ServerObjectSplitter()
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
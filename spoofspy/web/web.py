@@ -1,18 +1,20 @@
 import logging
 import ssl
 from dataclasses import dataclass
+from typing import Any
 from typing import Dict
 from typing import Generator
+from typing import Iterator
 from typing import Optional
 from urllib.parse import urlencode
 from urllib.parse import urlunparse
 
 import httpx
 import orjson
-from sqlalchemy import select
-from sqlalchemy.orm import sessionmaker
 
-from spoofspy import db
+from spoofspy import metrics
+from spoofspy.web.scheduler import RequestScheduler
+from spoofspy.web.stream import iter_server_objects
 
 SSL_CONTEXT = ssl.create_default_context()
 
@@ -41,26 +43,81 @@ class GameServerResult:
     gametype: Optional[str] = None
 
 
+_GET_SERVER_LIST_PATH = "/IGameServersService/GetServerList/v1/"
+
+
+def _server_list_url(key: str, query_filter: str, limit: int) -> str:
+    params: Dict[str, str | int] = {
+        "key": key,
+    }
+    if query_filter:
+        params["filter"] = query_filter
+    if limit:
+        params["limit"] = limit
+
+    return urlunparse((
+        "https",  # scheme
+        "api.steampowered.com",  # netloc
+        _GET_SERVER_LIST_PATH,  # url
+        None,  # query
+        urlencode(params),  # params
+        None,  # fragment
+    ))
+
+
+def _make_result(server: dict[str, Any]) -> GameServerResult:
+    addr, query_port = server["addr"].split(":")
+    return GameServerResult(
+        addr=addr,
+        query_port=int(query_port),
+        gameport=server["gameport"],
+        steamid=server.get("steamid", None),
+        name=server.get("name", None),
+        appid=server.get("appid", None),
+        gamedir=server.get("gamedir", None),
+        version=server.get("version", None),
+        product=server.get("product", None),
+        region=server.get("region", None),
+        players=server.get("players", None),
+        max_players=server.get("max_players", None),
+        bots=server.get("bots", None),
+        map=server.get("map", None),
+        secure=server.get("secure", None),
+        dedicated=server.get("dedicated", None),
+        os=server.get("os", None),
+        gametype=server.get("gametype", None),
+    )
+
+
 # TODO: do we need a more generalized Steam Web API wrapper?
 #   steam.webapi lacks the endpoints we need.
 # TODO: move this to its own module?
 class SteamWebAPI:
-    # Total number of requests made to Steam Web API
-    # in all SteamWebAPI instances.
-    # TODO: thread safety?
-    api_requests: int = 0
+    """Steam Web API client. Request counts are
+    stored in in-memory metric counters.
+    """
 
-    def __init__(self, key: str, timeout: float = 30.0, retries: int = 3):
+    def __init__(
+            self,
+            key: str,
+            timeout: float = 30.0,
+            retries: int = 3,
+            scheduler: Optional[RequestScheduler] = None,
+    ):
         self._key = key
+        self._scheduler = scheduler
+        if scheduler and scheduler.flight_timeout <= timeout * (retries + 1):
+            logger.warning(
+                "scheduler flight timeout %s is shorter than the longest "
+                "request (timeout=%s, retries=%s)",
+                scheduler.flight_timeout, timeout, retries)
         # TODO: redact sensitive information from httpx logs.
         transport = httpx.HTTPTransport(retries=retries)
         self._client = httpx.Client(
             verify=SSL_CONTEXT, timeout=timeout, transport=transport)
-        self._db_session = sessionmaker(db.engine())
 
     def __del__(self):
         self._client.close()
-        self.store_stats()
 
     def get_server_list(
             self,
@@ -70,69 +127,27 @@ class SteamWebAPI:
         """IGameServersService/GetServerList
         TODO: error handling? Logging?
         """
-        params: Dict[str, str | int] = {
-            "key": self._key,
-        }
-        if query_filter:
-            params["filter"] = query_filter
-        if limit:
-            params["limit"] = limit
-
-        url = urlunparse((
-            "https",  # scheme
-            "api.steampowered.com",  # netloc
-            "/IGameServersService/GetServerList/v1/",  # url
-            None,  # query
-            urlencode(params),  # params
-            None,  # fragment
-        ))
-
+        url = _server_list_url(self._key, query_filter, limit)
+
+        if self._scheduler:
+            # Identifies the request without exposing the key.
+            request_key = f"{_GET_SERVER_LIST_PATH}?{query_filter}&{limit}"
+            chunks = self._scheduler.stream(
+                request_key, lambda: self._stream(url))
+        else:
+            chunks = self._stream(url)
+
+        # Servers are parsed and yielded one by one as the
+        # response body arrives to allow processing them early.
         try:
-            resp = self._client.get(url)
-            resp.raise_for_status()
-            self.api_requests += 1
-            servers = orjson.loads(resp.text)["response"]["servers"]
+            for server_obj in iter_server_objects(chunks):
+                yield _make_result(orjson.loads(server_obj))
         except Exception as e:
-            logger.exception("error processing GET '%s': %s", url, e)
-            servers = []
-
-        for server in servers:
-            addr, query_port = server["addr"].split(":")
-            gsr = GameServerResult(
-                addr=addr,
-                query_port=int(query_port),
-                gameport=server["gameport"],
-                steamid=server.get("steamid", None),
-                name=server.get("name", None),
-                appid=server.get("appid", None),
-                gamedir=server.get("gamedir", None),
-                version=server.get("version", None),
-                product=server.get("product", None),
-                region=server.get("region", None),
-                players=server.get("players", None),
-                max_players=server.get("max_players", None),
-                bots=server.get("bots", None),
-                map=server.get("map", None),
-                secure=server.get("secure", None),
-                dedicated=server.get("dedicated", None),
-                os=server.get("os", None),
-                gametype=server.get("gametype", None),
-            )
-            yield gsr
-
-        self.store_stats()
-
-    def store_stats(self):
-        if self.api_requests <= 0:
-            return
+            logger.exception("error processing GET '%s': %s",
+                             _GET_SERVER_LIST_PATH, e)
 
-        try:
-            with self._db_session.begin() as sess:
-                stats = sess.scalar(
-                    select(db.models.QueryStatistics)
-                )
-                stats.steam_web_api_queries += self.api_requests
-                sess.merge(stats)
-            self.api_requests = 0
-        except Exception as e:
-            logger.error("store_stats error: %s", e)
+    def _stream(self, url: str) -> Iterator[bytes]:
+        with self._client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            metrics.incr(metrics.STEAM_WEB_API_QUERIES)
+            yield from resp.iter_bytes()
@@ -0,0 +1,5 @@
+import os
+
+# Importing spoofspy configures the Celery app, which requires
+# a broker URL. Nothing connects to it during the tests.
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
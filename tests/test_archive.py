@@ -0,0 +1,195 @@
+"""Archive round-trip: states exported with `archive.archive_chunk`
+read back and scored offline match the database rows. Needs
+DATABASE_URL of a database initialized with `db.drop_create_all`.
+Nothing is committed, generated rows are rolled back.
+"""
+
+import datetime
+import os
+import random
+from typing import Any
+
+import pytest
+
+if not os.environ.get("DATABASE_URL"):
+    pytest.skip("DATABASE_URL not set", allow_module_level=True)
+
+import orjson
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from spoofspy import archive
+from spoofspy import db
+from spoofspy.heuristics import trust
+from spoofspy.jobs import scoring
+
+RANGE_START = datetime.datetime(2002, 1, 3, tzinfo=datetime.timezone.utc)
+RANGE_END = RANGE_START + datetime.timedelta(days=7)
+NUM_SERVERS = 5
+STATES_PER_SERVER = 20
+
+PLAYER_NAMES = ["alice", "bob", "Player", "xXx"]
+
+
+@pytest.fixture
+def session():
+    with Session(db.engine()) as sess:
+        yield sess
+        sess.rollback()
+
+
+def _static(rng: random.Random, i: int) -> dict[str, Any]:
+    return {
+        "steamid": 90000000000000000 + i,
+        "name": f"server {i} {rng.randint(0, 1000)}",
+        "appid": 418460,
+        "gamedir": "RS2",
+        "version": "1.0",
+        "product": "RS2",
+        "region": 255,
+        "max_players": 64,
+        "dedicated": True,
+        "os": "w",
+        "gametype": "ROGame.ROGameInfoTerritories",
+    }
+
+
+def _insert_states(
+        sess: Session,
+        rng: random.Random,
+) -> tuple[list[int], dict[int, Any], dict[int, str]]:
+    stmt = pg_insert(db.models.GameServer).values([
+        {"address": f"198.51.100.{i}", "port": 7777, "query_port": 27015}
+        for i in range(1, NUM_SERVERS + 1)
+    ])
+    server_ids = list(sess.scalars(
+        stmt.on_conflict_do_update(
+            index_elements=["address", "port"],
+            set_={"query_port": stmt.excluded.query_port},
+        ).returning(db.models.GameServer.id)
+    ))
+
+    names_stmt = pg_insert(db.models.PlayerName).values(
+        [{"name": name} for name in PLAYER_NAMES])
+    name_ids = dict(sess.execute(
+        names_stmt.on_conflict_do_update(
+            index_elements=["name"],
+            set_={"name": names_stmt.excluded.name},
+        ).returning(db.models.PlayerName.id, db.models.PlayerName.name)
+    ).all())
+
+    blobs = {}
+    for i in range(3):
+        data = {"rules": i, "nested": {"x": [i, None, "a"]}}
+        blobs[db.blobs.store(sess, data)] = data
+
+    states = []
+    for i, server_id in enumerate(server_ids):
+        static = _static(rng, i)
+        # First full state is in the previous chunk.
+        full_time = RANGE_START - datetime.timedelta(hours=1)
+        for j in range(STATES_PER_SERVER):
+            time = RANGE_START + datetime.timedelta(minutes=5 * j + i)
+            if j == 0:
+                time = full_time
+            elif j == STATES_PER_SERVER // 2:
+                # Static columns changed.
+                static = _static(rng, i)
+                full_time = time
+
+            players = rng.randint(0, 64)
+            state = {
+                "time": time,
+                "game_server_id": server_id,
+                "static_since": full_time,
+                "players": players,
+                "secure": rng.choice([True, False]),
+                "map": rng.choice(["VNTE-CuChi", "WWTE-Suomussalmi"]),
+                "a2s_info_responded": True,
+                "a2s_map_name": "VNTE-CuChi",
+                "a2s_player_count": players + rng.randint(0, 10),
+                "a2s_max_players": 64,
+                "a2s_info_hash": rng.choice(list(blobs)),
+                "a2s_rules_responded": True,
+                "a2s_num_public_connections": 64,
+                "a2s_num_open_public_connections": rng.randint(0, 64),
+                "a2s_pi_count": 0,
+                "a2s_pi_names": [],
+                "a2s_pi_platforms": [],
+                "a2s_pi_steam_count": 0,
+                "a2s_pi_eos_count": 0,
+                "a2s_mutators_running": [],
+                "a2s_rules_hash": rng.choice(list(blobs)),
+                "a2s_players_responded": True,
+                "a2s_player_name_ids": rng.sample(
+                    list(name_ids), rng.randint(0, len(name_ids))),
+                **dict.fromkeys(db.latest.STATIC_COLUMNS),
+            }
+            if time == full_time:
+                state.update(static)
+            states.append(state)
+
+    sess.execute(
+        sqlalchemy.insert(db.models.GameServerState.__table__), states)
+    return server_ids, blobs, name_ids
+
+
+def _db_states(sess: Session, server_ids: list[int]) -> dict:
+    gss = db.models.GameServerState
+    batch = scoring.to_batch(sess.execute(
+        scoring.input_stmt(
+            (gss.time >= RANGE_START)
+            & (gss.time < RANGE_END)
+            & gss.game_server_id.in_(server_ids)
+        )
+    ).all())
+    return {
+        (state.game_server_id, state.time): state
+        for state in scoring._states(batch)
+    }
+
+
+def test_archive_round_trip(session, tmp_path):
+    rng = random.Random(1)
+    server_ids, blobs, names = _insert_states(session, rng)
+
+    num_rows = archive.archive_chunk(
+        session, tmp_path, "_test_chunk", RANGE_START, RANGE_END)
+    assert num_rows == NUM_SERVERS * (STATES_PER_SERVER - 1)
+
+    archived = list(archive.iter_states(tmp_path))
+    assert len(archived) == num_rows
+
+    gss = db.models.GameServerState
+    full = {
+        (row.game_server_id, row.time): row
+        for row in session.execute(
+            sqlalchemy.select(gss.__table__).where(
+                gss.game_server_id.in_(server_ids)
+                & (gss.time == gss.static_since)
+            )
+        )
+    }
+    for state in archived:
+        # Resolved from the full state, also from the previous chunk.
+        ref = full[(state.game_server_id, state.static_since)]
+        for col in db.latest.STATIC_COLUMNS:
+            assert getattr(state, col) == getattr(ref, col), col
+        assert orjson.loads(state.a2s_info) == blobs[state.a2s_info_hash]
+        assert orjson.loads(state.a2s_rules) == blobs[state.a2s_rules_hash]
+        assert state.a2s_player_names == [
+            names[name_id] for name_id in state.a2s_player_name_ids
+        ]
+
+    db_states = _db_states(session, server_ids)
+    expected = {
+        (state.game_server_address, state.game_server_port, state.time):
+            trust.eval_trust_score(state)  # type: ignore[arg-type]
+        for state in db_states.values()
+    }
+    actual = {
+        (address, port, time): score
+        for address, port, time, score in archive.eval_archive(tmp_path)
+    }
+    assert actual == pytest.approx(expected)
@@ -0,0 +1,180 @@
+import fakeredis
+import orjson
+import pytest
+
+from spoofspy.jobs import tasks
+from spoofspy.web import RequestScheduler
+from spoofspy.web import SteamWebAPI
+
+CHUNK_SIZE = 32
+
+
+def _server(i: int, query_port: int = 27015) -> dict:
+    return {
+        "addr": f"192.0.2.{i}:{query_port}",
+        "gameport": 7777,
+        "name": f"server {i}",
+    }
+
+
+class Discovery:
+    """Runs discover_servers over a streamed response body, recording
+    the order of received chunks and dispatched servers.
+    """
+
+    def __init__(self, monkeypatch, known=(), responding=()):
+        self.events: list = []
+        self.known = {
+            (f"192.0.2.{i}", 7777): port for i, port in known
+        }
+        self.responding = {
+            (f"192.0.2.{i}", port) for i, port in responding
+        }
+        self._monkeypatch = monkeypatch
+
+        self.api = SteamWebAPI(
+            "key", scheduler=RequestScheduler(fakeredis.FakeRedis(), "key"))
+        monkeypatch.setattr(tasks, "webapi", lambda: self.api)
+        monkeypatch.setattr(
+            tasks, "_cached_trust_lookups", lambda: ({}, set()))
+        monkeypatch.setattr(tasks, "_known_query_ports", self._known)
+        monkeypatch.setattr(
+            tasks, "_dispatch_server_queries", self._dispatch)
+        monkeypatch.setattr(
+            tasks, "_responds_to_a2s", lambda addr: addr in self.responding)
+        monkeypatch.setattr(tasks, "DISCOVER_BATCH_SIZE", 2)
+
+    def _known(self, server_results):
+        return {
+            (sr.addr, sr.gameport): self.known[(sr.addr, sr.gameport)]
+            for sr in server_results
+            if (sr.addr, sr.gameport) in self.known
+        }
+
+    def _dispatch(self, server_results, *_args):
+        self.events.append([
+            (sr.addr, sr.query_port) for sr in server_results
+        ])
+
+    def run(self, servers: list[dict]):
+        body = orjson.dumps({"response": {"servers": servers}})
+
+        def stream(_url):
+            for i in range(0, len(body), CHUNK_SIZE):
+                self.events.append("chunk")
+                yield body[i:i + CHUNK_SIZE]
+            self.events.append("end")
+
+        self._monkeypatch.setattr(self.api, "_stream", stream)
+        tasks.discover_servers({"filter": "test"})
+
+    def dispatched(self) -> list[tuple[str, int]]:
+        return sorted(
+            server
+            for event in self.events if isinstance(event, list)
+            for server in event
+        )
+
+    def dispatched_before_end(self) -> list[tuple[str, int]]:
+        return sorted(
+            server
+            for event in self.events[:self.events.index("end")]
+            if isinstance(event, list)
+            for server in event
+        )
+
+
+def test_known_servers_dispatched_before_body_completes(monkeypatch):
+    discovery = Discovery(
+        monkeypatch, known=[(i, 27015) for i in range(1, 7)])
+    discovery.run([_server(i) for i in range(1, 7)])
+
+    assert ("192.0.2.1", 27015) in discovery.dispatched_before_end()
+    assert discovery.dispatched() == [
+        (f"192.0.2.{i}", 27015) for i in range(1, 7)
+    ]
+
+
+def test_new_servers_wait_for_body(monkeypatch):
+    discovery = Discovery(monkeypatch, known=[(1, 27015), (2, 27016)])
+    discovery.run([_server(i) for i in range(1, 5)])
+
+    # Server 2 query port changed.
+    assert discovery.dispatched_before_end() == [("192.0.2.1", 27015)]
+    assert discovery.dispatched() == [
+        (f"192.0.2.{i}", 27015) for i in range(1, 5)
+    ]
+
+
+def test_duplicate_of_new_server(monkeypatch):
+    discovery = Discovery(monkeypatch, responding=[(1, 27016)])
+    discovery.run([
+        _server(1),
+        _server(2),
+        _server(3),
+        _server(1, query_port=27016),
+    ])
+
+    assert discovery.dispatched() == [
+        ("192.0.2.1", 27016),
+        ("192.0.2.2", 27015),
+        ("192.0.2.3", 27015),
+    ]
+
+
+def test_duplicate_of_dispatched_server(monkeypatch):
+    discovery = Discovery(
+        monkeypatch,
+        known=[(1, 27015), (2, 27015)],
+        responding=[(1, 27015)],
+    )
+    discovery.run([
+        _server(1),
+        _server(2),
+        _server(3),
+        _server(1, query_port=27016),
+    ])
+
+    assert discovery.dispatched_before_end() == [
+        ("192.0.2.1", 27015),
+        ("192.0.2.2", 27015),
+    ]
+    assert discovery.dispatched() == [
+        ("192.0.2.1", 27015),
+        ("192.0.2.2", 27015),
+        ("192.0.2.3", 27015),
+    ]
+
+
+def test_duplicate_before_batch_is_dispatched(monkeypatch):
+    discovery = Discovery(
+        monkeypatch,
+        known=[(1, 27015)],
+        responding=[(1, 27016)],
+    )
+    discovery.run([
+        _server(1),
+        _server(1, query_port=27016),
+        _server(2),
+    ])
+
+    assert discovery.dispatched() == [
+        ("192.0.2.1", 27016),
+        ("192.0.2.2", 27015),
+    ]
+
+
+def test_no_results(monkeypatch):
+    discovery = Discovery(monkeypatch)
+    discovery.run([])
+    assert discovery.dispatched() == []
+
+
+@pytest.mark.parametrize("num_servers", [1, 2, 5])
+def test_every_server_dispatched_once(monkeypatch, num_servers):
+    discovery = Discovery(
+        monkeypatch, known=[(i, 27015) for i in range(1, num_servers, 2)])
+    discovery.run([_server(i) for i in range(1, num_servers + 1)])
+    assert discovery.dispatched() == [
+        (f"192.0.2.{i}", 27015) for i in range(1, num_servers + 1)
+    ]
@@ -0,0 +1,153 @@
+import dataclasses
+import datetime
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from spoofspy.heuristics import features
+from spoofspy.jobs import scoring
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _state(i: int, players: int, **kwargs) -> SimpleNamespace:
+    return SimpleNamespace(
+        time=START + datetime.timedelta(minutes=5 * i),
+        players=players,
+        a2s_players_responded=bool(kwargs),
+        **kwargs,
+    )
+
+
+def _run(player_counts: list[int]) -> list[features.ServerFeatures]:
+    feats = features.ServerFeatures()
+    history = []
+    for i, players in enumerate(player_counts):
+        feats = features.update(feats, _state(i, players))
+        history.append(feats)
+    return history
+
+
+def test_ewma():
+    history = _run([10, 20])
+    assert history[0].players_ewma == 10.0
+    assert history[1].players_ewma == pytest.approx(
+        10.0 + features.ALPHA * 10.0)
+    assert history[1].players_delta_ewma == pytest.approx(
+        features.ALPHA * 10.0)
+    assert history[1].samples == 2
+
+
+def test_old_state_ignored():
+    feats = _run([10, 20])[-1]
+    assert features.update(feats, _state(0, 30)) is feats
+
+
+def test_stable_player_count_no_anomalies():
+    history = _run([30] * 50)
+    assert all(f.anomaly_flags == 0 for f in history)
+    assert history[-1].anomaly_ewma == 0.0
+
+
+def test_warm_up_no_anomalies():
+    history = _run([0, 64, 0, 64, 0][:features.ANOMALY_MIN_SAMPLES])
+    assert all(f.anomaly_flags == 0 for f in history)
+
+
+def test_jump():
+    history = _run([20] * 20 + [60])
+    assert history[-1].anomaly_flags & features.ANOMALY_JUMP
+    assert history[-1].anomaly_ewma == pytest.approx(features.ALPHA)
+
+
+def test_cusum_shift_up():
+    # Small steady increase, not a jump.
+    history = _run([20] * 20 + [24] * 10)
+    flags = [f.anomaly_flags for f in history[20:]]
+    assert not any(f & features.ANOMALY_JUMP for f in flags)
+    assert any(f & features.ANOMALY_SHIFT_UP for f in flags)
+    assert not any(f & features.ANOMALY_SHIFT_DOWN for f in flags)
+
+
+def test_cusum_shift_down():
+    history = _run([24] * 20 + [20] * 10)
+    flags = [f.anomaly_flags for f in history[20:]]
+    assert any(f & features.ANOMALY_SHIFT_DOWN for f in flags)
+    assert not any(f & features.ANOMALY_SHIFT_UP for f in flags)
+
+
+def test_frozen_scores_and_duration_violations():
+    feats = features.ServerFeatures()
+    for i in range(features.FROZEN_MIN_STREAK + 1):
+        feats = features.update(feats, _state(
+            i, 2,
+            a2s_player_name_ids=[1, 2],
+            a2s_player_scores=[10, 0],
+            # Player 2 duration goes back.
+            a2s_player_durations=[60.0 * i, 60.0 * (10 - i)],
+        ))
+    # Player 2 has a zero score, not counted as frozen.
+    assert feats.player_frozen == [features.FROZEN_MIN_STREAK, 0]
+    assert feats.frozen_score_ratio == 0.5
+    assert feats.duration_violation_ewma > 0.0
+
+
+def _batch(server_id: int, states: list[SimpleNamespace]) -> scoring.Batch:
+    rows = []
+    for state in states:
+        values = dict.fromkeys(scoring.INPUT_COLUMNS)
+        values.update(
+            time=state.time,
+            game_server_id=server_id,
+            players=state.players,
+            max_players=64,
+            a2s_info_responded=True,
+            a2s_player_count=state.players,
+            map="VNTE-CuChi",
+            a2s_map_name="VNTE-CuChi",
+            a2s_max_players=64,
+            a2s_rules_responded=True,
+            a2s_num_public_connections=64,
+            a2s_num_open_public_connections=64 - state.players,
+            a2s_pi_count=0,
+            a2s_pi_names=[],
+            a2s_pi_platforms=[],
+            a2s_pi_steam_count=0,
+            a2s_pi_eos_count=0,
+            a2s_mutators_running=[],
+            a2s_players_responded=False,
+            secure=True,
+        )
+        rows.append(("192.0.2.1", 7777, *values.values()))
+    return scoring.to_batch(rows)
+
+
+def test_split_batches_same_features():
+    rng = random.Random(1)
+    states = [_state(i, rng.randint(0, 64)) for i in range(40)]
+
+    whole: dict[int, features.ServerFeatures] = {}
+    whole_params = scoring.score(_batch(1, states), whole)
+
+    split: dict[int, features.ServerFeatures] = {}
+    split_params = (scoring.score(_batch(1, states[:17]), split)
+                    + scoring.score(_batch(1, states[17:]), split))
+
+    assert dataclasses.asdict(split[1]) == dataclasses.asdict(whole[1])
+    assert split_params == whole_params
+
+
+def test_server_partitions():
+    rows = [
+        SimpleNamespace(game_server_id=server_id, time=i)
+        for server_id, n in [(1, 3), (2, 1), (3, 4), (4, 1)]
+        for i in range(n)
+    ]
+    partitions = list(scoring.server_partitions(rows, 2))
+    assert [[r.game_server_id for r in p] for p in partitions] == [
+        [1, 1, 1],
+        [2, 3, 3, 3, 3],
+        [4],
+    ]
+    assert list(scoring.server_partitions([], 2)) == []
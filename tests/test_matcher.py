@@ -0,0 +1,79 @@
+import types
+
+from spoofspy.heuristics import matcher
+from spoofspy.heuristics.matcher import RuleSet
+
+BOTS_A = RuleSet("bots_a", matcher.KIND_BOT_NAME, 0, frozenset({"Bot", "Alpha"}))
+BOTS_B = RuleSet("bots_b", matcher.KIND_BOT_NAME, 1, frozenset({"Bot", "Beta"}))
+MUTS = RuleSet("muts", matcher.KIND_MUTATOR, 2, frozenset({"GOM.Mutator"}))
+
+
+def test_masks():
+    compiled = matcher.compile_rule_sets([BOTS_A, BOTS_B, MUTS])
+
+    assert compiled.bot_mask("Bot") == 0b011
+    assert compiled.bot_mask("Alpha") == 0b001
+    assert compiled.bot_mask("Beta") == 0b010
+    # Bot names are case sensitive.
+    assert compiled.bot_mask("bot") == 0
+    assert compiled.bot_mask(None) == 0
+
+
+def test_mutator_mask_case_insensitive():
+    compiled = matcher.compile_rule_sets([BOTS_A, MUTS])
+
+    assert compiled.mutator_mask(["Other", "gom.MUTATOR"]) == 0b100
+    assert compiled.mutator_mask(["Other"]) == 0
+    assert compiled.mutator_mask(None) == 0
+    # Mutator rule sets don't match bot names.
+    assert compiled.bot_mask("GOM.Mutator") == 0
+
+
+def test_values_of():
+    compiled = matcher.compile_rule_sets([BOTS_A, BOTS_B, MUTS])
+
+    assert sorted(compiled.bot_names_of(0)) == ["Alpha", "Bot"]
+    assert sorted(compiled.bot_names_of(1)) == ["Beta", "Bot"]
+    assert compiled.mutators_of(2) == ["gom.mutator"]
+    assert compiled.bot_names_of(2) == []
+
+
+class Session:
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def execute(self, _stmt):
+        return types.SimpleNamespace(
+            tuples=lambda: [(row.name, row.version) for row in self._rows])
+
+    def scalars(self, _stmt):
+        return self._rows
+
+
+def _stored(rule_set: RuleSet, version: int, entries) -> types.SimpleNamespace:
+    return types.SimpleNamespace(
+        name=rule_set.name,
+        kind=rule_set.kind,
+        bit=rule_set.bit,
+        version=version,
+        entries=entries,
+    )
+
+
+def test_refresh_replaces_defaults_by_name():
+    store = matcher.MatcherStore([BOTS_A, BOTS_B])
+    assert store.current.bot_mask("Alpha") == 0b001
+
+    session = Session([_stored(BOTS_A, 2, ["Gamma"])])
+    assert store.refresh(session)  # type: ignore[arg-type]
+    assert store.current.version == (("bots_a", 2),)
+    assert store.current.bot_mask("Alpha") == 0
+    assert store.current.bot_mask("Gamma") == 0b001
+    # Defaults not stored are kept.
+    assert store.current.bot_mask("Bot") == 0b010
+
+    # Unchanged versions don't recompile.
+    current = store.current
+    assert not store.refresh(session)  # type: ignore[arg-type]
+    assert store.current is current
@@ -0,0 +1,72 @@
+import threading
+from collections import Counter
+
+from sqlalchemy.dialects import postgresql
+
+from spoofspy import metrics
+from spoofspy.metrics.metrics import _upsert
+
+
+def test_incr_and_take():
+    counters = metrics.Counters()
+    counters.incr("a")
+    counters.incr("a", 2)
+    counters.incr("b")
+
+    assert counters.take() == {"a": 3, "b": 1}
+    assert counters.take() == {}
+
+
+def test_restore_merges_with_new_deltas():
+    counters = metrics.Counters()
+    counters.incr("a", 2)
+    deltas = counters.take()
+    counters.incr("a")
+    counters.incr("b")
+    counters.restore(deltas)
+
+    assert counters.take() == {"a": 3, "b": 1}
+
+
+def test_concurrent_incr():
+    counters = metrics.Counters()
+    taken = []
+
+    def incr():
+        for _ in range(10_000):
+            counters.incr("a")
+
+    def take():
+        for _ in range(100):
+            taken.append(counters.take()["a"])
+
+    threads = [threading.Thread(target=incr) for _ in range(4)]
+    threads.append(threading.Thread(target=take))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(taken) + counters.take()["a"] == 40_000
+
+
+class FailingSession:
+
+    def begin(self):
+        raise RuntimeError("no database")
+
+
+def test_failed_flush_restores_deltas():
+    counters = metrics.Counters()
+    counters.incr("a", 5)
+    metrics.flush(FailingSession(), counters)  # type: ignore[arg-type]
+    assert counters.take() == {"a": 5}
+
+
+def test_upsert_total_and_hour_buckets():
+    stmt = _upsert(Counter({"a": 1}))
+    params = stmt.compile(dialect=postgresql.dialect()).params
+    buckets = [v for k, v in params.items() if k.startswith("bucket")]
+    assert len(buckets) == 2
+    assert metrics.TOTAL_BUCKET in buckets
+    assert all(v == 1 for k, v in params.items() if k.startswith("value"))
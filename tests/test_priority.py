@@ -0,0 +1,89 @@
+import contextlib
+import ipaddress
+import types
+
+import pytest
+
+from spoofspy.jobs import tasks
+from spoofspy.web import GameServerResult
+
+NEW = ("192.0.2.1", 7777)
+KNOWN = ("192.0.2.2", 7777)
+
+
+@pytest.mark.parametrize("score, expected", [
+    (0.0, tasks.PRIORITY_LOW_TRUST_MIN),
+    (tasks.TRUST_CUTOFF / 3, 2),
+    (tasks.TRUST_CUTOFF, tasks.PRIORITY_LOW_TRUST_MAX),
+    # Clamped to the low trust range.
+    (1.0, tasks.PRIORITY_LOW_TRUST_MAX),
+])
+def test_low_trust_priority(score, expected):
+    assert tasks._probe_priority(KNOWN, set(), {KNOWN: score}, set()) == expected
+
+
+def test_new_server_first():
+    assert tasks._probe_priority(
+        NEW, {NEW}, {NEW: 1.0}, {NEW}) == tasks.PRIORITY_NEW_SERVER
+
+
+def test_default_priority():
+    assert tasks._probe_priority(
+        KNOWN, {NEW}, {}, set()) == tasks.PRIORITY_DEFAULT
+
+
+def test_volatile_priority():
+    assert tasks._probe_priority(
+        KNOWN, set(), {}, {KNOWN}) == tasks.PRIORITY_VOLATILE
+    # Lower trust priority is kept.
+    assert tasks._probe_priority(
+        KNOWN, set(), {KNOWN: 0.0}, {KNOWN}) == tasks.PRIORITY_LOW_TRUST_MIN
+    assert tasks._probe_priority(
+        KNOWN, set(), {KNOWN: 1.0}, {KNOWN}) == tasks.PRIORITY_VOLATILE
+
+
+class Session:
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def execute(self, _stmt):
+        return self._rows
+
+
+def test_dispatch_server_queries(monkeypatch):
+    rows = [
+        (1, ipaddress.IPv4Address(NEW[0]), NEW[1], True),
+        (2, ipaddress.IPv4Address(KNOWN[0]), KNOWN[1], False),
+    ]
+    session = types.SimpleNamespace(
+        begin=lambda: contextlib.nullcontext(Session(rows)))
+    monkeypatch.setattr(
+        tasks, "app", types.SimpleNamespace(db_session=session))
+    monkeypatch.setattr(tasks, "redis_client", lambda: None)
+    invalidated = []
+    monkeypatch.setattr(
+        tasks.rowcache, "invalidate",
+        lambda _r, table, addresses: invalidated.append((table, addresses)))
+    sent = []
+    monkeypatch.setattr(
+        tasks.query_server_state, "apply_async",
+        lambda args, **kwargs: sent.append((args, kwargs)))
+
+    tasks._dispatch_server_queries(
+        [
+            GameServerResult(addr=NEW[0], gameport=NEW[1], query_port=27015),
+            GameServerResult(addr=KNOWN[0], gameport=KNOWN[1], query_port=27015),
+        ],
+        {KNOWN: 0.0},
+        set(),
+    )
+
+    assert invalidated == [(tasks.rowcache.GAME_SERVER, [NEW[0]])]
+    by_addr = {args[0]["addr"]: (args, kwargs) for args, kwargs in sent}
+    new_args, new_kwargs = by_addr[NEW[0]]
+    assert new_args[1:] == (tasks.PRIORITY_NEW_SERVER, 1)
+    assert new_kwargs["priority"] == tasks.PRIORITY_NEW_SERVER
+    known_args, known_kwargs = by_addr[KNOWN[0]]
+    assert known_args[1:] == (tasks.PRIORITY_LOW_TRUST_MIN, 2)
+    assert known_kwargs["priority"] == tasks.PRIORITY_LOW_TRUST_MIN
@@ -0,0 +1,82 @@
+import ipaddress
+import random
+
+import numpy as np
+
+from spoofspy.heuristics import reputation
+from spoofspy.heuristics.reputation import Entry
+
+
+def _net(network: str) -> ipaddress.IPv4Network:
+    return ipaddress.IPv4Network(network)
+
+
+def test_flatten_overlapping():
+    starts, ends, multipliers = reputation._flatten([
+        (0, 9, 0.5),
+        (5, 14, 0.2),
+        (20, 29, 0.8),
+        (20, 24, 0.8),
+    ])
+    assert starts.tolist() == [0, 5, 20]
+    assert ends.tolist() == [4, 14, 29]
+    assert multipliers.tolist() == [0.5, 0.2, 0.8]
+
+
+def test_flatten_nested():
+    starts, ends, multipliers = reputation._flatten([
+        (0, 99, 0.5),
+        (10, 19, 0.0),
+    ])
+    assert starts.tolist() == [0, 10, 20]
+    assert ends.tolist() == [9, 19, 99]
+    assert multipliers.tolist() == [0.5, 0.0, 0.5]
+
+
+def test_flatten_empty():
+    for arr in reputation._flatten([]):
+        assert len(arr) == 0
+
+
+def test_port_entry_network():
+    index = reputation.ReputationIndex([
+        Entry(0.0, _net("10.0.0.0/8"), port=7777),
+        Entry(0.5, _net("10.1.0.0/16")),
+    ])
+    # Not expanded per address.
+    assert len(index) == 2
+    assert index.lookup(ipaddress.IPv4Address("10.2.3.4"), 7777) == 0.0
+    assert index.lookup(ipaddress.IPv4Address("10.2.3.4"), 7778) == 1.0
+    assert index.lookup(ipaddress.IPv4Address("10.1.3.4"), 7778) == 0.5
+    assert index.lookup(ipaddress.IPv4Address("11.0.0.0"), 7777) == 1.0
+
+
+def _random_entries(rng: random.Random, n: int) -> list[Entry]:
+    entries = []
+    for _ in range(n):
+        prefix = rng.randint(20, 32)
+        network = ipaddress.IPv4Network(
+            (rng.randrange(0xC0000000, 0xC0010000), prefix), strict=False)
+        port = rng.choice([None, 7777, 7778])
+        entries.append(Entry(rng.choice([0.0, 0.25, 0.5]), network, port))
+    return entries
+
+
+def test_lookup_batch_matches_lookup():
+    rng = random.Random(1)
+    index = reputation.ReputationIndex(_random_entries(rng, 50))
+    addresses = [rng.randrange(0xC0000000, 0xC0010000) for _ in range(5000)]
+    ports = [rng.choice([7777, 7778, 7779]) for _ in addresses]
+
+    expected = [
+        index.lookup(ipaddress.IPv4Address(addr), port)
+        for addr, port in zip(addresses, ports)
+    ]
+    assert index.lookup_batch(addresses, ports).tolist() == expected
+    # Some of each kind.
+    assert 0 < np.count_nonzero(np.asarray(expected) < 1.0) < len(expected)
+
+
+def test_lookup_batch_empty_index():
+    index = reputation.ReputationIndex([])
+    assert index.lookup_batch([1, 2], [7777, 7777]).tolist() == [1.0, 1.0]
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from spoofspy.heuristics import roster
+
+
+def _roster(rng: random.Random, n: int = 20) -> set[int]:
+    return set(rng.sample(range(1, 1_000_000), n))
+
+
+def test_jaccard_estimate():
+    hasher = roster.MinHasher(num_perm=256)
+    a = set(range(100))
+    b = set(range(50, 150))
+    estimate = roster.jaccard_estimate(hasher.signature(a), hasher.signature(b))
+    # Exact Jaccard similarity 50 / 150.
+    assert estimate == pytest.approx(1 / 3, abs=0.1)
+    assert roster.jaccard_estimate(
+        hasher.signature(a), hasher.signature(a)) == 1.0
+
+
+def test_signature_deterministic():
+    values = [5, 1, 3, 1]
+    assert (roster.MinHasher().signature(values)
+            == roster.MinHasher().signature(sorted(set(values)))).all()
+
+
+def test_cluster_similar_rosters():
+    rng = random.Random(1)
+    fake = _roster(rng)
+    # Mostly the same fake players, one differs.
+    similar = (fake - {min(fake)}) | {1_000_001}
+    rosters = [fake, similar, _roster(rng), _roster(rng)]
+
+    clusters = roster.cluster(["a", "b", "c", "d"], rosters)
+    assert [sorted(c) for c in clusters] == [["a", "b"]]
+
+
+def test_small_rosters_not_clustered():
+    small = set(range(roster.MIN_ROSTER_SIZE - 1))
+    assert roster.cluster(["a", "b"], [small, small]) == []
+
+
+def test_dissimilar_rosters_not_clustered():
+    rng = random.Random(2)
+    keys = list(range(50))
+    assert roster.cluster(keys, [_roster(rng) for _ in keys]) == []
+
+
+def test_large_bucket():
+    rng = random.Random(3)
+    fake = _roster(rng)
+    n = roster.MAX_PAIRWISE_BUCKET * 2
+    keys = list(range(n + 1))
+    rosters = [fake] * n + [_roster(rng)]
+
+    clusters = roster.cluster(keys, rosters)
+    assert [sorted(c) for c in clusters] == [list(range(n))]
@@ -0,0 +1,130 @@
+import asyncio
+import datetime
+
+import fakeredis
+import pytest
+
+from spoofspy import rowcache
+from spoofspy.rowcache.rowcache import _SET_IF_GENERATION
+from spoofspy.rowcache.rowcache import generation_key
+from spoofspy.rowcache.rowcache import key
+
+TABLE = rowcache.GAME_SERVER
+ADDR = "192.0.2.1"
+
+
+class Loader:
+
+    def __init__(self, on_load=None):
+        self.calls: list[list[str]] = []
+        self._on_load = on_load
+
+    async def __call__(self, addresses: list[str]) -> dict[str, list[dict]]:
+        self.calls.append(sorted(addresses))
+        if self._on_load is not None:
+            self._on_load()
+        return {
+            addr: [{"address": addr, "load": len(self.calls)}]
+            for addr in addresses if addr != "192.0.2.99"
+        }
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def r(server):
+    # Sync client of the ingest path.
+    return fakeredis.FakeRedis(server=server)
+
+
+def _cache(server) -> rowcache.RowCache:
+    return rowcache.RowCache(fakeredis.FakeAsyncRedis(server=server))
+
+
+def test_read_through(server, r):
+    async def run():
+        cache = _cache(server)
+        load = Loader()
+
+        rows = await cache.get_many(TABLE, [ADDR, "192.0.2.99"], load)
+        assert rows == {
+            ADDR: [{"address": ADDR, "load": 1}],
+            "192.0.2.99": [],
+        }
+        assert r.exists(key(TABLE, ADDR))
+        assert r.exists(key(TABLE, "192.0.2.99"))
+
+        # Local hit.
+        rows = await cache.get_many(TABLE, [ADDR], load)
+        assert rows == {ADDR: [{"address": ADDR, "load": 1}]}
+        # Redis hit of another process.
+        rows = await _cache(server).get_many(TABLE, [ADDR], load)
+        assert rows == {ADDR: [{"address": ADDR, "load": 1}]}
+        assert load.calls == [[ADDR, "192.0.2.99"]]
+
+    asyncio.run(run())
+
+
+def test_invalidate(server, r):
+    async def run():
+        load = Loader()
+        await _cache(server).get_many(TABLE, [ADDR], load)
+
+        rowcache.invalidate(r, TABLE, [ADDR])
+        k = key(TABLE, ADDR)
+        assert not r.exists(k)
+        assert r.get(generation_key(k)) == b"1"
+
+        rows = await _cache(server).get_many(TABLE, [ADDR], load)
+        assert rows[ADDR][0]["load"] == 2
+        assert r.exists(k)
+
+    asyncio.run(run())
+
+
+def test_invalidated_during_load_not_stored(server, r):
+    async def run():
+        cache = _cache(server)
+        load = Loader(lambda: rowcache.invalidate(r, TABLE, [ADDR]))
+
+        # Stale rows are returned but not cached.
+        rows = await cache.get_many(TABLE, [ADDR], load)
+        assert rows[ADDR][0]["load"] == 1
+        assert not r.exists(key(TABLE, ADDR))
+
+        load = Loader()
+        rows = await cache.get_many(TABLE, [ADDR], load)
+        assert rows[ADDR][0]["load"] == 1
+        assert load.calls == [[ADDR]]
+        assert r.exists(key(TABLE, ADDR))
+
+    asyncio.run(run())
+
+
+def test_set_if_generation(server, r):
+    k = key(TABLE, ADDR)
+    script = r.register_script(_SET_IF_GENERATION)
+
+    assert script(keys=[k, generation_key(k)], args=[b"a", 60, b""])
+    assert r.get(k) == b"a"
+
+    rowcache.invalidate(r, TABLE, [ADDR])
+    # Generation read before the invalidation.
+    assert not script(
+        keys=[k, generation_key(k)], args=[b"b", 60, b""])
+    assert not r.exists(k)
+    assert script(keys=[k, generation_key(k)], args=[b"c", 60, b"1"])
+    assert r.get(k) == b"c"
+
+
+def test_state_id():
+    time = datetime.datetime(
+        2024, 1, 1, 12, 30, 0, 123456,
+        tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    sid = rowcache.state_id(7, time)
+    assert sid == rowcache.state_id(
+        7, time.astimezone(datetime.timezone.utc))
+    assert rowcache.parse_state_id(sid) == (7, time)
@@ -0,0 +1,79 @@
+import fakeredis
+import pytest
+
+from spoofspy.web import BudgetExceededError
+from spoofspy.web import RequestScheduler
+
+CHUNKS = [b"first ", b"second ", b"third"]
+
+
+class Request:
+
+    def __init__(self, chunks: list[bytes] = CHUNKS):
+        self.chunks = chunks
+        self.calls = 0
+        self.read = 0
+
+    def __call__(self):
+        self.calls += 1
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def scheduler(r):
+    return RequestScheduler(r, api_key="key")
+
+
+def test_leader_yields_before_body_is_read(scheduler, r):
+    request = Request()
+    stream = scheduler.stream("req", request)
+
+    assert next(stream) == CHUNKS[0]
+    assert request.read < len(CHUNKS)
+    assert r.exists(scheduler._flight_key("req"))
+
+    assert list(stream) == CHUNKS[1:]
+    assert not r.exists(scheduler._flight_key("req"))
+
+
+def test_lock_released_before_last_chunk(scheduler, r):
+    stream = scheduler.stream("req", Request())
+    *_, last = [next(stream) for _ in CHUNKS]
+    assert last == CHUNKS[-1]
+    assert not r.exists(scheduler._flight_key("req"))
+
+
+def test_cached_response(scheduler):
+    request = Request()
+    assert scheduler.fetch("req", request) == b"".join(CHUNKS)
+    assert scheduler.fetch("req", request) == b"".join(CHUNKS)
+    assert request.calls == 1
+    assert scheduler.budget_used() == 1
+
+
+def test_abandoned_stream_is_not_cached(scheduler, r):
+    request = Request()
+    stream = scheduler.stream("req", request)
+    next(stream)
+    stream.close()
+
+    assert not r.exists(scheduler._flight_key("req"))
+    assert scheduler.fetch("req", request) == b"".join(CHUNKS)
+    assert request.calls == 2
+
+
+def test_budget_exceeded(r):
+    scheduler = RequestScheduler(r, api_key="key", daily_budget=1)
+    request = Request()
+    scheduler.fetch("a", request)
+    with pytest.raises(BudgetExceededError):
+        scheduler.fetch("b", request)
+    assert request.calls == 1
+    assert not r.exists(scheduler._flight_key("b"))
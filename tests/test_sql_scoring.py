@@ -0,0 +1,232 @@
+"""Parity of the in-database trust score functions with `scoring.score`.
+Needs DATABASE_URL of a database initialized with `db.drop_create_all`.
+Nothing is committed, generated rows and the functions are rolled back.
+"""
+
+import datetime
+import os
+import random
+from typing import Any
+
+import pytest
+
+if not os.environ.get("DATABASE_URL"):
+    pytest.skip("DATABASE_URL not set", allow_module_level=True)
+
+import sqlalchemy
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from spoofspy import db
+from spoofspy.heuristics import trust
+from spoofspy.jobs import scoring
+
+RANGE_START = datetime.datetime(2001, 1, 1, tzinfo=datetime.timezone.utc)
+RANGE_END = RANGE_START + datetime.timedelta(days=1)
+NUM_STATES = 2000
+TOLERANCE = 1e-9
+
+SERVERS = [
+    # Blacklisted by DEFAULT_REPUTATION_ENTRIES, by address
+    # and by address:port. The same address on another port
+    # is not blacklisted.
+    ("51.222.28.26", 7777),
+    ("62.102.148.162", 47411),
+    ("62.102.148.162", 7777),
+] + [
+    (f"192.0.2.{i}", 7777 + i)
+    for i in range(1, 30)
+]
+
+MAPS = ["VNTE-CuChi", "VNSU-AnLaoValley", "WWTE-Suomussalmi", "WWSU-Taipale"]
+PLAYER_NAMES = ["player", "Player 2", "xXx", "bob", "alice"]
+# Null unless the corresponding query responded.
+RESPONSE_COLUMNS = (
+    "a2s_map_name",
+    "a2s_player_count",
+    "a2s_max_players",
+    "a2s_num_public_connections",
+    "a2s_num_open_public_connections",
+    "a2s_pi_count",
+    "a2s_pi_names",
+    "a2s_pi_platforms",
+    "a2s_pi_steam_count",
+    "a2s_pi_eos_count",
+    "a2s_mutators_running",
+    "a2s_player_name_ids",
+)
+
+
+def _pi_names(rng: random.Random, bots: list[str], n: int) -> list[str]:
+    return [
+        rng.choice(bots) if (bots and rng.random() < 0.6)
+        else rng.choice(PLAYER_NAMES)
+        for _ in range(n)
+    ]
+
+
+def _state(
+        rng: random.Random,
+        time: datetime.datetime,
+        server_id: int,
+) -> dict[str, Any]:
+    compiled = trust.rules.current
+    kind = rng.choice(["plain", "ww", "gom3", "gom4"])
+    bots = {
+        "plain": [],
+        "ww": compiled.bot_names_of(trust.BOTS_WW),
+        "gom3": compiled.bot_names_of(trust.BOTS_RS2),
+        "gom4": compiled.bot_names_of(trust.BOTS_GOM4),
+    }[kind]
+    mutators = {
+        "plain": rng.choice([None, [], ["SomeMutator.u"]]),
+        "ww": rng.choice([None, []]),
+        # Mutators are matched case-insensitively.
+        "gom3": ["GOM3.u"],
+        "gom4": ["Other.u", "gom4.u"],
+    }[kind]
+
+    players = rng.randint(0, 64)
+    map_name = rng.choice(MAPS[2:] if kind == "ww" else MAPS)
+    state: dict[str, Any] = {
+        "time": time,
+        "game_server_id": server_id,
+        "players": players,
+        "max_players": 64,
+        "secure": rng.choice([True, False, None]),
+        "map": map_name,
+        "a2s_info_responded": rng.random() < 0.85,
+        "a2s_rules_responded": rng.random() < 0.85,
+        "a2s_players_responded": rng.random() < 0.85,
+        **dict.fromkeys(RESPONSE_COLUMNS),
+    }
+
+    if state["a2s_info_responded"]:
+        state["a2s_map_name"] = rng.choice([map_name, MAPS[0]])
+        state["a2s_player_count"] = max(0, players + rng.randint(-5, 30))
+        state["a2s_max_players"] = 64
+
+    if state["a2s_rules_responded"]:
+        num_pis = rng.randint(0, 70)
+        platforms = [rng.choice([0, 1, 1, 1, 2]) for _ in range(num_pis)]
+        pi_count = rng.randint(0, num_pis + 5)
+        npc = rng.randint(0, 64)
+        state["a2s_num_public_connections"] = npc
+        state["a2s_num_open_public_connections"] = rng.randint(0, npc)
+        state["a2s_pi_count"] = pi_count
+        state["a2s_pi_names"] = _pi_names(rng, bots, num_pis)
+        state["a2s_pi_platforms"] = platforms
+        # Null PI counts, e.g. states stored before the counts.
+        state["a2s_pi_steam_count"] = (
+            None if rng.random() < 0.2
+            else sum(1 for p in platforms[:pi_count] if p == 1))
+        state["a2s_pi_eos_count"] = (
+            None if rng.random() < 0.2
+            else sum(1 for p in platforms[:pi_count] if p == 2))
+        state["a2s_mutators_running"] = mutators
+
+    if state["a2s_players_responded"]:
+        state["a2s_player_name_ids"] = rng.choice([
+            None,
+            list(range(max(0, players + rng.randint(-10, 10)))),
+        ])
+
+    return state
+
+
+@pytest.fixture
+def session():
+    with Session(db.engine()) as sess:
+        yield sess
+        sess.rollback()
+
+
+def _insert_states(sess: Session, rng: random.Random) -> dict[tuple[str, int], int]:
+    stmt = pg_insert(db.models.GameServer).values([
+        {"address": addr, "port": port, "query_port": port + 19238}
+        for addr, port in SERVERS
+    ])
+    server_ids = {
+        (str(addr), port): server_id
+        for server_id, addr, port in sess.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["address", "port"],
+                set_={"query_port": stmt.excluded.query_port},
+            ).returning(
+                db.models.GameServer.id,
+                db.models.GameServer.address,
+                db.models.GameServer.port,
+            )
+        )
+    }
+
+    ids = list(server_ids.values())
+    sess.execute(
+        sqlalchemy.insert(db.models.GameServerState.__table__),
+        [
+            _state(
+                rng,
+                RANGE_START + datetime.timedelta(seconds=i),
+                ids[i % len(ids)],
+            )
+            for i in range(NUM_STATES)
+        ],
+    )
+    return server_ids
+
+
+def test_score_in_database_matches_python(session):
+    rng = random.Random(1)
+    server_ids = _insert_states(session, rng)
+    gss = db.models.GameServerState
+
+    batch = scoring.to_batch(session.execute(
+        scoring.input_stmt(
+            (gss.time >= RANGE_START)
+            & (gss.time < RANGE_END)
+            & gss.game_server_id.in_(server_ids.values())
+        )
+    ).all())
+    expected = {
+        (p["u_time"], p["u_game_server_id"]): p["trust_score"]
+        for p in scoring.score(batch)
+    }
+    assert len(expected) == NUM_STATES
+
+    session.execute(db.queries.trust_score_functions)
+    actual = {
+        (row.time, row.game_server_id): row.trust_score
+        for row in session.execute(
+            db.queries.score_in_database,
+            {
+                "range_start": RANGE_START,
+                "range_end": RANGE_END,
+                "last_time": None,
+                "last_game_server_id": None,
+                "batch_size": NUM_STATES * 10,
+                **scoring.sql_params(),
+            },
+        )
+        if row.game_server_id in server_ids.values()
+    }
+
+    assert actual.keys() == expected.keys()
+    mismatches = {
+        key: (score, actual[key])
+        for key, score in expected.items()
+        if abs(actual[key] - score) > TOLERANCE
+    }
+    assert not mismatches
+
+    # The generated states cover blacklisted servers
+    # and a range of partial scores.
+    blacklisted = {
+        server_ids[("51.222.28.26", 7777)],
+        server_ids[("62.102.148.162", 47411)],
+    }
+    assert all(
+        score == 0.0
+        for (_, server_id), score in expected.items()
+        if server_id in blacklisted
+    )
+    assert any(0.0 < score < 1.0 for score in expected.values())
@@ -0,0 +1,68 @@
+import time
+
+import orjson
+
+from spoofspy.web.stream import ServerObjectSplitter
+from spoofspy.web.stream import iter_server_objects
+
+SERVERS = [
+    {
+        "addr": "1.2.3.4:27015",
+        "gameport": 7777,
+        "name": "Rising Storm 2 Vietnam Server Name X",
+        "map": "VNTE-CuChi",
+    },
+    {
+        "addr": "5.6.7.8:27015",
+        "gameport": 7778,
+        # Structural characters and escapes inside strings.
+        "name": 'tricky {"name"} [x] \\ \\"}] äö',
+        "gametype": "ROGame.ROGameInfoTerritories",
+    },
+    {
+        "addr": "9.10.11.12:27015",
+        "gameport": 7779,
+        "name": "nested",
+        "extra": {"a": [1, {"b": "}"}], "c": {}},
+    },
+]
+
+BODY = orjson.dumps({"response": {"servers": SERVERS}})
+
+
+def _parse(chunks) -> list[dict]:
+    return [orjson.loads(obj) for obj in iter_server_objects(chunks)]
+
+
+def test_single_chunk():
+    assert _parse([BODY]) == SERVERS
+
+
+def test_split_at_every_offset():
+    for i in range(len(BODY) + 1):
+        assert _parse([BODY[:i], BODY[i:]]) == SERVERS, i
+
+
+def test_byte_by_byte():
+    assert _parse(BODY[i:i + 1] for i in range(len(BODY))) == SERVERS
+
+
+def test_stops_at_array_end():
+    body = orjson.dumps({"response": {"servers": SERVERS, "x": [{}]}})
+    assert _parse([body]) == SERVERS
+
+
+def test_empty_servers():
+    assert _parse([b'{"response": {"servers": []}}']) == []
+    assert _parse([b'{"response": {}}']) == []
+
+
+def test_long_incomplete_string():
+    splitter = ServerObjectSplitter()
+    start = time.monotonic()
+    list(splitter.feed(b'{"response": {"servers": [{"name": "'))
+    for _ in range(100):
+        assert not list(splitter.feed(b"a" * 100))
+    objs = list(splitter.feed(b'"}]}}'))
+    assert time.monotonic() - start < 1.0
+    assert [orjson.loads(obj) for obj in objs] == [{"name": "a" * 10_000}]